@@ -0,0 +1,4 @@
+"""Нагрузочные проверки и бенчмарки. Запускаются из корня проекта: python -m benchmarks.<имя>
+
+Требуют локальные postgres и redis из .env (не боевые!).
+"""
@@ -0,0 +1,382 @@
+"""Синтетический трафик бота: цепочки вызовов db_api и utils.cache на каждый апдейт без Telegram.
+
+Апдейты приходят открытым потоком с заданной частотой (пуассоновский поток, --rate апдейтов в секунду) и
+смесью --mix: /start по реферальной ссылке, сообщение в чат (модель по --models), /img и /reset. Дополнительно
+каждые --burst-every секунд приходит пачка из --burst одновременных /start, как после рассылки ссылки.
+Ответ нейросети подменяется задержкой (--llm-latency, --img-latency), поэтому замеряется только сам бот.
+
+Печатает задержку каждого шага (p50/p95/p99), долю ошибок, задержку event loop, загрузку пула соединений бд
+(get_pool_stats) и redis (операции в секунду, CPU, соединения клиента). Несколько значений --rate запускаются
+по очереди: по росту p95 и ожиданию пула видно предел одного процесса бота.
+
+    python -m benchmarks.bot_traffic --yes --rate 50 100 200 400 --duration 60 --output traffic.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+from uuid import uuid4
+
+from sqlalchemy import text
+
+from db_api import api_image_query_async, api_profile_async, api_text_query_async, async_engine_db, get_pool_stats
+from db_api.engine import pool_stats
+from services import redis
+from utils.cache import (create_ref_link, encode_profile, flush_quota, get_local_cache_stats, get_or_load_profile,
+                         get_session_id, reset_session, set_cache_profile, spend_quota)
+from utils.activity import track_active_profile
+from utils.context import get_context_messages, push_context_turn
+from utils.counters import add_click, flush_ref_counters
+from utils.enum import AiModelName
+from utils.generation_lock import GenerationLock, get_generation_lock_stats
+
+PREMIUM_SQL = """
+    UPDATE profile SET tariff_id = 2, date_subscription = now() + interval '30 days', chatgpt_4o_daily_limit = 100,
+                       chatgpt_o1_preview_daily_limit = 20, chatgpt_o1_mini_daily_limit = 60,
+                       mj_daily_limit_5_2 = 45, mj_daily_limit_6_0 = 20
+    WHERE tgid > :base AND tgid <= :base + :count AND (tgid - :base) % :every = 0
+"""
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def parse_weights(value: str) -> dict[str, float]:
+    """Разбери веса вида start=0.1,chat=0.8"""
+    weights = {}
+    for item in value.split(","):
+        name, weight = item.split("=")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+class FakeLLM:
+    """Подмена нейросети: отвечает через логнормальную задержку со средним latency секунд"""
+
+    def __init__(self, latency: float, answer_chars: int = 600):
+        self.latency = latency
+        self.answer_chars = answer_chars
+
+    async def complete(self, messages: list[dict[str, str]]) -> str:
+        if self.latency > 0:
+            await asyncio.sleep(random.lognormvariate(0, 0.5) * self.latency / 1.13)
+        return "ответ " * (self.answer_chars // 6)
+
+
+class Traffic:
+    """Генератор апдейтов и сборщик статистики одного прогона"""
+
+    def __init__(self, args, users: list[int], links: list[str]):
+        self.args = args
+        self.users = users
+        self.links = links
+        self.next_tgid = users[-1] + 1
+        self.mix = parse_weights(args.mix)
+        self.models = parse_weights(args.models)
+        self.llm = FakeLLM(args.llm_latency)
+        self.img = FakeLLM(args.img_latency, answer_chars=60)
+        self.steps = defaultdict(list)
+        self.outcomes = Counter()
+        self.errors = Counter()
+        self.in_flight = 0
+        self.in_flight_max = 0
+        self.tasks = set()
+
+    @asynccontextmanager
+    async def step(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps[name].append((time.perf_counter() - start) * 1000)
+
+    async def handle_start(self):
+        link = random.choice(self.links)
+        tgid = self.next_tgid
+        self.next_tgid += 1
+        async with self.step("start.add_click"):
+            link_id = await add_click(link)
+        async with self.step("start.upsert_profile"):
+            upserted = await api_profile_async.upsert_profile(tgid, f"load_{tgid}", "load", "user", "",
+                                                              referal_link_id=link_id)
+        async with self.step("start.set_cache_profile"):
+            await set_cache_profile(tgid, encode_profile(upserted.profile))
+        self.users.append(tgid)
+        return "registered" if upserted.is_created else "existing"
+
+    async def handle_chat(self):
+        model = random.choices(list(self.models), weights=list(self.models.values()))[0]
+        profile = await self._profile("chat")
+        async with self.step("chat.spend_quota"):
+            quota = await spend_quota(profile, model, add_request=True)
+        if not quota.is_spent:
+            return "limit"
+        async with self.step("chat.get_session_id"):
+            session_id = await get_session_id(profile, model)
+        async with GenerationLock(session_id) as acquired:
+            if not acquired:
+                return "busy"
+            async with self.step("chat.get_context_messages"):
+                messages = await get_context_messages(session_id, model)
+            query = f"вопрос {uuid4().hex[:8]}"
+            async with self.step("chat.create_text_query"):
+                text_query = await api_text_query_async.create_text_query(query, session_id)
+            async with self.step("chat.track_active_profile"):
+                await track_active_profile(profile.id)
+            answer = await self.llm.complete(messages + [{"role": "user", "content": query}])
+            async with self.step("chat.save_message"):
+                await api_text_query_async.save_message(answer, text_query.id)
+            async with self.step("chat.push_context_turn"):
+                await push_context_turn(session_id, query, answer, text_query.created_at)
+        return "answered"
+
+    async def handle_img(self):
+        model = AiModelName.MIDJOURNEY_6_0.value
+        profile = await self._profile("img")
+        async with self.step("img.spend_quota"):
+            quota = await spend_quota(profile, model, add_request=True)
+        if not quota.is_spent:
+            return "limit"
+        async with self.step("img.get_session_id"):
+            session_id = await get_session_id(profile, model)
+        async with self.step("img.create_image_query"):
+            image_query = await api_image_query_async.create_image_query("картинка", session_id, uuid4().hex)
+        async with self.step("img.track_active_profile"):
+            await track_active_profile(profile.id)
+        url = await self.img.complete([])
+        async with self.step("img.save_answer_query"):
+            await api_image_query_async.save_answer_query(url, image_query.id)
+        return "answered"
+
+    async def handle_reset(self):
+        profile = await self._profile("reset")
+        model = profile.ai_model_id
+        async with self.step("reset.get_session_id"):
+            session_id = await get_session_id(profile, model)
+        async with self.step("reset.reset_session"):
+            await reset_session(session_id, profile)
+        return "reset"
+
+    async def _profile(self, kind: str):
+        async with self.step(f"{kind}.get_or_load_profile"):
+            return await get_or_load_profile(random.choice(self.users))
+
+    async def update(self, kind: str):
+        self.in_flight += 1
+        self.in_flight_max = max(self.in_flight_max, self.in_flight)
+        start = time.perf_counter()
+        try:
+            outcome = await getattr(self, f"handle_{kind}")()
+            self.outcomes[f"{kind}.{outcome}"] += 1
+        except Exception as e:
+            self.errors[f"{kind}: {type(e).__name__}: {str(e)[:120]}"] += 1
+        finally:
+            self.steps[f"{kind}.total"].append((time.perf_counter() - start) * 1000)
+            self.in_flight -= 1
+
+    def spawn(self, kind: str):
+        task = asyncio.create_task(self.update(kind))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def produce(self, rate: float, duration: float):
+        """Открытый поток апдейтов: следующий приходит независимо от того, обработаны ли прошлые"""
+        kinds, weights = list(self.mix), list(self.mix.values())
+        end = time.perf_counter() + duration
+        next_burst = time.perf_counter() + self.args.burst_every if self.args.burst else end
+        while (now := time.perf_counter()) < end:
+            if now >= next_burst:
+                for _ in range(self.args.burst):
+                    self.spawn("start")
+                next_burst += self.args.burst_every
+            self.spawn(random.choices(kinds, weights=weights)[0])
+            await asyncio.sleep(random.expovariate(rate))
+
+
+class Sampler:
+    """Раз в interval секунд снимает задержку event loop, состояние пула бд и соединений redis"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.loop_lag = []
+        self.pool = []
+        self.redis_clients_in_use = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.loop_lag.append((time.perf_counter() - start - self.interval) * 1000)
+            self.pool.append(get_pool_stats())
+            in_use = getattr(redis.connection_pool, "_in_use_connections", ())
+            self.redis_clients_in_use.append(len(in_use))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+async def redis_counters() -> dict[str, float]:
+    """Счетчики сервера redis для расчета загрузки за прогон"""
+    info = await redis.info()
+    return {"commands": info["total_commands_processed"], "cpu": info["used_cpu_sys"] + info["used_cpu_user"],
+            "connected_clients": info["connected_clients"]}
+
+
+async def seed(args) -> tuple[list[int], list[str]]:
+    """Создай пользователей (каждый --premium-every с подпиской) и реферальные ссылки"""
+    base = random.randint(7 * 10 ** 12, 8 * 10 ** 12)
+    await api_profile_async.import_profiles(
+        [{"tgid": base + i, "username": f"load_{base + i}"} for i in range(1, args.users + 1)]
+    )
+    async with async_engine_db.begin() as conn:
+        await conn.execute(text(PREMIUM_SQL), {"base": base, "count": args.users, "every": args.premium_every})
+    owner = await api_profile_async.get_profile(base + 1)
+    links = [(await create_ref_link("load", owner.id)).link for _ in range(args.ref_links)]
+    return [base + i for i in range(1, args.users + 1)], links
+
+
+def summary(values: list[float]) -> dict[str, float]:
+    return {"count": len(values), "p50_ms": round(percentile(values, 0.50), 2),
+            "p95_ms": round(percentile(values, 0.95), 2), "p99_ms": round(percentile(values, 0.99), 2)}
+
+
+def stats_delta(after: dict, before: dict) -> dict:
+    """Прирост накопительных счетчиков за прогон. Размеры кэшей (size, maxsize) остаются текущими"""
+    delta = {}
+    for key, value in after.items():
+        if isinstance(value, dict):
+            delta[key] = stats_delta(value, before.get(key, {}))
+        elif key in ("size", "maxsize"):
+            delta[key] = value
+        else:
+            delta[key] = round(value - before.get(key, 0), 3)
+    return delta
+
+
+async def run_rate(args, users: list[int], links: list[str], rate: float) -> dict:
+    traffic = Traffic(args, users, links)
+    sampler = Sampler(args.sample_interval)
+    pool_before = get_pool_stats()
+    lock_before, local_cache_before = get_generation_lock_stats(), get_local_cache_stats()
+    waits_before, wait_time_before = pool_stats.waits, pool_stats.wait_time_total
+    pool_stats.wait_time_max = 0.0  # максимум ожидания считается заново для каждого прогона
+    redis_before = await redis_counters()
+    sampler.start()
+    start = time.perf_counter()
+    await traffic.produce(rate, args.duration)
+    offered = time.perf_counter() - start
+    if traffic.tasks:
+        await asyncio.wait(traffic.tasks, timeout=args.drain_timeout)
+    elapsed = time.perf_counter() - start
+    await sampler.stop()
+    redis_after = await redis_counters()
+    pool_after = get_pool_stats()
+
+    updates = sum(traffic.outcomes.values()) + sum(traffic.errors.values())
+    pool = sampler.pool or [pool_after]
+    return {
+        "rate": rate,
+        "offered_s": round(offered, 2),
+        "elapsed_s": round(elapsed, 2),
+        "updates": updates,
+        "throughput_ups": round(updates / elapsed, 1),
+        "unfinished": len(traffic.tasks),
+        "in_flight_max": traffic.in_flight_max,
+        "outcomes": dict(traffic.outcomes),
+        "errors": dict(traffic.errors),
+        "steps": {name: summary(values) for name, values in sorted(traffic.steps.items())},
+        "loop_lag": summary(sampler.loop_lag),
+        "db_pool": {
+            "size": pool_after["size"],
+            "checked_out_max": max(sample["checked_out"] for sample in pool),
+            "overflow_max": max(sample["overflow"] for sample in pool),
+            "checked_out_avg": round(statistics.mean(sample["checked_out"] for sample in pool), 1),
+            "checkouts": pool_after["checkouts"] - pool_before["checkouts"],
+            "connects": pool_after["connects"] - pool_before["connects"],
+            "wait_avg_ms": round((pool_stats.wait_time_total - wait_time_before)
+                                 / max(pool_stats.waits - waits_before, 1) * 1000, 3),
+            "wait_max_ms": round(pool_after["wait_max"] * 1000, 3),
+        },
+        "redis": {
+            "ops_per_s": round((redis_after["commands"] - redis_before["commands"]) / elapsed, 1),
+            "cpu_utilisation": round((redis_after["cpu"] - redis_before["cpu"]) / elapsed, 3),
+            "connected_clients": redis_after["connected_clients"],
+            "client_in_use_max": max(sampler.redis_clients_in_use, default=0),
+        },
+        "generation_lock": stats_delta(get_generation_lock_stats(), lock_before),
+        "local_cache": stats_delta(get_local_cache_stats(), local_cache_before),
+    }
+
+
+def print_report(report: dict):
+    print(f"\n=== {report['rate']} апд/с: {report['updates']} апдейтов за {report['elapsed_s']} с, "
+          f"{report['throughput_ups']} апд/с, в работе max {report['in_flight_max']}, "
+          f"не завершено {report['unfinished']}")
+    print(f"{'шаг':<42}{'кол-во':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, values in report["steps"].items():
+        print(f"{name:<42}{values['count']:>8}{values['p50_ms']:>10}{values['p95_ms']:>10}{values['p99_ms']:>10}")
+    print(f"исходы: {report['outcomes']}")
+    if report["errors"]:
+        print(f"ошибки: {report['errors']}")
+    print(f"event loop lag p99: {report['loop_lag']['p99_ms']} ms")
+    print(f"пул бд: {report['db_pool']}")
+    print(f"redis: {report['redis']}")
+
+
+async def main(args):
+    reports = []
+    try:
+        users, links = await seed(args)
+        for rate in args.rate:
+            report = await run_rate(args, users, links, rate)
+            print_report(report)
+            reports.append(report)
+        # Буферы лимитов и счетчиков ссылок сбрасываются после замеров, как это делают фоновые задачи
+        await flush_quota()
+        await flush_ref_counters()
+    finally:
+        await async_engine_db.dispose()
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"args": {key: value for key, value in vars(args).items() if key != "yes"},
+                       "runs": reports}, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--yes", action="store_true", help="подтверждение, что postgres и redis из .env тестовые")
+    parser.add_argument("--rate", type=float, nargs="+", default=[50.0], help="апдейтов в секунду")
+    parser.add_argument("--duration", type=float, default=30.0, help="секунд на каждое значение --rate")
+    parser.add_argument("--mix", default="start=0.05,chat=0.8,img=0.1,reset=0.05")
+    parser.add_argument("--models", default="gpt-4o-mini=0.7,gpt-4o=0.3", help="модели сообщений в чат")
+    parser.add_argument("--burst", type=int, default=50, help="/start в одной пачке, 0 - без пачек")
+    parser.add_argument("--burst-every", type=float, default=10.0)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--premium-every", type=int, default=5, help="каждый N-й пользователь с подпиской")
+    parser.add_argument("--ref-links", type=int, default=20)
+    parser.add_argument("--llm-latency", type=float, default=1.5, help="средняя задержка ответа модели, с")
+    parser.add_argument("--img-latency", type=float, default=8.0, help="средняя задержка генерации картинки, с")
+    parser.add_argument("--sample-interval", type=float, default=0.5)
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="сколько ждать незавершенные апдейты")
+    parser.add_argument("--output", help="куда сохранить JSON с результатом")
+    arguments = parser.parse_args()
+    if not arguments.yes:
+        sys.exit("Скрипт создает пользователей и пишет в postgres и redis из .env. Подтвердите флагом --yes")
+    asyncio.run(main(arguments))
@@ -0,0 +1,286 @@
+"""Микробенчмарки методов db_api на синтетических данных.
+
+Каждый метод вызывается --repeat раз после прогрева. Для вызова считаются время, число SQL запросов и
+число строк, которые вернула бд. Результат сохраняется в --results под хешем текущего коммита, чтобы
+сравнивать коммиты между собой: с --compare <коммит> (по умолчанию предыдущий сохраненный) печатается
+разница по медиане, и скрипт выходит с кодом 1, если медиана или число запросов выросли больше --max-regression
+процентов. Данные создаются benchmarks.synthetic_data, с --generate - прямо перед запуском в пустой базе.
+
+    python -m benchmarks.synthetic_data --yes --profiles 1000000 --messages 50000000
+    python -m benchmarks.db_api_bench --yes --repeat 20
+    python -m benchmarks.db_api_bench --yes --only ref_link --compare 67f149e
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Awaitable, Callable
+
+from sqlalchemy import event, text
+
+from benchmarks.synthetic_data import add_arguments, generate, is_empty, volumes
+from db_api import (api_chat_session_async, api_invoice_async, api_profile_async, api_ref_link_async,
+                    api_stat_async, api_tariff_async, api_text_query_async, async_engine_db)
+from utils.enum import PaymentName, Price
+
+TABLES = ("profile", "chat_session", "text_query", "image_query", "invoice", "ref_link")
+
+
+@dataclass
+class Case:
+    """Вызов метода db_api. prepare выполняется перед каждым вызовом и не входит в замер, его результат
+    передается в call"""
+    name: str
+    call: Callable[..., Awaitable]
+    prepare: Callable[[int], Awaitable] | None = None
+
+
+def cases(sample) -> list[Case]:
+    """Вызовы db_api на данных sample. Пишущие методы получают новые строки через prepare"""
+    profile = SimpleNamespace(id=sample.profile_id, tgid=sample.tgid, ai_model_id="gpt-4o-mini")
+    new_tgid = random.randint(6 * 10 ** 12, 7 * 10 ** 12)
+
+    async def new_invoice(i):
+        invoice = await api_invoice_async.create_invoice(sample.profile_id, 2, PaymentName.ROBOKASSA)
+        return invoice.id
+
+    async def new_text_query(i):
+        text_query = await api_text_query_async.create_text_query("вопрос", sample.session_id)
+        return text_query.id
+
+    async def next_tgid(i):
+        return new_tgid + i
+
+    robokassa = PaymentName.ROBOKASSA.name
+    return [
+        # ApiProfileAsync
+        Case("profile.get_profile", lambda: api_profile_async.get_profile(sample.tgid)),
+        Case("profile.get_profile_read", lambda: api_profile_async.get_profile_read(sample.tgid)),
+        Case("profile.check_have_profile", lambda: api_profile_async.check_have_profile(sample.tgid)),
+        Case("profile.upsert_profile.existing",
+             lambda: api_profile_async.upsert_profile(sample.tgid, None, "bench", "bench", "")),
+        Case("profile.upsert_profile.new",
+             lambda tgid: api_profile_async.upsert_profile(tgid, f"bench_{tgid}", "bench", "bench", "",
+                                                           referal_link_id=1),
+             prepare=next_tgid),
+        Case("profile.spend_quota", lambda: api_profile_async.spend_quota(sample.profile_id, "gpt-4o-mini")),
+        Case("profile.refresh_daily_limits", lambda: api_profile_async.refresh_daily_limits(sample.profile_id)),
+        Case("profile.update_subscription_profile",
+             lambda: api_profile_async.update_subscription_profile(sample.paid_profile_id, 2)),
+        Case("profile.get_admin_profiles", lambda: api_profile_async.get_admin_profiles()),
+        Case("profile.get_admin_profiles_read", lambda: api_profile_async.get_admin_profiles_read()),
+        Case("profile.get_count_profiles", lambda: api_profile_async.get_count_profiles()),
+        Case("profile.get_profiles_created_last_24_hours",
+             lambda: api_profile_async.get_profiles_created_last_24_hours()),
+        Case("profile.get_profiles_created_last_24_hours_with_ref",
+             lambda: api_profile_async.get_profiles_created_last_24_hours_with_ref()),
+        Case("profile.get_profiles_finish_sub", lambda: api_profile_async.get_profiles_finish_sub()),
+        Case("profile.expire_subscriptions", lambda: api_profile_async.expire_subscriptions(batch_size=100)),
+        # ApiChatSessionAsync
+        Case("chat_session.get_or_create_session_ref",
+             lambda: api_chat_session_async.get_or_create_session_ref(sample.profile_id, "gpt-4o-mini")),
+        Case("chat_session.get_or_create_session",
+             lambda: api_chat_session_async.get_or_create_session(profile, "gpt-4o-mini")),
+        Case("chat_session.get_text_messages_from_session",
+             lambda: api_chat_session_async.get_text_messages_from_session(sample.session_id, "gpt-4o-mini")),
+        Case("chat_session.get_last_turns", lambda: api_chat_session_async.get_last_turns(sample.session_id, 20)),
+        Case("chat_session.active_generic_in_session",
+             lambda: api_chat_session_async.active_generic_in_session(sample.session_id)),
+        Case("chat_session.get_count_query_for_day", lambda: api_chat_session_async.get_count_query_for_day()),
+        Case("chat_session.get_count_unique_profile_count_from_queries_for_24_hours",
+             lambda: api_chat_session_async.get_count_unique_profile_count_from_queries_for_24_hours()),
+        Case("chat_session.get_count_unique_profile_count_from_queries_for_month",
+             lambda: api_chat_session_async.get_count_unique_profile_count_from_queries_for_month()),
+        # ApiTextQueryAsync
+        Case("text_query.create_text_query",
+             lambda: api_text_query_async.create_text_query("вопрос", sample.session_id)),
+        Case("text_query.save_message", lambda query_id: api_text_query_async.save_message("ответ", query_id),
+             prepare=new_text_query),
+        Case("text_query.get_count_query_select_text_model_ai_for_day",
+             lambda: api_text_query_async.get_count_query_select_text_model_ai_for_day("gpt-4o")),
+        # ApiInvoiceAsync
+        Case("invoice.create_invoice",
+             lambda: api_invoice_async.create_invoice(sample.profile_id, 2, PaymentName.ROBOKASSA)),
+        Case("invoice.finalize_payment",
+             lambda invoice_id: api_invoice_async.finalize_payment(invoice_id, Price.RUB.value,
+                                                                   PaymentName.ROBOKASSA.value),
+             prepare=new_invoice),
+        Case("invoice.get_invoice_mother", lambda: api_invoice_async.get_invoice_mother(sample.paid_profile_id)),
+        Case("invoice.get_invoice", lambda: api_invoice_async.get_invoice(sample.paid_profile_id)),
+        Case("invoice.get_due_mother_invoices", lambda: api_invoice_async.get_due_mother_invoices(limit=1000)),
+        Case("invoice.get_count_sub", lambda: api_invoice_async.get_count_sub(robokassa)),
+        Case("invoice.get_count_sub_for_day", lambda: api_invoice_async.get_count_sub_for_day(robokassa)),
+        Case("invoice.get_number_of_renewals_profile", lambda: api_invoice_async.get_number_of_renewals_profile()),
+        # ApiRefLinkAsync
+        Case("ref_link.get_ref_link", lambda: api_ref_link_async.get_ref_link("bot?start=7")),
+        Case("ref_link.get_ref_link_id", lambda: api_ref_link_async.get_ref_link_id("bot?start=7")),
+        Case("ref_link.add_click", lambda: api_ref_link_async.add_click("bot?start=7")),
+        Case("ref_link.create_ref_link", lambda: api_ref_link_async.create_ref_link("bench", sample.profile_id)),
+        Case("ref_link.get_count_ref_links", lambda: api_ref_link_async.get_count_ref_links()),
+        Case("ref_link.get_ref_links_of_owner", lambda: api_ref_link_async.get_ref_links_of_owner(sample.profile_id)),
+        Case("ref_link.get_ref_links_stats", lambda: api_ref_link_async.get_ref_links_stats(limit=50)),
+        # ApiTariffAsync
+        Case("tariff.get_tariff", lambda: api_tariff_async.get_tariff(2)),
+        Case("tariff.get_tariff_read", lambda: api_tariff_async.get_tariff_read(2)),
+        Case("tariff.get_sum_payment_profile_for_ref_link",
+             lambda: api_tariff_async.get_sum_payment_profile_for_ref_link(1, robokassa)),
+        Case("tariff.get_sum_sub", lambda: api_tariff_async.get_sum_sub(robokassa)),
+        Case("tariff.get_sum_sub_for_day", lambda: api_tariff_async.get_sum_sub_for_day(robokassa)),
+        # ApiStatAsync
+        Case("stat.get_basic_stat", lambda: api_stat_async.get_basic_stat()),
+    ]
+
+
+def git_commit() -> tuple[str, bool]:
+    """Хеш текущего коммита и признак незакоммиченных изменений"""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], text=True))
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", True
+    return commit, dirty
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def get_sample():
+    """Пользователь с сессией gpt-4o-mini и пользователь с оплаченным материнским счетом"""
+    async with async_engine_db.connect() as conn:
+        return (await conn.execute(text(
+            """
+            SELECT p.tgid, p.id AS profile_id, cs.id AS session_id,
+                   (SELECT profile_id FROM invoice WHERE is_paid AND is_mother LIMIT 1) AS paid_profile_id
+            FROM profile p JOIN chat_session cs ON cs.profile_id = p.id AND cs.ai_model_id = 'gpt-4o-mini'
+            WHERE p.tgid = 40
+            """
+        ))).one()
+
+
+async def get_volumes() -> dict[str, int]:
+    """Примерное число строк в больших таблицах по статистике планировщика"""
+    async with async_engine_db.connect() as conn:
+        result = await conn.execute(text("SELECT relname, reltuples::bigint FROM pg_class WHERE relname = ANY(:tables)"),
+                                    {"tables": list(TABLES)})
+        return dict(result.all())
+
+
+async def run(args) -> dict[str, dict]:
+    sample = await get_sample()
+    counters = {"statements": 0, "rows": 0}
+    capturing = False
+
+    @event.listens_for(async_engine_db.sync_engine, "after_cursor_execute")
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if capturing:
+            counters["statements"] += 1
+            if cursor.description is not None and cursor.rowcount > 0:
+                counters["rows"] += cursor.rowcount
+
+    methods = {}
+    for case in cases(sample):
+        if args.only and not any(pattern in case.name for pattern in args.only):
+            continue
+        timings, statements, rows = [], [], []
+        for i in range(args.repeat + 1):
+            prepared = (await case.prepare(i),) if case.prepare else ()
+            counters.update(statements=0, rows=0)
+            capturing = True
+            start = time.perf_counter()
+            await case.call(*prepared)
+            elapsed = (time.perf_counter() - start) * 1000
+            capturing = False
+            if i == 0:
+                continue  # прогрев: кэш планов asyncpg и страниц postgres
+            timings.append(elapsed)
+            statements.append(counters["statements"])
+            rows.append(counters["rows"])
+        methods[case.name] = {
+            "median_ms": round(statistics.median(timings), 3),
+            "p95_ms": round(percentile(timings, 0.95), 3),
+            "min_ms": round(min(timings), 3),
+            "statements": round(statistics.mean(statements), 2),
+            "rows": round(statistics.mean(rows), 1),
+        }
+        print(f"  {case.name}: {methods[case.name]['median_ms']} ms, "
+              f"{methods[case.name]['statements']} запр., {methods[case.name]['rows']} строк")
+    event.remove(async_engine_db.sync_engine, "after_cursor_execute", count)
+    return methods
+
+
+def compare(methods: dict, baseline: dict, max_regression: float) -> bool:
+    """Напечатай разницу с прошлым запуском. Вернет False, если есть регрессия"""
+    ok = True
+    print(f"\nСравнение с {baseline['commit']} ({baseline['date']}):")
+    for name, result in methods.items():
+        before = baseline["methods"].get(name)
+        if before is None:
+            print(f"  {name}: новый")
+            continue
+        change = (result["median_ms"] - before["median_ms"]) / before["median_ms"] * 100 if before["median_ms"] else 0
+        regression = change > max_regression or result["statements"] > before["statements"]
+        ok &= not regression
+        print(f"{'REGRESSION' if regression else '          '} {name}: {before['median_ms']} -> "
+              f"{result['median_ms']} ms ({change:+.1f}%), запросов {before['statements']} -> {result['statements']}")
+    return ok
+
+
+async def main(args):
+    try:
+        if await is_empty():
+            if not args.generate:
+                sys.exit("База пустая. Запустите benchmarks.synthetic_data или передайте --generate")
+            await generate(volumes(args), args.chunk)
+        commit, dirty = git_commit()
+        methods = await run(args)
+        table_volumes = await get_volumes()
+    finally:
+        await async_engine_db.dispose()
+
+    results = {}
+    if os.path.exists(args.results):
+        with open(args.results) as file:
+            results = json.load(file)
+    key = f"{commit}-dirty" if dirty else commit
+    previous = [other for other in results if other != key]
+    baseline_key = args.compare or (previous[-1] if previous else None)
+    # Повторный запуск на том же коммите дополняет результаты, чтобы --only не стирал остальные методы
+    entry = results.pop(key, {"methods": {}})
+    results[key] = {"commit": key, "date": datetime.now().isoformat(timespec="seconds"), "volumes": table_volumes,
+                    "repeat": args.repeat, "methods": {**entry["methods"], **methods}}
+    with open(args.results, "w") as file:
+        json.dump(results, file, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {args.results} под {key}")
+
+    if baseline_key is None:
+        return
+    if baseline_key not in results:
+        sys.exit(f"Нет результатов для {baseline_key} в {args.results}")
+    if not compare(methods, results[baseline_key], args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--yes", action="store_true", help="подтверждение, что база из .env локальная и тестовая")
+    parser.add_argument("--generate", action="store_true", help="наполнить пустую базу перед запуском")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--only", nargs="*", help="запускать только методы, в названии которых есть подстрока")
+    parser.add_argument("--results", default="db_api_bench.json")
+    parser.add_argument("--compare", help="коммит для сравнения, по умолчанию предыдущий в --results")
+    parser.add_argument("--max-regression", type=float, default=20.0)
+    add_arguments(parser)
+    arguments = parser.parse_args()
+    if not arguments.yes:
+        sys.exit("Скрипт изменяет данные в базе из .env. Подтвердите флагом --yes")
+    asyncio.run(main(arguments))
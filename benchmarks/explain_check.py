@@ -0,0 +1,210 @@
+"""Проверка планов горячих запросов db_api: ни один из них не должен читать большие таблицы Seq Scan.
+
+Скрипт создает схему миграциями alembic в ПУСТОЙ локальной базе из .env (проверяются индексы миграций,
+а не models.py), наполняет ее синтетическими данными, вызывает методы db_api, перехватывает выполненный
+SQL и проверяет EXPLAIN каждого запроса.
+Выходит с кодом 1, если хотя бы один горячий запрос упал в последовательное сканирование.
+
+    python -m benchmarks.explain_check --yes
+"""
+import argparse
+import asyncio
+import json
+import sys
+from types import SimpleNamespace
+
+from sqlalchemy import event, inspect, text
+
+from benchmarks.synthetic_data import REFERENCE_SQL, migrate
+from db_api import (api_chat_session_async, api_invoice_async, api_profile_async, api_ref_link_async,
+                    api_stat_async, api_tariff_async, api_text_query_async, async_engine_db)
+from db_api.async_api import msk_today
+from utils.enum import PaymentName
+
+SEED_SQL = REFERENCE_SQL + (
+    # 10% пользователей с подпиской, из них истекших ~1%; регистрации равномерно за год
+    """
+    INSERT INTO profile (id, tgid, username, tariff_id, ai_model_id, date_subscription, chatgpt_4o_daily_limit,
+                         chatgpt_4o_mini_daily_limit, count_request, recurring, is_staff, is_admin, created_at)
+    SELECT gen_random_uuid(), g, 'user_' || g,
+           CASE WHEN g % 10 = 0 THEN 2 ELSE 1 END, 'gpt-4o-mini',
+           CASE WHEN g % 100 = 0 THEN now() - interval '1 day'
+                WHEN g % 10 = 0 THEN now() + (g % 30 + 1) * interval '1 day' END,
+           CASE WHEN g % 10 = 0 THEN 100 ELSE 0 END, -1, g % 500, g % 20 = 0, false, g % 10000 = 0,
+           now() - (g % 365) * interval '1 day' - (g % 1440) * interval '1 minute'
+    FROM generate_series(1, :profiles) AS g
+    """,
+    """
+    INSERT INTO ref_link (id, name, link, owner_id, count_clicks, count_buys, count_new_users, sum_buys_rub,
+                          sum_buys_stars)
+    SELECT g, 'link ' || g, 'bot?start=' || g, p.id, 0, 0, 0, 0, 0
+    FROM generate_series(1, :ref_links) AS g JOIN profile p ON p.tgid = g
+    """,
+    "SELECT setval(pg_get_serial_sequence('ref_link', 'id'), :ref_links)",
+    "UPDATE profile SET referal_link_id = tgid % :ref_links + 1 WHERE tgid % 5 = 0",
+    """
+    INSERT INTO chat_session (name, ai_model_id, profile_id, active_generation)
+    SELECT 'Новый диалог 1', m.code, p.id, false
+    FROM profile p CROSS JOIN (VALUES ('gpt-4o-mini'), ('gpt-4o'), ('mj-6-0')) AS m(code)
+    WHERE m.code = 'gpt-4o-mini' OR p.tgid % 4 = 0
+    """,
+    # Активность с перекосом: у каждой восьмой сессии в 10 раз больше сообщений, история за 90 дней
+    """
+    INSERT INTO text_query (id, chat_session_id, query, answer, status, created_at)
+    SELECT gen_random_uuid(), cs.id, 'вопрос ' || g, 'ответ ' || g, 'finish',
+           now() - random() * interval '90 days'
+    FROM chat_session cs
+    JOIN generate_series(1, :messages_per_session * 10) AS g
+      ON g <= CASE WHEN cs.id % 8 = 0 THEN :messages_per_session * 10 ELSE :messages_per_session END
+    WHERE cs.ai_model_id <> 'mj-6-0'
+    """,
+    """
+    INSERT INTO image_query (id, chat_session_id, query, answer, jobid, status, created_at)
+    SELECT gen_random_uuid(), cs.id, 'картинка ' || g, 'https://cdn/' || g, md5(g::text), 'finish',
+           now() - random() * interval '90 days'
+    FROM chat_session cs CROSS JOIN generate_series(1, :messages_per_session) AS g
+    WHERE cs.ai_model_id = 'mj-6-0'
+    """,
+    """
+    INSERT INTO invoice (profile_id, is_paid, tariff_id, provider, is_mother, created_at)
+    SELECT p.id, g % 3 <> 0, 2, CASE WHEN g % 4 = 0 THEN 'STARS' ELSE 'ROBOKASSA' END::paymentname,
+           g % 6 = 1, now() - (g % 180) * interval '1 day'
+    FROM profile p CROSS JOIN generate_series(1, 3) AS g
+    WHERE p.tgid % 10 = 0
+    """,
+    "ANALYZE",
+)
+
+# Таблицы, которые не должны читаться Seq Scan. Маленькие справочники (tariff, ai_model) не проверяются.
+BIG_TABLES = {"profile", "chat_session", "text_query", "image_query", "invoice", "ref_link"}
+
+
+def hot_queries(sample) -> list[tuple[str, callable, set[str]]]:
+    """Горячие вызовы db_api: (название, фабрика корутины, таблицы без Seq Scan)"""
+    profile = SimpleNamespace(id=sample.profile_id, tgid=sample.tgid, ai_model_id="gpt-4o-mini")
+    return [
+        ("profile.get_profile_read", lambda: api_profile_async.get_profile_read(sample.tgid), {"profile"}),
+        ("profile.expire_subscriptions", lambda: api_profile_async.expire_subscriptions(batch_size=100),
+         {"profile"}),
+        ("profile.get_profiles_created_last_24_hours",
+         lambda: api_profile_async.get_profiles_created_last_24_hours(), {"profile"}),
+        ("profile.get_profiles_created_last_24_hours_with_ref",
+         lambda: api_profile_async.get_profiles_created_last_24_hours_with_ref(), {"profile"}),
+        ("profile.get_admin_profiles_read", lambda: api_profile_async.get_admin_profiles_read(), {"profile"}),
+        ("chat_session.get_or_create_session",
+         lambda: api_chat_session_async.get_or_create_session(profile, "gpt-4o-mini"),
+         {"chat_session", "text_query", "image_query"}),
+        ("chat_session.get_or_create_session_ref",
+         lambda: api_chat_session_async.get_or_create_session_ref(sample.profile_id, "gpt-4o-mini"),
+         {"chat_session"}),
+        ("chat_session.get_text_messages_from_session",
+         lambda: api_chat_session_async.get_text_messages_from_session(sample.session_id, "gpt-4o-mini"),
+         {"chat_session", "text_query"}),
+        ("chat_session.get_last_turns",
+         lambda: api_chat_session_async.get_last_turns(sample.session_id, 20), {"text_query"}),
+        ("chat_session.get_count_query_for_day",
+         lambda: api_chat_session_async.get_count_query_for_day(), {"text_query", "image_query"}),
+        ("chat_session.get_count_unique_profile_count_from_queries_for_24_hours",
+         lambda: api_chat_session_async.get_count_unique_profile_count_from_queries_for_24_hours(),
+         {"text_query", "image_query"}),
+        ("text_query.get_count_query_select_text_model_ai_for_day",
+         lambda: api_text_query_async.get_count_query_select_text_model_ai_for_day("gpt-4o"), {"text_query"}),
+        ("invoice.get_invoice_mother", lambda: api_invoice_async.get_invoice_mother(sample.paid_profile_id),
+         {"invoice"}),
+        ("invoice.get_count_sub_for_day",
+         lambda: api_invoice_async.get_count_sub_for_day(PaymentName.ROBOKASSA.name), {"invoice"}),
+        ("tariff.get_sum_sub_for_day",
+         lambda: api_tariff_async.get_sum_sub_for_day(PaymentName.ROBOKASSA.name), {"invoice"}),
+        ("ref_link.get_ref_link_id", lambda: api_ref_link_async.get_ref_link_id("bot?start=7"), {"ref_link"}),
+        ("ref_link.get_ref_links_of_owner", lambda: api_ref_link_async.get_ref_links_of_owner(sample.profile_id),
+         {"ref_link"}),
+        ("ref_link.get_ref_links_stats", lambda: api_ref_link_async.get_ref_links_stats(limit=50),
+         {"profile", "invoice"}),
+        ("stat.refresh_daily_stats", lambda: api_stat_async.refresh_daily_stats(msk_today()),
+         {"profile", "text_query", "image_query", "invoice"}),
+        ("stat.get_basic_stat", lambda: api_stat_async.get_basic_stat(), set()),
+    ]
+
+
+def seq_scans(plan: dict) -> set[str]:
+    """Собери таблицы, которые читаются Seq Scan в плане"""
+    tables = set()
+    if plan.get("Node Type") == "Seq Scan":
+        tables.add(plan.get("Relation Name"))
+    for child in plan.get("Plans", []):
+        tables |= seq_scans(child)
+    return tables
+
+
+async def prepare(args):
+    """Создай схему и наполни базу, если она пустая"""
+    async with async_engine_db.connect() as conn:
+        tables = await conn.run_sync(lambda sync_conn: inspect(sync_conn).get_table_names())
+    if "profile" in tables:
+        if not args.reuse:
+            sys.exit("База уже содержит таблицы. Запустите на пустой базе или передайте --reuse")
+        return
+    await migrate()
+    async with async_engine_db.begin() as conn:
+        params = {"profiles": args.profiles, "ref_links": args.ref_links,
+                  "messages_per_session": args.messages_per_session}
+        for statement in SEED_SQL:
+            clause = text(statement)
+            await conn.execute(clause, {key: value for key, value in params.items()
+                                        if f":{key}" in statement})
+
+
+async def main(args):
+    await prepare(args)
+    async with async_engine_db.connect() as conn:
+        sample = (await conn.execute(text(
+            """
+            SELECT p.tgid, p.id AS profile_id, cs.id AS session_id,
+                   (SELECT profile_id FROM invoice WHERE is_paid AND is_mother LIMIT 1) AS paid_profile_id
+            FROM profile p JOIN chat_session cs ON cs.profile_id = p.id AND cs.ai_model_id = 'gpt-4o-mini'
+            WHERE p.tgid = 40
+            """
+        ))).one()
+
+    captured = []
+    capturing = False
+
+    @event.listens_for(async_engine_db.sync_engine, "before_cursor_execute")
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if capturing and not executemany:
+            captured.append((statement, parameters))
+
+    failed = False
+    for name, factory, tables in hot_queries(sample):
+        captured.clear()
+        capturing = True
+        await factory()
+        capturing = False
+        for statement, parameters in captured:
+            if not statement.lstrip().upper().startswith(("SELECT", "UPDATE", "INSERT", "DELETE", "WITH")):
+                continue
+            async with async_engine_db.connect() as conn:
+                result = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters)
+                plan = result.scalar()
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            bad = seq_scans(plan[0]["Plan"]) & tables & BIG_TABLES
+            failed |= bool(bad)
+            print(f"{'FAIL' if bad else 'ok  '} {name}: {', '.join(sorted(bad)) or 'index scans only'}")
+            if bad and args.verbose:
+                print(f"     {statement}")
+    await async_engine_db.dispose()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--yes", action="store_true", help="подтверждение, что база из .env локальная и тестовая")
+    parser.add_argument("--reuse", action="store_true", help="не наполнять базу, если схема уже есть")
+    parser.add_argument("--profiles", type=int, default=50000)
+    parser.add_argument("--ref-links", type=int, default=500)
+    parser.add_argument("--messages-per-session", type=int, default=4)
+    parser.add_argument("--verbose", action="store_true")
+    arguments = parser.parse_args()
+    if not arguments.yes:
+        sys.exit("Скрипт создает таблицы и данные в базе из .env. Подтвердите флагом --yes")
+    asyncio.run(main(arguments))
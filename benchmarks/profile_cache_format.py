@@ -0,0 +1,92 @@
+"""Сравнение старого json формата кэша профиля с компактным версионированным форматом.
+
+Не требует бд и redis: тариф и модель кладутся в локальный реестр напрямую.
+
+    python -m benchmarks.profile_cache_format --number 20000
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+from db_api.models import AiModel, Profile, Tariff
+from db_api.schemas import AiModelRead, TariffRead
+from utils.cache import ai_model_local_cache, decode_profile, encode_profile, tariff_local_cache
+from utils.enum import TariffCode
+
+
+def make_profile() -> Profile:
+    now = datetime.utcnow()
+    tariff = Tariff(id=2, name="Premium", code=TariffCode.PREMIUM, description="Подписка Plus",
+                    chatgpt_4o_daily_limit=100, chatgpt_4o_mini_daily_limit=-1, midjourney_6_0_daily_limit=20,
+                    midjourney_5_2_daily_limit=45, chatgpt_o1_preview_daily_limit=20, chatgpt_o1_mini_daily_limit=60,
+                    days=30, price_rub=489, price_stars=190, is_active=True, created_at=now, updated_at=now)
+    ai_model = AiModel(code="gpt-4o", name="GPT-4o", type="text", is_active=True, created_at=now, updated_at=now)
+    return Profile(
+        id=uuid.uuid4(), tgid=5234567890, username="some_username", first_name="Иван", last_name="Петров",
+        email=None, url_telegram="https://t.me/some_username", tariff_id=2, ai_model_id="gpt-4o",
+        date_subscription=now + timedelta(days=30), chatgpt_4o_daily_limit=87, chatgpt_4o_mini_daily_limit=-1,
+        chatgpt_o1_preview_daily_limit=20, chatgpt_o1_mini_daily_limit=60, mj_daily_limit_5_2=45,
+        mj_daily_limit_6_0=20, count_request=1532, recurring=True, referal_link_id=12,
+        limits_reset_date=date.today(), is_staff=False, is_admin=False, created_at=now, updated_at=now,
+        tariffs=tariff, ai_models_id=ai_model,
+    )
+
+
+def old_decode(value: str) -> Profile:
+    """Прежняя десериализация (utils.cache.deserialization_profile до смены формата)"""
+    profile_data = json.loads(value)
+    profile_data["tariffs"] = Tariff(**profile_data["tariffs"])
+    profile_data["ai_models_id"] = AiModel(**profile_data["ai_models_id"])
+    return Profile(**profile_data)
+
+
+def timeit(func, number: int) -> float:
+    """Среднее время вызова в микросекундах"""
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return (time.perf_counter() - start) / number * 1e6
+
+
+async def async_timeit(func, number: int) -> float:
+    """Среднее время вызова корутины в микросекундах"""
+    start = time.perf_counter()
+    for _ in range(number):
+        await func()
+    return (time.perf_counter() - start) / number * 1e6
+
+
+async def main(number: int):
+    profile = make_profile()
+    tariff = profile.tariffs
+    tariff_local_cache.set(2, TariffRead(**{column.key: getattr(tariff, column.key)
+                                            for column in Tariff.__table__.columns}), ttl=3600)
+    ai_model = profile.ai_models_id
+    ai_model_local_cache.set("all", {"gpt-4o": AiModelRead(**{column.key: getattr(ai_model, column.key)
+                                                              for column in AiModel.__table__.columns})}, ttl=3600)
+
+    old_value = json.dumps(profile.to_dict())
+    new_value = encode_profile(profile)
+    results = {
+        "json": {
+            "bytes": len(old_value.encode()),
+            "encode_us": timeit(lambda: json.dumps(profile.to_dict()), number),
+            "decode_us": timeit(lambda: old_decode(old_value), number),
+        },
+        f"v{new_value[0]}": {
+            "bytes": len(new_value.encode()),
+            "encode_us": timeit(lambda: encode_profile(profile), number),
+            "decode_us": await async_timeit(lambda: decode_profile(new_value), number),
+        },
+    }
+    assert (await decode_profile(new_value)).chatgpt_o1_mini_daily_limit == 60
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=20000)
+    asyncio.run(main(parser.parse_args().number))
@@ -0,0 +1,80 @@
+"""Стоимость создания и память на пользователя: ORM Profile против ProfileRead.
+
+Не требует бд: строка запроса имитируется кортежем в порядке колонок PROFILE_READ_COLUMNS.
+
+    python -m benchmarks.profile_read_model --number 100000
+"""
+import argparse
+import json
+import time
+import tracemalloc
+import uuid
+from datetime import date, datetime, timedelta
+
+from db_api.models import AiModel, Profile, Tariff
+from db_api.schemas import (ProfileRead, PROFILE_READ_COLUMNS, TARIFF_READ_COLUMNS, AI_MODEL_READ_COLUMNS)
+from utils.enum import TariffCode
+
+
+def make_row() -> tuple:
+    """Строка запроса ApiProfileAsync._select_profile_read"""
+    now = datetime.utcnow()
+    profile = {
+        "id": uuid.uuid4(), "tgid": 5234567890, "username": "some_username", "first_name": "Иван",
+        "last_name": "Петров", "email": None, "url_telegram": "https://t.me/some_username", "tariff_id": 2,
+        "ai_model_id": "gpt-4o", "date_subscription": now + timedelta(days=30), "chatgpt_4o_daily_limit": 87,
+        "chatgpt_4o_mini_daily_limit": -1, "chatgpt_o1_preview_daily_limit": 20, "chatgpt_o1_mini_daily_limit": 60,
+        "mj_daily_limit_5_2": 45, "mj_daily_limit_6_0": 20, "count_request": 1532, "limits_reset_date": date.today(),
+        "recurring": True, "referal_link_id": 12, "is_staff": False, "is_admin": False, "created_at": now,
+        "updated_at": now,
+    }
+    tariff = {
+        "id": 2, "name": "Premium", "code": TariffCode.PREMIUM, "description": "Подписка Plus",
+        "chatgpt_4o_daily_limit": 100, "chatgpt_4o_mini_daily_limit": -1, "midjourney_6_0_daily_limit": 20,
+        "midjourney_5_2_daily_limit": 45, "chatgpt_o1_preview_daily_limit": 20, "chatgpt_o1_mini_daily_limit": 60,
+        "days": 30, "price_rub": 489, "price_stars": 190, "is_active": True, "created_at": now, "updated_at": now,
+    }
+    ai_model = {"code": "gpt-4o", "name": "GPT-4o", "type": "text", "is_active": True, "created_at": now,
+                "updated_at": now}
+    return (
+        tuple(profile[column.key] for column in PROFILE_READ_COLUMNS)
+        + tuple(tariff[column.key] for column in TARIFF_READ_COLUMNS)
+        + tuple(ai_model[column.key] for column in AI_MODEL_READ_COLUMNS)
+    )
+
+
+def build_orm(row: tuple) -> Profile:
+    """Обьект Profile с тарифом и моделью, как раньше собирался из кэша"""
+    profile_count, tariff_count = len(PROFILE_READ_COLUMNS), len(TARIFF_READ_COLUMNS)
+    tariff = Tariff(**{c.key: v for c, v in zip(TARIFF_READ_COLUMNS, row[profile_count:])})
+    ai_model = AiModel(**{c.key: v for c, v in zip(AI_MODEL_READ_COLUMNS, row[profile_count + tariff_count:])})
+    return Profile(**{c.key: v for c, v in zip(PROFILE_READ_COLUMNS, row)}, tariffs=tariff, ai_models_id=ai_model)
+
+
+def measure(build, row: tuple, number: int) -> dict:
+    start = time.perf_counter()
+    for _ in range(number):
+        build(row)
+    construct_us = (time.perf_counter() - start) / number * 1e6
+
+    tracemalloc.start()
+    objects = [build(row) for _ in range(number)]
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return {"construct_us": round(construct_us, 3), "bytes_per_user": memory // number}
+
+
+def main(number: int):
+    row = make_row()
+    results = {
+        "orm_profile": measure(build_orm, row, number),
+        "profile_read": measure(ProfileRead.from_row, row, number),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=100000)
+    main(parser.parse_args().number)
@@ -0,0 +1,116 @@
+"""Нагрузочная проверка рекуррентных списаний на локальной заглушке Robokassa Recurring.
+
+Поднимает aiohttp-сервер с задержкой ответа и долей ошибок 5xx, затем отправляет --renewals списаний
+через RecurringBilling (общий пул соединений) и, для сравнения, старым способом: новый ClientSession
+на каждое списание. База данных и redis не нужны.
+
+    python -m benchmarks.recurring_billing --renewals 5000 --concurrency 50
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import Counter
+
+from aiohttp import ClientSession, web
+
+from services import robokassa_obj
+from services.recurring import RecurringBilling
+
+
+def make_app(latency: float, error_rate: float, stats: Counter) -> web.Application:
+    """Заглушка эндпоинта Recurring: отвечает OK<InvoiceID> после задержки или 503 с вероятностью error_rate"""
+    peers = set()
+
+    async def recurring(request: web.Request) -> web.Response:
+        peers.add(request.transport.get_extra_info("peername"))
+        stats["connections"] = len(peers)
+        stats["requests"] += 1
+        data = await request.post()
+        await asyncio.sleep(latency * (0.5 + random.random()))
+        if random.random() < error_rate:
+            return web.Response(status=503, text="busy")
+        return web.Response(text=f"OK{data['invoiceID']}")
+
+    app = web.Application()
+    app.router.add_post("/Merchant/Recurring", recurring)
+    return app
+
+
+def charges(count: int) -> list[dict]:
+    return [
+        {"invoice_id": 10 ** 6 + i, "mother_invoice_id": i, "user_id": i, "price": 489, "desc": "Premium"}
+        for i in range(count)
+    ]
+
+
+async def run_pooled(url: str, args) -> tuple[float, list]:
+    start = time.perf_counter()
+    async with RecurringBilling(robokassa_obj, concurrency=args.concurrency, timeout=args.timeout,
+                                retries=args.retries, backoff=0.05, url=url) as billing:
+        outcomes = await billing.charge_all(charges(args.renewals))
+    return time.perf_counter() - start, outcomes
+
+
+async def run_session_per_charge(url: str, args) -> float:
+    """Старый async_recurring_request: новый ClientSession на каждое списание, без повторов"""
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def charge(charge_args: dict):
+        data = robokassa_obj.gen_payment_data(user_id=charge_args["user_id"], inv_id=charge_args["invoice_id"],
+                                              price=charge_args["price"], tariff_desc=charge_args["desc"],
+                                              mother_inv_id=charge_args["mother_invoice_id"], recurring=True)
+        async with semaphore:
+            async with ClientSession() as session:
+                async with session.post(url=url, data=data) as response:
+                    await response.text()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(charge(charge_args) for charge_args in charges(args.renewals)))
+    return time.perf_counter() - start
+
+
+async def serve(args, stats: Counter) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(make_app(args.latency_ms / 1000, args.error_rate, stats), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/Merchant/Recurring"
+
+
+async def main(args):
+    stats = Counter()
+    runner, url = await serve(args, stats)
+    try:
+        elapsed, outcomes = await run_pooled(url, args)
+        statuses = Counter(outcome.status.value for outcome in outcomes)
+        latencies = sorted(outcome.elapsed * 1000 for outcome in outcomes)
+        print(f"pooled:            {args.renewals} charges in {elapsed:.2f}s ({args.renewals / elapsed:.0f}/s), "
+              f"connections {stats['connections']}, requests {stats['requests']}, {dict(statuses)}")
+        print(f"                   p50 {statistics.median(latencies):.0f}ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.0f}ms")
+        if not args.skip_baseline:
+            stats.clear()
+            runner_baseline, url_baseline = await serve(args, stats)
+            try:
+                elapsed = await run_session_per_charge(url_baseline, args)
+            finally:
+                await runner_baseline.cleanup()
+            print(f"session per charge: {args.renewals} charges in {elapsed:.2f}s ({args.renewals / elapsed:.0f}/s), "
+                  f"connections {stats['connections']}, no retries")
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--renewals", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--timeout", type=float, default=5)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--skip-baseline", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,71 @@
+"""Проверка идемпотентности /result при одновременных повторных колбэках Robokassa.
+
+Создает пользователя с реферальной ссылкой и счет, затем отправляет --duplicates одинаковых
+подписанных колбэков одновременно, обрабатывает outbox и проверяет, что подписка и статистика ссылки
+учтены один раз.
+
+    python -m benchmarks.result_callbacks --yes --duplicates 50
+"""
+import argparse
+import asyncio
+import random
+import sys
+
+import httpx
+from sqlalchemy import select
+
+from db_api import api_invoice_async, api_profile_async, async_engine_db
+from db_api.engine import async_session_db
+from db_api.models import Invoice, RefLink
+from main import app
+from services import robokassa_obj
+from services.jobs import dispatch_outbox_job
+from utils.cache import create_ref_link
+from utils.enum import PaymentName, Price
+
+
+async def seed():
+    """Создай владельца ссылки, пользователя по ссылке и неоплаченный счет"""
+    owner_tgid, user_tgid = random.randint(10 ** 12, 2 * 10 ** 12), random.randint(2 * 10 ** 12, 3 * 10 ** 12)
+    owner = await api_profile_async.create_profile(owner_tgid, f"bench_{owner_tgid}", "bench", "owner", "")
+    ref_link = await create_ref_link("bench", owner.id)
+    user = await api_profile_async.create_profile(user_tgid, f"bench_{user_tgid}", "bench", "user", "",
+                                                  referal_link_id=ref_link.id)
+    invoice = await api_invoice_async.create_invoice(user.id, 2, PaymentName.ROBOKASSA)
+    return invoice.id, ref_link.id
+
+
+async def main(duplicates: int):
+    invoice_id, ref_link_id = await seed()
+    price = Price.RUB.value
+    params = {
+        "OutSum": price,
+        "InvId": invoice_id,
+        "SignatureValue": robokassa_obj.calc_signature(price, invoice_id, robokassa_obj.password_2),
+    }
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        responses = await asyncio.gather(*(client.get("/result", params=params) for _ in range(duplicates)))
+    await dispatch_outbox_job()
+
+    async with async_session_db() as session:
+        is_paid = (await session.execute(select(Invoice.is_paid).filter_by(id=invoice_id))).scalar()
+        ref_link = await session.get(RefLink, ref_link_id)
+
+    answers = {response.text for response in responses}
+    assert answers == {f"OK{invoice_id}"}, answers
+    assert is_paid
+    assert ref_link.count_buys == 1, ref_link.count_buys
+    assert ref_link.sum_buys_rub == price, ref_link.sum_buys_rub
+    print(f"OK: {duplicates} duplicate callbacks, invoice {invoice_id} paid once")
+    await async_engine_db.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--yes", action="store_true", help="подтверждение, что база из .env локальная и тестовая")
+    parser.add_argument("--duplicates", type=int, default=50)
+    arguments = parser.parse_args()
+    if not arguments.yes:
+        sys.exit("Скрипт создает пользователя, ссылку и оплаченный счет в базе из .env. Подтвердите флагом --yes")
+    asyncio.run(main(arguments.duplicates))
@@ -0,0 +1,195 @@
+"""Генератор синтетических данных для нагрузочных проверок db_api.
+
+Создает схему миграциями alembic (upgrade head) в ПУСТОЙ локальной базе из .env и наполняет ее объемами, близкими к продакшену: профили,
+сессии чатов, сообщения, картинки, счета и реферальные ссылки. Активность распределена с перекосом:
+сессия, пользователь счета и ссылка выбираются как 1 + floor(N * random() ^ skew), поэтому небольшая часть
+пользователей дает большую часть сообщений и оплат, а свежие сообщения встречаются чаще старых.
+Большие таблицы заполняются пачками по --chunk строк, каждая пачка в своей транзакции.
+
+    python -m benchmarks.synthetic_data --yes --profiles 1000000 --messages 50000000 --invoices 500000 --ref-links 10000
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect, text
+
+from db_api import async_engine_db
+
+REFERENCE_SQL = (
+    """
+    INSERT INTO ai_model (code, name, type, is_active) VALUES
+        ('gpt-4o', 'GPT-4o', 'text', true), ('gpt-4o-mini', 'GPT-4o mini', 'text', true),
+        ('o1-preview', 'o1-preview', 'text', true), ('o1-mini', 'o1-mini', 'text', true),
+        ('mj-5-2', 'Midjourney 5.2', 'image', true), ('mj-6-0', 'Midjourney 6.0', 'image', true)
+    """,
+    """
+    INSERT INTO tariff (id, name, code, chatgpt_4o_daily_limit, chatgpt_4o_mini_daily_limit,
+                        midjourney_6_0_daily_limit, midjourney_5_2_daily_limit, chatgpt_o1_preview_daily_limit,
+                        chatgpt_o1_mini_daily_limit, days, price_rub, price_stars, is_active) VALUES
+        (1, 'Free', 'FREE', 0, -1, 0, 0, 0, 0, NULL, 0, 0, true),
+        (2, 'Premium', 'PREMIUM', 100, -1, 20, 45, 20, 60, 30, 489, 190, true),
+        (3, 'Promo', 'PROMO', 100, -1, 20, 45, 20, 60, 3, 0, 0, true)
+    """,
+)
+
+# Пачки задаются :start и :stop по номеру строки g. Id сессий считаются от tgid, чтобы сообщения можно было
+# раздать сессиям без join: gpt-4o-mini есть у всех (id = tgid), gpt-4o у каждого 4-го, mj-6-0 у каждого 20-го.
+CHUNKED_SQL = (
+    # 10% пользователей с подпиской, из них истекших ~1%; регистрации за год, свежих больше
+    ("profile", "profiles", """
+    INSERT INTO profile (id, tgid, username, tariff_id, ai_model_id, date_subscription, chatgpt_4o_daily_limit,
+                         chatgpt_4o_mini_daily_limit, chatgpt_o1_preview_daily_limit, chatgpt_o1_mini_daily_limit,
+                         mj_daily_limit_5_2, mj_daily_limit_6_0, count_request, recurring, is_staff, is_admin,
+                         created_at)
+    SELECT gen_random_uuid(), g, 'user_' || g,
+           CASE WHEN g % 10 = 0 THEN 2 ELSE 1 END, 'gpt-4o-mini',
+           CASE WHEN g % 100 = 0 THEN now() - interval '1 day'
+                WHEN g % 10 = 0 THEN now() + (g % 30 + 1) * interval '1 day' END,
+           CASE WHEN g % 10 = 0 THEN 100 ELSE 0 END, -1, 0, 0, 0, 0, g % 500, g % 20 = 0, false, g % 10000 = 0,
+           now() - power(random(), 2) * interval '365 days'
+    FROM generate_series(CAST(:start AS bigint), CAST(:stop AS bigint)) AS g
+    """),
+    ("ref_link", "ref_links", """
+    INSERT INTO ref_link (id, name, link, owner_id, count_clicks, count_buys, count_new_users, sum_buys_rub,
+                          sum_buys_stars)
+    SELECT g, 'link ' || g, 'bot?start=' || g, p.id, 0, 0, 0, 0, 0
+    FROM generate_series(CAST(:start AS bigint), CAST(:stop AS bigint)) AS g JOIN profile p ON p.tgid = g
+    """),
+    ("profile.referal_link_id", "profiles", """
+    UPDATE profile SET referal_link_id = 1 + floor(CAST(:ref_links AS bigint) * power(random(), :skew))::bigint
+    WHERE tgid BETWEEN :start AND :stop AND tgid % 5 = 0 AND CAST(:ref_links AS bigint) > 0
+    """),
+    ("chat_session", "profiles", """
+    INSERT INTO chat_session (id, name, ai_model_id, profile_id, active_generation)
+    SELECT CASE m.code WHEN 'gpt-4o-mini' THEN p.tgid
+                       WHEN 'gpt-4o' THEN CAST(:profiles AS bigint) + p.tgid / 4
+                       ELSE CAST(:profiles AS bigint) + CAST(:profiles AS bigint) / 4 + p.tgid / 20 END,
+           'Новый диалог 1', m.code, p.id, false
+    FROM profile p CROSS JOIN (VALUES ('gpt-4o-mini'), ('gpt-4o'), ('mj-6-0')) AS m(code)
+    WHERE p.tgid BETWEEN :start AND :stop
+      AND (m.code = 'gpt-4o-mini' OR (m.code = 'gpt-4o' AND p.tgid % 4 = 0) OR p.tgid % 20 = 0)
+    """),
+    # 80% сообщений в gpt-4o-mini, 20% в gpt-4o
+    ("text_query", "messages", """
+    INSERT INTO text_query (id, chat_session_id, query, answer, status, created_at)
+    SELECT gen_random_uuid(),
+           CASE WHEN g % 5 = 0
+                THEN CAST(:profiles AS bigint) + 1
+                     + floor(CAST(:profiles AS bigint) / 4 * power(random(), :skew))::bigint
+                ELSE 1 + floor(CAST(:profiles AS bigint) * power(random(), :skew))::bigint END,
+           'вопрос ' || g, 'ответ ' || g, 'finish', now() - power(random(), 2) * interval '90 days'
+    FROM generate_series(CAST(:start AS bigint), CAST(:stop AS bigint)) AS g
+    """),
+    ("image_query", "images", """
+    INSERT INTO image_query (id, chat_session_id, query, answer, jobid, status, created_at)
+    SELECT gen_random_uuid(),
+           CAST(:profiles AS bigint) + CAST(:profiles AS bigint) / 4 + 1
+           + floor(CAST(:profiles AS bigint) / 20 * power(random(), :skew))::bigint,
+           'картинка ' || g, 'https://cdn/' || g, md5(g::text), 'finish',
+           now() - power(random(), 2) * interval '90 days'
+    FROM generate_series(CAST(:start AS bigint), CAST(:stop AS bigint)) AS g
+    """),
+    # Пользователь выбирается в подзапросе, чтобы random() считался один раз на строку
+    ("invoice", "invoices", """
+    INSERT INTO invoice (profile_id, is_paid, tariff_id, provider, is_mother, created_at, paid_at)
+    SELECT p.id, s.is_paid, 2, CASE WHEN s.g % 4 = 0 THEN 'STARS' ELSE 'ROBOKASSA' END::paymentname,
+           s.g % 6 = 1, s.created_at, CASE WHEN s.is_paid THEN s.created_at + interval '10 minutes' END
+    FROM (
+        SELECT g, 1 + floor(CAST(:profiles AS bigint) * power(random(), :skew))::bigint AS tgid,
+               g % 3 <> 0 AS is_paid, now() - power(random(), 2) * interval '180 days' AS created_at
+        FROM generate_series(CAST(:start AS bigint), CAST(:stop AS bigint)) AS g
+    ) AS s
+    JOIN profile p ON p.tgid = s.tgid
+    """),
+)
+
+FINISH_SQL = (
+    "SELECT setval(pg_get_serial_sequence('ref_link', 'id'), GREATEST(:ref_links, 1))",
+    "SELECT setval(pg_get_serial_sequence('chat_session', 'id'), (SELECT max(id) FROM chat_session))",
+    "ANALYZE",
+)
+
+
+def volumes(args) -> dict[str, int | float]:
+    """Объемы и параметры генерации из аргументов командной строки"""
+    return {"profiles": args.profiles, "ref_links": min(args.ref_links, args.profiles), "messages": args.messages,
+            "images": args.images if args.images is not None else args.messages // 50,
+            "invoices": args.invoices, "skew": float(args.skew)}
+
+
+async def migrate():
+    """Создай схему цепочкой миграций, как на продакшене, а не по models.py.
+
+    env.py миграций сам запускает event loop, поэтому upgrade выполняется в отдельном потоке.
+    """
+    config = Config()
+    config.set_main_option("script_location", str(Path(__file__).resolve().parent.parent / "migrations"))
+    await asyncio.to_thread(command.upgrade, config, "head")
+
+
+def _params(statement: str, params: dict) -> dict:
+    return {key: value for key, value in params.items() if f":{key}" in statement}
+
+
+async def generate(params: dict, chunk: int = 1_000_000):
+    """Создай схему и наполни базу. База должна быть пустой"""
+    await migrate()
+    async with async_engine_db.begin() as conn:
+        for statement in REFERENCE_SQL:
+            await conn.execute(text(statement))
+
+    for table, total_key, statement in CHUNKED_SQL:
+        total = params[total_key]
+        start_time = time.perf_counter()
+        for start in range(1, total + 1, chunk):
+            stop = min(start + chunk - 1, total)
+            async with async_engine_db.begin() as conn:
+                await conn.execute(text(statement), {**_params(statement, params), "start": start, "stop": stop})
+            print(f"  {table}: {stop}/{total}", end="\r", flush=True)
+        print(f"  {table}: {total} за {time.perf_counter() - start_time:.1f} с")
+
+    async with async_engine_db.begin() as conn:
+        for statement in FINISH_SQL:
+            await conn.execute(text(statement), _params(statement, params))
+
+
+async def is_empty() -> bool:
+    """Проверь, что в базе еще нет схемы бота"""
+    async with async_engine_db.connect() as conn:
+        tables = await conn.run_sync(lambda sync_conn: inspect(sync_conn).get_table_names())
+    return "profile" not in tables
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Аргументы объемов, общие для генератора и бенчмарков"""
+    parser.add_argument("--profiles", type=int, default=1_000_000)
+    parser.add_argument("--ref-links", type=int, default=10_000)
+    parser.add_argument("--messages", type=int, default=50_000_000)
+    parser.add_argument("--images", type=int, default=None, help="по умолчанию messages / 50")
+    parser.add_argument("--invoices", type=int, default=500_000)
+    parser.add_argument("--skew", type=float, default=3.0, help="степень перекоса активности, 1 - равномерно")
+    parser.add_argument("--chunk", type=int, default=1_000_000, help="строк в одной транзакции")
+
+
+async def main(args):
+    try:
+        if not await is_empty():
+            sys.exit("База уже содержит таблицы. Запустите на пустой базе")
+        await generate(volumes(args), args.chunk)
+    finally:
+        await async_engine_db.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--yes", action="store_true", help="подтверждение, что база из .env локальная и тестовая")
+    add_arguments(parser)
+    arguments = parser.parse_args()
+    if not arguments.yes:
+        sys.exit("Скрипт создает таблицы и данные в базе из .env. Подтвердите флагом --yes")
+    asyncio.run(main(arguments))
@@ -0,0 +1,187 @@
+"""Нагрузочный тест /result на локальных Postgres и Redis из .env.
+
+Создает --invoices пользователей с неоплаченными счетами и отправляет подписанные колбэки Robokassa
+с заданной конкурентностью. Часть колбэков повторяет уже отправленный счет (--duplicates), часть идет
+с неверной подписью (--invalid). Приложение вызывается в процессе через httpx.ASGITransport, поэтому
+считаются и запросы в бд на каждый колбэк. Итог печатается и сохраняется в JSON; с --baseline результат
+сравнивается с прошлым запуском и скрипт выходит с кодом 1 при росте p95 больше --max-regression процентов.
+
+    python -m benchmarks.webhook_load --yes --invoices 2000 --concurrency 50 --output result.json
+    python -m benchmarks.webhook_load --yes --baseline result.json
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import random
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+
+import httpx
+from sqlalchemy import event, text
+
+from db_api import api_profile_async, async_engine_db
+from main import app
+from services import robokassa_obj
+from utils.enum import Price
+
+SEED_INVOICES_SQL = """
+    INSERT INTO invoice (profile_id, is_paid, tariff_id, provider, is_mother)
+    SELECT id, false, 2, 'ROBOKASSA', false FROM profile WHERE tgid > :base AND tgid <= :base + :count
+    RETURNING id
+"""
+
+_request_kind = contextvars.ContextVar("request_kind", default=None)
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def seed(count: int) -> list[int]:
+    """Создай пользователей и неоплаченные счета, верни id счетов"""
+    base = random.randint(4 * 10 ** 12, 5 * 10 ** 12)
+    await api_profile_async.import_profiles(
+        [{"tgid": base + i, "username": f"load_{base + i}"} for i in range(1, count + 1)]
+    )
+    async with async_engine_db.begin() as conn:
+        result = await conn.execute(text(SEED_INVOICES_SQL), {"base": base, "count": count})
+        return [row.id for row in result]
+
+
+def build_requests(invoice_ids: list[int], duplicates: float, invalid: float, seed_value: int) -> list[tuple]:
+    """Собери перемешанный список колбэков: (вид, параметры)"""
+    rng = random.Random(seed_value)
+    price = Price.RUB.value
+    requests = []
+    for invoice_id in invoice_ids:
+        signature = robokassa_obj.calc_signature(price, invoice_id, robokassa_obj.password_2)
+        params = {"OutSum": price, "InvId": invoice_id, "SignatureValue": signature}
+        requests.append(("valid", params))
+        if rng.random() < duplicates:
+            requests.append(("duplicate", params))
+        if rng.random() < invalid:
+            requests.append(("invalid", {**params, "SignatureValue": "0" * 32}))
+    rng.shuffle(requests)
+    return requests
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    invoice_ids = await seed(args.invoices)
+    requests = build_requests(invoice_ids, args.duplicates, args.invalid, args.seed)
+
+    statements = Counter()
+
+    @event.listens_for(async_engine_db.sync_engine, "before_cursor_execute")
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        kind = _request_kind.get()
+        if kind is not None:
+            statements[kind] += 1
+
+    latencies = defaultdict(list)
+    answers = defaultdict(Counter)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://load") as client:
+        async def send(kind: str, params: dict):
+            async with semaphore:
+                _request_kind.set(kind)
+                start = time.perf_counter()
+                response = await client.get("/result", params=params)
+                latencies[kind].append((time.perf_counter() - start) * 1000)
+                answers[kind]["OK" if response.text.startswith("OK") else response.text] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(send(kind, params) for kind, params in requests))
+        elapsed = time.perf_counter() - start
+    event.remove(async_engine_db.sync_engine, "before_cursor_execute", count_statement)
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    report = {
+        "commit": git_commit(),
+        "params": {key: getattr(args, key) for key in ("invoices", "concurrency", "duplicates", "invalid", "seed")},
+        "requests": len(requests),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(requests) / elapsed, 1),
+        "p50_ms": round(percentile(all_latencies, 0.50), 2),
+        "p95_ms": round(percentile(all_latencies, 0.95), 2),
+        "p99_ms": round(percentile(all_latencies, 0.99), 2),
+        "kinds": {
+            kind: {
+                "requests": len(values),
+                "p50_ms": round(percentile(values, 0.50), 2),
+                "p95_ms": round(percentile(values, 0.95), 2),
+                "p99_ms": round(percentile(values, 0.99), 2),
+                "db_statements_per_request": round(statements[kind] / len(values), 2),
+                "answers": dict(answers[kind]),
+            }
+            for kind, values in sorted(latencies.items())
+        },
+    }
+    paid = answers["valid"]["OK"] + answers["duplicate"]["OK"]
+    report["ok"] = answers["invalid"]["OK"] == 0 and paid == len(latencies["valid"]) + len(latencies["duplicate"])
+    return report
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> bool:
+    """Сравни с прошлым запуском. Вернет False при росте p95 больше max_regression процентов"""
+    ok = True
+    for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+        before, after = baseline.get(metric), report[metric]
+        if not before:
+            continue
+        change = (after - before) / before * 100
+        print(f"  {metric}: {before} -> {after} ({change:+.1f}%)")
+    before_p95 = baseline.get("p95_ms")
+    if before_p95 and (report["p95_ms"] - before_p95) / before_p95 * 100 > max_regression:
+        print(f"REGRESSION: p95 выросла больше чем на {max_regression}% (baseline {baseline.get('commit')})")
+        ok = False
+    return ok
+
+
+async def main(args):
+    try:
+        report = await run(args)
+    finally:
+        await async_engine_db.dispose()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+    ok = report["ok"]
+    if not ok:
+        print("FAIL: колбэки обработаны неверно (оплата по неверной подписи или потерянная оплата)")
+    if args.baseline:
+        with open(args.baseline) as file:
+            ok &= compare(report, json.load(file), args.max_regression)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--yes", action="store_true", help="подтверждение, что база из .env локальная и тестовая")
+    parser.add_argument("--invoices", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duplicates", type=float, default=0.2, help="доля счетов с повторным колбэком")
+    parser.add_argument("--invalid", type=float, default=0.05, help="доля счетов с колбэком с неверной подписью")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="куда сохранить JSON с результатом")
+    parser.add_argument("--baseline", help="JSON прошлого запуска для сравнения")
+    parser.add_argument("--max-regression", type=float, default=20.0)
+    arguments = parser.parse_args()
+    if not arguments.yes:
+        sys.exit("Скрипт создает пользователей и счета в базе из .env. Подтвердите флагом --yes")
+    asyncio.run(main(arguments))
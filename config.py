@@ -11,7 +11,26 @@ class Settings(BaseSettings):
     DB_PASS: str
     DB_HOST: str
     DB_PORT: int
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
     TTL: int
+    LOCAL_CACHE_SIZE: int = 10000
+    LOCAL_CACHE_TTL: int = 30
+    CACHE_EARLY_REFRESH_BETA: float = 1.0
+    LAZY_LIMITS_RESET: bool = False
+    STAT_REFRESH_DAYS: int = 3
+    OUTBOX_MAX_ATTEMPTS: int = 10
+    CONTEXT_MAX_TURNS: int = 50
+    CONTEXT_CACHE_TURNS: int = 20
+    CONTEXT_CACHE_TTL: int = 3600
+    CONTEXT_TOKENS_GPT_4O: int = 8000
+    CONTEXT_TOKENS_GPT_4O_MINI: int = 16000
+    CONTEXT_TOKENS_O1_PREVIEW: int = 8000
+    CONTEXT_TOKENS_O1_MINI: int = 16000
+    CONTEXT_TOKENS_DEFAULT: int = 4000
     PATH_WORK: str = os.getcwd()
     PATH_ENV: str = f'{PATH_WORK}/.env'
     LEVEL_LOGGER: str
@@ -28,6 +47,9 @@ class Settings(BaseSettings):
     ROBOKASSA_PASS_1: str
     ROBOKASSA_PASS_2: str
     RECURRING: bool
+    RECURRING_CONCURRENCY: int = 20
+    RECURRING_TIMEOUT: int = 15
+    RECURRING_RETRIES: int = 3
     REDIS_HOST: str
     REDIS_PORT: int
     CHANNELS_IDS: str
@@ -1,5 +1,7 @@
 from .async_api import (DBApiAsync, ApiTariffAsync, ApiProfileAsync, ApiAiModelAsync, ApiImageQueryAsync,
-                     ApiTextQueryAsync, ApiChatSessionAsync, ApiInvoiceAsync, ApiRefLinkAsync)
+                     ApiTextQueryAsync, ApiChatSessionAsync, ApiInvoiceAsync, ApiRefLinkAsync,
+                     ApiStatAsync, ApiOutboxAsync)
+from .engine import async_engine_db, get_pool_stats
 
 db_api_async_obj = DBApiAsync()
 api_tariff_async = ApiTariffAsync()
@@ -10,8 +12,11 @@ api_text_query_async = ApiTextQueryAsync()
 api_chat_session_async = ApiChatSessionAsync()
 api_invoice_async = ApiInvoiceAsync()
 api_ref_link_async = ApiRefLinkAsync()
+api_stat_async = ApiStatAsync()
+api_outbox_async = ApiOutboxAsync()
 
 __all__ = [
     db_api_async_obj, api_profile_async, api_tariff_async, api_ai_model_async, api_text_query_async,
-    api_chat_session_async, api_image_query_async, api_invoice_async, api_ref_link_async
+    api_chat_session_async, api_image_query_async, api_invoice_async, api_ref_link_async, api_stat_async,
+    api_outbox_async, async_engine_db, get_pool_stats
 ]
\ No newline at end of file
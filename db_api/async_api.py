@@ -1,17 +1,103 @@
-from datetime import datetime, timedelta
-from typing import Optional
+from datetime import date, datetime, time, timedelta
 
 from db_api.interface_api import DataBaseApiInterface
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from db_api.engine import async_engine_db, async_session_db
 from config import settings
-from db_api.models import Profile, AiModel, ChatSession, TextQuery, Tariff, ImageQuery, Invoice, RefLink
+from db_api.models import (Profile, AiModel, ChatSession, TextQuery, Tariff, ImageQuery, Invoice, RefLink, DailyStat,
+                           DailyActiveProfile, OutboxEvent)
 from uuid import UUID
 from sqlalchemy.future import select
 from sqlalchemy.orm import joinedload, selectinload
 from utils.enum import PaymentName
-from sqlalchemy import func, union_all, case
-
-from utils.enum import AiModelName, PaymentName
+from sqlalchemy import (func, union_all, case, update, or_, and_, bindparam, literal, cast, String,
+                        delete, insert, true, false)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import aliased
+
+from db_api.schemas import (QuotaSpend, PaymentResult, ChatSessionRef, ProfileRead, ProfileUpsert, RefLinkStat, RenewalDue, TariffRead, AiModelRead, PROFILE_READ_COLUMNS,
+                            TARIFF_READ_COLUMNS, AI_MODEL_READ_COLUMNS)
+from utils.enum import AiModelName, PaymentName, PaymentStatus, OutboxKind
+
+# Колонки профиля с дневными лимитами по моделям (-1 означает безлимит)
+QUOTA_COLUMNS = {
+    AiModelName.GPT_4_O.value: Profile.chatgpt_4o_daily_limit,
+    AiModelName.GPT_4_O_MINI.value: Profile.chatgpt_4o_mini_daily_limit,
+    AiModelName.GPT_O1_PREVIEW.value: Profile.chatgpt_o1_preview_daily_limit,
+    AiModelName.GPT_O1_MINI.value: Profile.chatgpt_o1_mini_daily_limit,
+    AiModelName.MIDJOURNEY_5_2.value: Profile.mj_daily_limit_5_2,
+    AiModelName.MIDJOURNEY_6_0.value: Profile.mj_daily_limit_6_0,
+}
+
+# Колонки тарифа, из которых обновляются дневные лимиты профиля
+TARIFF_LIMIT_COLUMNS = {
+    Profile.chatgpt_4o_daily_limit: Tariff.chatgpt_4o_daily_limit,
+    Profile.chatgpt_4o_mini_daily_limit: Tariff.chatgpt_4o_mini_daily_limit,
+    Profile.chatgpt_o1_preview_daily_limit: Tariff.chatgpt_o1_preview_daily_limit,
+    Profile.chatgpt_o1_mini_daily_limit: Tariff.chatgpt_o1_mini_daily_limit,
+    Profile.mj_daily_limit_5_2: Tariff.midjourney_5_2_daily_limit,
+    Profile.mj_daily_limit_6_0: Tariff.midjourney_6_0_daily_limit,
+}
+
+# Значения профиля после окончания подписки
+FREE_TARIFF_VALUES = {
+    "tariff_id": 1,
+    "chatgpt_4o_mini_daily_limit": -1,
+    "chatgpt_4o_daily_limit": 0,
+    "mj_daily_limit_5_2": 0,
+    "mj_daily_limit_6_0": 0,
+    "chatgpt_o1_preview_daily_limit": 0,
+    "chatgpt_o1_mini_daily_limit": 0,
+    "date_subscription": None,
+}
+
+
+def subscription_values(tariff_id: int, recurring: bool = False) -> dict:
+    """Значения профиля после оплаты подписки"""
+    values = {
+        "tariff_id": tariff_id,
+        "recurring": recurring,
+        "chatgpt_4o_mini_daily_limit": -1,
+        "chatgpt_4o_daily_limit": 100,
+        "mj_daily_limit_5_2": 45,
+        "mj_daily_limit_6_0": 20,
+        "chatgpt_o1_preview_daily_limit": 20,
+        "chatgpt_o1_mini_daily_limit": 60,
+        "limits_reset_date": msk_today(),
+    }
+    if tariff_id == 3:
+        values["date_subscription"] = datetime.now() + timedelta(days=3)
+    elif tariff_id == 2:
+        values["date_subscription"] = datetime.now() + timedelta(days=30)
+    return values
+
+
+def msk_today():
+    """Верни текущую дату по мск"""
+    return (datetime.utcnow() + timedelta(hours=3)).date()
+
+
+def limits_is_stale(today):
+    """Условие: дневные лимиты профиля с подпиской не обновлялись с начала суток"""
+    return and_(
+        Profile.tariff_id == 2,
+        or_(Profile.limits_reset_date.is_(None), Profile.limits_reset_date < today),
+    )
+
+
+def ref_counter_deltas_statement(deltas: dict[int, dict[str, int]]) -> tuple:
+    """UPDATE ссылок с приращениями счетчиков для executemany: (запрос, параметры)"""
+    table = RefLink.__table__
+    fields = ("count_clicks", "count_new_users", "count_buys", "sum_buys_rub", "sum_buys_stars")
+    query = (
+        update(table)
+        .where(table.c.id == bindparam("link_id"))
+        .values({field: func.coalesce(table.c[field], 0) + bindparam(f"delta_{field}") for field in fields})
+    )
+    params = [
+        {"link_id": link_id, **{f"delta_{field}": counters.get(field, 0) for field in fields}}
+        for link_id, counters in deltas.items()
+    ]
+    return query, params
 
 
 class DBApiAsync(DataBaseApiInterface):
@@ -22,12 +108,12 @@ class DBApiAsync(DataBaseApiInterface):
         self._create_session()
 
     def _create_engine(self):
-        """Создание асинхронного движка базы данных"""
-        self.async_engine_db = create_async_engine(url=settings.url_connect_with_asyncpg, echo=False)
+        """Подключение к общему для процесса асинхронному движку базы данных"""
+        self.async_engine_db = async_engine_db
 
     def _create_session(self):
-        """Создание асинхронной сессии для работы с базой данных"""
-        self.async_session_db = async_sessionmaker(self.async_engine_db)
+        """Подключение к общей фабрике асинхронных сессий"""
+        self.async_session_db = async_session_db
 
     async def update_data(self, obj):
         """Обнови данные для обьекта в бд"""
@@ -79,15 +165,14 @@ class ApiTextQueryAsync(DBApiAsync):
 
 class ApiRefLinkAsync(DBApiAsync):
     async def create_ref_link(self, name_link, owner_id):
-        """Создай реферальную ссылку"""
-        async with self.async_session_db() as session:
-            # Получаем общее количество записей в RefLink
-            total_links_count = await session.execute(func.count(RefLink.id))
-            total_links_count = total_links_count.scalar()  # Получаем число
+        """Создай реферальную ссылку. Id и код ссылки берутся из последовательности ref_link, без подсчета строк
 
-            # Увеличиваем общее количество на 1 для использования в ссылке
-            new_id = total_links_count + 1
+        Вызывайте через utils.cache.create_ref_link: он сбрасывает закэшированный промах по новому коду.
+        """
+        async with self.async_session_db() as session:
+            new_id = await session.scalar(select(func.nextval(func.pg_get_serial_sequence("ref_link", "id"))))
             ref_link = RefLink(
+                id=new_id,
                 name=name_link,
                 owner_id=owner_id,
                 link=f'{settings.USERNAME_BOT}?start={new_id}'
@@ -109,84 +194,56 @@ class ApiRefLinkAsync(DBApiAsync):
             ref_link = result.unique().scalars().first()
             return ref_link
 
-    async def add_click(self, link: str) -> RefLink | None:
-        """Прибавь кол-во переходов по ссылке"""
+    async def get_ref_link_id(self, link: str) -> int | None:
+        """Получи id реферальной ссылки без загрузки владельца"""
+        async with self.async_session_db() as session:
+            result = await session.execute(select(RefLink.id).filter_by(link=link))
+            return result.scalar()
+
+    async def _increment(self, where, **values) -> RefLink | None:
+        """Атомарно прибавь значения к счетчикам ссылки (col = col + n)"""
         async with self.async_session_db() as session:
             query = (
-                select(RefLink)
-                .filter_by(link=link)
-                .options(joinedload(RefLink.owner))
+                update(RefLink)
+                .where(where)
+                .values({key: getattr(RefLink, key) + value for key, value in values.items()})
+                .returning(RefLink)
+                .execution_options(synchronize_session=False)
             )
             result = await session.execute(query)
-            ref_link = result.unique().scalars().first()
-            if ref_link is None:
-                # Ссылка не найдена, обработка ситуации
-                return None
-            ref_link.count_clicks += 1
+            ref_link = result.scalars().first()
             await session.commit()
-            await session.refresh(ref_link)
-
             return ref_link
 
-    async def add_count_new_users(self, link_id: int) -> RefLink | None:
+    async def add_click(self, link: str) -> RefLink | None:
         """Прибавь кол-во переходов по ссылке"""
-        async with self.async_session_db() as session:
-            query = (
-                select(RefLink)
-                .filter_by(id=link_id)
-                .options(joinedload(RefLink.owner))
-            )
-            result = await session.execute(query)
-            ref_link = result.unique().scalars().first()
-            if ref_link is None:
-                # Ссылка не найдена, обработка ситуации
-                return None
-            ref_link.count_new_users += 1
-            await session.commit()
-            await session.refresh(ref_link)
+        return await self._increment(RefLink.link == link, count_clicks=1)
 
-            return ref_link
+    async def add_count_new_users(self, link_id: int) -> RefLink | None:
+        """Прибавь кол-во переходов по ссылке"""
+        return await self._increment(RefLink.id == link_id, count_new_users=1)
 
     async def add_count_buy(self, link_id: int) -> RefLink | None:
         """Прибавь кол-во покупок по ссылке"""
-        async with self.async_session_db() as session:
-            query = (
-                select(RefLink)
-                .filter_by(id=link_id)
-                .options(joinedload(RefLink.owner))
-            )
-            result = await session.execute(query)
-            ref_link = result.unique().scalars().first()
-            if ref_link is None:
-                # Ссылка не найдена, обработка ситуации
-                return None
-            ref_link.count_buys += 1
-            await session.commit()
-            await session.refresh(ref_link)
-
-            return ref_link
+        return await self._increment(RefLink.id == link_id, count_buys=1)
 
     async def add_sum_buy(self, link_id: int, sum_buy: int, category: str) -> RefLink | None:
         """Прибавь сумму покупок по ссылке"""
+        if category == PaymentName.STARS.value:
+            return await self._increment(RefLink.id == link_id, sum_buys_stars=sum_buy)
+        return await self._increment(RefLink.id == link_id, sum_buys_rub=sum_buy)
+
+    async def apply_counter_deltas(self, deltas: dict[int, dict[str, int]]) -> str:
+        """Прибавь накопленные приращения счетчиков к ссылкам одной транзакцией
+
+        deltas: {id ссылки: {название счетчика: приращение}}
+        """
+        if not deltas:
+            return "Ok"
         async with self.async_session_db() as session:
-            query = (
-                select(RefLink)
-                .filter_by(id=link_id)
-                .options(joinedload(RefLink.owner))
-            )
-            result = await session.execute(query)
-            ref_link = result.unique().scalars().first()
-            if ref_link is None:
-                # Ссылка не найдена, обработка ситуации
-                return None
-            if category == PaymentName.STARS.value:
-                ref_link.sum_buys_stars += sum_buy
-            else:
-                ref_link.sum_buys_rub += sum_buy
+            await session.execute(*ref_counter_deltas_statement(deltas))
             await session.commit()
-            await session.refresh(ref_link)
-
-            return ref_link
+        return "Ok"
 
     async def get_count_ref_links(self):
         """Получить пользователей с закончившей подпиской"""
@@ -198,6 +255,45 @@ class ApiRefLinkAsync(DBApiAsync):
             count_ref_links = result.scalar()
         return count_ref_links
 
+    async def get_ref_links_stats(self, limit: int | None = None, offset: int = 0,
+                                  owner_id: UUID | None = None) -> list[RefLinkStat]:
+        """Получи статистику всех ссылок или страницы ссылок одним запросом
+
+        Покупки считаются по оплаченным инвойсам приглашенных пользователей для каждой ссылки страницы отдельно
+        (LATERAL по индексам profile.referal_link_id и invoice.profile_id), поэтому запрос не читает чужие инвойсы.
+        """
+        links = select(RefLink.id, RefLink.name, RefLink.link, RefLink.count_clicks, RefLink.count_new_users)
+        if owner_id is not None:
+            links = links.where(RefLink.owner_id == owner_id)
+        links = links.order_by(RefLink.id).offset(offset).limit(limit).subquery("links")
+        purchases = (
+            select(
+                func.count(Invoice.profile_id.distinct()).label("subscribers"),
+                func.coalesce(func.sum(Tariff.price_rub).filter(Invoice.provider == PaymentName.ROBOKASSA), 0)
+                .label("purchases_rub"),
+                func.coalesce(func.sum(Tariff.price_stars).filter(Invoice.provider == PaymentName.STARS), 0)
+                .label("purchases_stars"),
+            )
+            .select_from(Profile)
+            .join(Invoice, and_(Invoice.profile_id == Profile.id, Invoice.is_paid == True))
+            .outerjoin(Tariff, Tariff.id == Invoice.tariff_id)
+            .where(Profile.referal_link_id == links.c.id)
+            .lateral("purchases")
+        )
+        query = (
+            select(
+                links.c.id, links.c.name, links.c.link,
+                func.coalesce(links.c.count_clicks, 0), func.coalesce(links.c.count_new_users, 0),
+                purchases.c.subscribers, purchases.c.purchases_rub, purchases.c.purchases_stars,
+            )
+            .select_from(links)
+            .join(purchases, true())
+            .order_by(links.c.id)
+        )
+        async with self.async_session_db() as session:
+            result = await session.execute(query)
+            return [RefLinkStat(*row) for row in result]
+
     async def get_ref_links_of_owner(self, owner_id):
         """Получить все ссылки пользователя"""
         async with self.async_session_db() as session:
@@ -267,10 +363,134 @@ class ApiInvoiceAsync(DBApiAsync):
             result = await session.execute(query)
             invoice_obj = result.unique().scalars().first()
             invoice_obj.is_paid = True
+            invoice_obj.paid_at = datetime.utcnow()
             await session.commit()
             await session.refresh(invoice_obj)
             return invoice_obj
 
+    async def get_due_mother_invoices(self, limit: int = 1000, lead: timedelta = timedelta(days=1)
+                                      ) -> list[RenewalDue]:
+        """Получи подписки с автопродлением, которые заканчиваются в течение lead, с их материнским счетом Robokassa
+
+        Пропускаются пользователи, по которым за последние сутки уже отправлен запрос на списание.
+        """
+        mother_invoice_id = (
+            select(Invoice.id)
+            .where(Invoice.profile_id == Profile.id)
+            .where(Invoice.is_paid == True, Invoice.is_mother == True)
+            .where(Invoice.provider == PaymentName.ROBOKASSA)
+            .order_by(Invoice.id.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+        renewal = aliased(Invoice)
+        charged_recently = (
+            select(renewal.id)
+            .where(renewal.profile_id == Profile.id)
+            .where(renewal.is_mother == False, renewal.charge_status.isnot(None))
+            .where(renewal.created_at >= datetime.utcnow() - timedelta(days=1))
+            .exists()
+        )
+        query = (
+            select(Profile.id, Profile.tgid, mother_invoice_id.label("mother_invoice_id"), Tariff.id, Tariff.name,
+                   Tariff.price_rub)
+            .join(Tariff, Tariff.id == Profile.tariff_id)
+            .where(Profile.tariff_id == 2, Profile.recurring == True)
+            .where(Profile.date_subscription <= datetime.now() + lead)
+            .where(mother_invoice_id.isnot(None))
+            .where(~charged_recently)
+            .order_by(Profile.date_subscription)
+            .limit(limit)
+        )
+        async with self.async_session_db() as session:
+            result = await session.execute(query)
+            return [RenewalDue(*row) for row in result]
+
+    async def create_renewal_invoices(self, dues: list[RenewalDue]) -> dict[int, RenewalDue]:
+        """Создай неоплаченные счета продления одним запросом. Вернет {id нового счета: продление}"""
+        if not dues:
+            return {}
+        query = (
+            insert(Invoice)
+            .values([
+                {"profile_id": due.profile_id, "tariff_id": due.tariff_id, "provider": PaymentName.ROBOKASSA,
+                 "is_mother": False}
+                for due in dues
+            ])
+            .returning(Invoice.id, Invoice.profile_id)
+        )
+        async with self.async_session_db() as session:
+            result = await session.execute(query)
+            invoice_ids = {profile_id: invoice_id for invoice_id, profile_id in result}
+            await session.commit()
+        return {invoice_ids[due.profile_id]: due for due in dues}
+
+    async def record_charge_outcomes(self, outcomes: list[dict]) -> str:
+        """Запиши результаты запросов на списание пачкой
+
+        Словари с ключами invoice_id, status (ChargeStatus), attempts, error.
+        """
+        if not outcomes:
+            return "Ok"
+        table = Invoice.__table__
+        query = (
+            update(table)
+            .where(table.c.id == bindparam("invoice_id"))
+            .values(charge_status=bindparam("status"), charge_attempts=bindparam("attempts"),
+                    charge_error=bindparam("error"), charged_at=func.timezone("utc", func.now()))
+        )
+        async with self.async_session_db() as session:
+            await session.execute(query, outcomes)
+            await session.commit()
+        return "Ok"
+
+    async def finalize_payment(self, invoice_id: int, sum_buy: int, category: str,
+                               recurring: bool = False) -> PaymentResult:
+        """Проведи оплату транзакции одной транзакцией бд
+
+        Отмечает счет оплаченным, выдает подписку и пишет событие outbox для статистики ссылки, кэша и уведомлений.
+        Повторный вызов для уже оплаченного счета ничего не меняет и возвращает PaymentStatus.ALREADY_PAID.
+        """
+        async with self.async_session_db() as session:
+            query = (
+                update(Invoice)
+                .where(Invoice.id == invoice_id)
+                .where(Invoice.is_paid == False)
+                .values(is_paid=True, paid_at=func.timezone("utc", func.now()))
+                .returning(Invoice.profile_id, Invoice.tariff_id)
+                .execution_options(synchronize_session=False)
+            )
+            invoice_row = (await session.execute(query)).first()
+            if invoice_row is None:
+                is_paid = (await session.execute(select(Invoice.is_paid).filter_by(id=invoice_id))).scalar()
+                if is_paid is None:
+                    return PaymentResult(status=PaymentStatus.NOT_FOUND)
+                return PaymentResult(status=PaymentStatus.ALREADY_PAID)
+
+            query = (
+                update(Profile)
+                .where(Profile.id == invoice_row.profile_id)
+                .values(**subscription_values(invoice_row.tariff_id, recurring))
+                .returning(Profile.tgid, Profile.referal_link_id)
+                .execution_options(synchronize_session=False)
+            )
+            profile_row = (await session.execute(query)).first()
+
+            # Статистика ссылки, кэш и уведомления обновляются диспетчером outbox после ответа Robokassa
+            session.add(OutboxEvent(
+                kind=OutboxKind.PAYMENT.value,
+                payload={"tgid": profile_row.tgid, "referal_link_id": profile_row.referal_link_id,
+                         "sum_buy": sum_buy, "category": category},
+            ))
+            await session.commit()
+
+        return PaymentResult(
+            status=PaymentStatus.PAID,
+            profile_id=invoice_row.profile_id,
+            tgid=profile_row.tgid,
+            referal_link_id=profile_row.referal_link_id,
+        )
+
     async def get_count_sub(self, provider):
         async with self.async_session_db() as session:
             query = (
@@ -394,38 +614,76 @@ class ApiChatSessionAsync(DBApiAsync):
                     messages.append({"role": "assistant", "content": msg.answer})
             return messages
 
-    async def delete_context_from_session(self, session_id: int, profile: Profile) -> str:
-        """Удали выбранную сессию и создай новую"""
+    async def get_last_turns(self, session_id: int, limit: int, before: datetime | None = None) -> list:
+        """Верни последние завершенные пары вопрос-ответ сессии, от новых к старым
+
+        Постраничный выбор по created_at: для следующей страницы передайте created_at самой старой пары в before.
+        Строки: (query, answer, created_at).
+        """
+        async with self.async_session_db() as session:
+            query = (
+                select(TextQuery.query, TextQuery.answer, TextQuery.created_at)
+                .where(TextQuery.chat_session_id == session_id)
+                .where(TextQuery.query.isnot(None), TextQuery.answer.isnot(None))
+                .order_by(TextQuery.created_at.desc())
+                .limit(limit)
+            )
+            if before is not None:
+                query = query.where(TextQuery.created_at < before)
+            result = await session.execute(query)
+            return result.all()
+
+    async def delete_context_from_session(self, session_id: int, profile: Profile | ProfileRead) -> str:
+        """Удали выбранную сессию и создай новую. Кэш id сессии сбрасывает utils.cache.reset_session"""
         async with self.async_session_db() as session:
             session_obj = await session.get(ChatSession, session_id)
             if not session_obj:
                 return "Not object"
             await session.delete(session_obj)
             await session.commit()
-        await self.get_or_create_session(profile, profile.ai_model_id)
+        await self.get_or_create_session_ref(profile.id, profile.ai_model_id)
         return "Ok"
 
+    async def get_or_create_session_ref(self, profile_id: UUID, model: str) -> ChatSessionRef:
+        """Получи id и флаги сессии пользователя с моделью, создав ее при необходимости, без загрузки истории
+
+        Один запрос: INSERT ... ON CONFLICT DO NOTHING и выборка существующей строки, если вставки не было.
+        """
+        inserted = (
+            pg_insert(ChatSession)
+            .values(profile_id=profile_id, ai_model_id=model, name='Новый диалог 1', active_generation=False)
+            .on_conflict_do_nothing(index_elements=[ChatSession.profile_id, ChatSession.ai_model_id])
+            .returning(ChatSession.id, ChatSession.active_generation)
+            .cte("inserted")
+        )
+        query = union_all(
+            select(inserted.c.id, inserted.c.active_generation),
+            select(ChatSession.id, ChatSession.active_generation)
+            .where(ChatSession.profile_id == profile_id, ChatSession.ai_model_id == model),
+        ).limit(1)
+        async with self.async_session_db() as session:
+            row = (await session.execute(query)).first()
+            if row is None:
+                # Сессию одновременно вставил другой запрос: она видна новому снимку следующего запроса
+                row = (await session.execute(query)).first()
+            await session.commit()
+            return ChatSessionRef(*row)
+
     async def get_or_create_session(self, profile: Profile, model: str):
-        """Создай сессию для пользователя если ее нет"""
+        """Создай сессию для пользователя если ее нет и верни ее с историей
+
+        Сессия создается через get_or_create_session_ref, поэтому одновременные вызовы не падают на уникальности.
+        """
+        session_ref = await self.get_or_create_session_ref(profile.id, model)
         async with self.async_session_db() as session:
             query = (
                 select(ChatSession)
-                .filter_by(profile_id=profile.id, ai_model_id=model)
+                .filter_by(id=session_ref.id)
                 .options(selectinload(ChatSession.text_queries))
                 .options(selectinload(ChatSession.image_queries))
             )
             result = await session.execute(query)
-            session_chat = result.unique().scalars().first()
-            if not session_chat:
-                session_chat = ChatSession(
-                    profile_id=profile.id,
-                    ai_model_id=model,
-                    name='Новый диалог 1',
-                )
-                session.add(session_chat)
-                await session.commit()
-                await session.refresh(session_chat)
-            return session_chat
+            return result.unique().scalars().first()
 
     async def active_generic_in_session(self, chat_session_id: int) -> bool:
         """Включи статус генерации в указанной сессии"""
@@ -562,55 +820,58 @@ class ApiProfileAsync(DBApiAsync):
             await session.refresh(profile_obj)
             return profile_obj
 
-    async def subtracting_count_request_to_model_chatgpt_4o(self, profile_id: int) -> str:
-        """Удали кол-во токенов запроса"""
+    async def spend_quota(self, profile_id: int, model_id: str, add_request: bool = False) -> QuotaSpend:
+        """Спиши один запрос из дневного лимита модели одним условным UPDATE
+
+        Если лимит исчерпан, строка не обновляется и возвращается QuotaSpend(False).
+        """
+        column = QUOTA_COLUMNS[model_id]
+        current = column
+        values = {}
+        query = update(Profile).where(Profile.id == profile_id)
+        if settings.LAZY_LIMITS_RESET:
+            # В первом запросе после начала суток лимиты берутся из тарифа в этом же UPDATE
+            today = msk_today()
+            stale = limits_is_stale(today)
+            for profile_column, tariff_column in TARIFF_LIMIT_COLUMNS.items():
+                values[profile_column] = case((stale, tariff_column), else_=profile_column)
+            values[Profile.limits_reset_date] = case((stale, today), else_=Profile.limits_reset_date)
+            current = values[column]
+            query = query.where(Tariff.id == Profile.tariff_id)
+        values[column] = case((current > 0, current - 1), else_=current)
+        if add_request:
+            values[Profile.count_request] = Profile.count_request + 1
         async with self.async_session_db() as session:
-            profile_obj = await session.get(Profile, profile_id)
-            profile_obj.chatgpt_4o_daily_limit -= 1
+            query = (
+                query
+                .where(or_(current > 0, current == -1))
+                .values(values)
+                .returning(column)
+                .execution_options(synchronize_session=False)
+            )
+            result = await session.execute(query)
+            remaining = result.scalar()
             await session.commit()
-            return "Ok"
+        if remaining is None:
+            return QuotaSpend(is_spent=False)
+        return QuotaSpend(is_spent=True, remaining=remaining)
 
-    async def subtracting_count_request_to_model_chatgpt_4o_mini(self, profile_id: int) -> str:
-        """Вычти кол-во допустимых запросов к модели chatgpt_4o_mini на 1 для пользователя."""
-        async with self.async_session_db() as session:
-            profile_id = await session.get(Profile, profile_id)
-            profile_id.chatgpt_4o_mini_daily_limit -= 1
-            await session.commit()
-            return "Ok"
+    async def subtracting_count_request_to_model_chatgpt_4o(self, profile_id: int) -> QuotaSpend:
+        """Удали кол-во токенов запроса"""
+        return await self.spend_quota(profile_id, AiModelName.GPT_4_O.value)
 
-    async def subtracting_count_request_to_model_mj(self, profile_id: int, version: str) -> Profile:
+    async def subtracting_count_request_to_model_chatgpt_4o_mini(self, profile_id: int) -> QuotaSpend:
         """Вычти кол-во допустимых запросов к модели chatgpt_4o_mini на 1 для пользователя."""
-        async with self.async_session_db() as session:
-            profile = await session.get(Profile, profile_id)
-            if version == '5.2':
-                profile.mj_daily_limit_5_2 -= 1
-            elif version == "6.0":
-                profile.mj_daily_limit_6_0 -= 1
-            profile.count_request += 1
-            await session.commit()
-            await session.refresh(profile)
-            return profile
+        return await self.spend_quota(profile_id, AiModelName.GPT_4_O_MINI.value)
 
-    async def subtracting_count_request_to_model_gpt(self, profile_id: int, model_id: str) -> Profile:
-        """Вычти кол-во допустимых запросов к модели chatgpt_4o_mini на 1 для пользователя."""
-        async with self.async_session_db() as session:
-            query = (
-                select(Profile)
-                .filter_by(id=profile_id)
-                .options(joinedload(Profile.tariffs))
-                .options(joinedload(Profile.ai_models_id))
-            )
-            result = await session.execute(query)
-            profile = result.unique().scalars().first()
-            if model_id == AiModelName.GPT_4_O.value:
-                profile.chatgpt_4o_daily_limit -= 1
-            elif model_id == AiModelName.GPT_O1_PREVIEW.value:
-                profile.chatgpt_o1_preview_daily_limit -= 1
-            elif model_id == AiModelName.GPT_O1_MINI.value:
-                profile.chatgpt_o1_mini_daily_limit -= 1
-            await session.commit()
-            await session.refresh(profile)
-            return profile
+    async def subtracting_count_request_to_model_mj(self, profile_id: int, version: str) -> QuotaSpend:
+        """Вычти кол-во допустимых запросов к модели midjourney на 1 для пользователя."""
+        model_id = AiModelName.MIDJOURNEY_5_2.value if version == '5.2' else AiModelName.MIDJOURNEY_6_0.value
+        return await self.spend_quota(profile_id, model_id, add_request=True)
+
+    async def subtracting_count_request_to_model_gpt(self, profile_id: int, model_id: str) -> QuotaSpend:
+        """Вычти кол-во допустимых запросов к модели gpt на 1 для пользователя."""
+        return await self.spend_quota(profile_id, model_id)
 
     async def add_request_count(self, profile_id: int) -> Profile:
         """Добавь кол-во запросов пользователю."""
@@ -628,23 +889,60 @@ class ApiProfileAsync(DBApiAsync):
             await session.refresh(profile)
             return profile
 
-    async def check_have_profile(self, tgid: int):
-        """Проверь есть ли пользователь в бд или нет"""
-        async with self.async_session_db() as session:
-            query = (
-                select(Profile)
-                .filter_by(tgid=tgid)
-                .options(joinedload(Profile.tariffs))
-                .options(joinedload(Profile.ai_models_id))
+    async def apply_quota_deltas(self, deltas: dict[str, dict[str, int]], day: date) -> str:
+        """Спиши накопленные в redis за сутки day запросы из лимитов и прибавь их к count_request одной транзакцией
+
+        deltas: {id пользователя: {название колонки лимита или count_request: кол-во}}
+        Если лимиты пользователя уже обновлены на более поздние сутки, списания day к ним не применяются.
+        Лимиты, еще не обновленные на сутки day, в том же UPDATE обновляются из тарифа и только потом уменьшаются.
+        """
+        if not deltas:
+            return "Ok"
+        table = Profile.__table__
+        limit_fields = [column.key for column in QUOTA_COLUMNS.values()]
+        # Лимиты, не обновленные на сутки day, сначала берутся из тарифа, как в spend_quota при LAZY_LIMITS_RESET
+        stale = limits_is_stale(day)
+        values = {}
+        for profile_column, tariff_column in TARIFF_LIMIT_COLUMNS.items():
+            field = profile_column.key
+            tariff_limit = select(tariff_column).where(Tariff.id == table.c.tariff_id).scalar_subquery()
+            current = case((stale, tariff_limit), else_=table.c[field])
+            values[field] = case(
+                (current < 0, current),
+                (table.c.limits_reset_date > day, table.c[field]),
+                else_=func.greatest(current - bindparam(f"delta_{field}"), 0),
             )
-            result = await session.execute(query)
-            profile = result.unique().scalars().first()
-            if profile:
-                return profile
-            return None
+        values["limits_reset_date"] = case((stale, day), else_=table.c.limits_reset_date)
+        values["count_request"] = table.c.count_request + bindparam("delta_count_request")
+        query = update(table).where(table.c.id == bindparam("profile_id")).values(values)
+        params = [
+            {
+                "profile_id": UUID(str(profile_id)),
+                **{f"delta_{field}": counters.get(field, 0) for field in limit_fields + ["count_request"]},
+            }
+            for profile_id, counters in deltas.items()
+        ]
+        async with self.async_session_db() as session:
+            await session.execute(query, params)
+            await session.commit()
+        return "Ok"
+
+    @staticmethod
+    def _select_profile_read():
+        """Запрос профиля с тарифом и моделью плоскими колонками для ProfileRead.from_row"""
+        return (
+            select(*PROFILE_READ_COLUMNS, *TARIFF_READ_COLUMNS, *AI_MODEL_READ_COLUMNS)
+            .select_from(Profile)
+            .outerjoin(Tariff, Tariff.id == Profile.tariff_id)
+            .outerjoin(AiModel, AiModel.code == Profile.ai_model_id)
+        )
+
+    async def check_have_profile(self, tgid: int) -> Profile | None:
+        """Проверь есть ли пользователь в бд или нет"""
+        return await self.get_profile(tgid)
 
     async def get_profile(self, tgid: int) -> Profile | None:
-        """Создай пользователя если его нет в бд"""
+        """Получи пользователя с тарифом и моделью или None, если его нет в бд"""
         async with self.async_session_db() as session:
             query = (
                 select(Profile)
@@ -652,13 +950,40 @@ class ApiProfileAsync(DBApiAsync):
                 .options(joinedload(Profile.tariffs))
                 .options(joinedload(Profile.ai_models_id))
             )
-            result = await session.execute(query)
-            profile = result.unique().scalars().first()
-            if profile:
-                return profile
-            return None
+            profile = (await session.execute(query)).unique().scalars().first()
+            if profile is not None and self.need_refresh_limits(profile):
+                await session.execute(self._refresh_limits_query(profile.id))
+                await session.commit()
+                query = query.execution_options(populate_existing=True)
+                profile = (await session.execute(query)).unique().scalars().first()
+            return profile
+
+    async def get_profile_read(self, tgid: int) -> ProfileRead | None:
+        """Получи пользователя только для чтения или None, если его нет в бд"""
+        async with self.async_session_db() as session:
+            query = self._select_profile_read().where(Profile.tgid == tgid)
+            row = (await session.execute(query)).first()
+            if row is None:
+                return None
+            profile = ProfileRead.from_row(row)
+            if self.need_refresh_limits(profile):
+                await session.execute(self._refresh_limits_query(profile.id))
+                await session.commit()
+                profile = ProfileRead.from_row((await session.execute(query)).first())
+            return profile
 
-    async def get_admin_profiles(self) -> Optional[Profile]:
+    @staticmethod
+    def limits_outdated(profile: Profile | ProfileRead) -> bool:
+        """Проверь, что дневные лимиты профиля с подпиской не обновлены на текущие сутки (мск)"""
+        if profile.tariff_id != 2:
+            return False
+        return profile.limits_reset_date is None or profile.limits_reset_date < msk_today()
+
+    def need_refresh_limits(self, profile: Profile | ProfileRead) -> bool:
+        """Проверь, нужно ли обновить дневные лимиты профиля в режиме LAZY_LIMITS_RESET"""
+        return settings.LAZY_LIMITS_RESET and self.limits_outdated(profile)
+
+    async def get_admin_profiles(self) -> list[Profile]:
         async with self.async_session_db() as session:
             query = (
                 select(Profile)
@@ -667,66 +992,112 @@ class ApiProfileAsync(DBApiAsync):
                 .options(joinedload(Profile.ai_models_id))
             )
             result = await session.execute(query)
-            profile = result.unique().scalars().all()
-            return profile
+            return result.unique().scalars().all()
 
-    async def create_profile(self, tgid: int, username: str, first_name: str, last_name: str, url: str, referal_link_id: int = None):
+    async def get_admin_profiles_read(self) -> list[ProfileRead]:
         async with self.async_session_db() as session:
-            profile = Profile(
-                username=username,
-                tgid=tgid,
-                first_name=first_name,
-                last_name=last_name,
-                url_telegram=url,
-                tariff_id=1
-            )
-            if referal_link_id:
-                profile.referal_link_id = referal_link_id
-            session.add(profile)
-            await session.commit()
-            query = (
-                select(Profile)
-                .filter_by(tgid=tgid)
-                .options(joinedload(Profile.tariffs))
-                .options(joinedload(Profile.ai_models_id))
-            )
+            query = self._select_profile_read().where(Profile.is_admin == True)
             result = await session.execute(query)
-            profile = result.unique().scalars().first()
-            return profile
+            return [ProfileRead.from_row(row) for row in result]
+
+    async def create_profile(self, tgid: int, username: str, first_name: str, last_name: str, url: str, referal_link_id: int = None):
+        return await self.get_or_create_profile(tgid, username, first_name, last_name, url, referal_link_id)
 
-    async def get_or_create_profile(self, tgid: int, username: str, first_name: str, last_name: str, url: str, referal_link_id: int = None):
+    async def get_or_create_profile(self, tgid: int, username: str, first_name: str, last_name: str, url: str, referal_link_id: int = None) -> Profile:
         """Создай пользователя если его нет в бд"""
-        async with self.async_session_db() as session:
-            query = (
-                select(Profile)
-                .filter_by(tgid=tgid)
-                .options(joinedload(Profile.tariffs))
-                .options(joinedload(Profile.ai_models_id))
+        await self.upsert_profile(tgid, username, first_name, last_name, url, referal_link_id, count_referral=False)
+        return await self.get_profile(tgid)
+
+    async def get_or_create_profile_read(self, tgid: int, username: str, first_name: str, last_name: str, url: str,
+                                         referal_link_id: int = None) -> ProfileRead:
+        """Создай пользователя если его нет в бд и верни его только для чтения"""
+        result = await self.upsert_profile(tgid, username, first_name, last_name, url, referal_link_id,
+                                           count_referral=False)
+        return result.profile
+
+    async def upsert_profile(self, tgid: int, username: str, first_name: str, last_name: str, url: str,
+                             referal_link_id: int = None, count_referral: bool = True) -> ProfileUpsert:
+        """Зарегистрируй пользователя одним запросом и верни профиль с тарифом и моделью
+
+        INSERT ... ON CONFLICT (tgid) DO NOTHING и выборка существующей строки, если вставки не было, как
+        в get_or_create_session_ref: повторный /start не переписывает строку профиля. Реферальная ссылка
+        записывается только новому пользователю, и при count_referral в том же запросе прибавляется
+        count_new_users ссылки.
+        """
+        inserted = (
+            pg_insert(Profile)
+            .values(tgid=tgid, username=username, first_name=first_name, last_name=last_name, url_telegram=url,
+                    tariff_id=1, referal_link_id=referal_link_id or None)
+            .on_conflict_do_nothing(index_elements=[Profile.tgid])
+            .returning(*Profile.__table__.c)
+            .cte("inserted")
+        )
+        upserted = union_all(
+            select(*inserted.c, true().label("is_created")),
+            select(*Profile.__table__.c, false().label("is_created")).where(Profile.tgid == tgid),
+        ).limit(1).subquery("upserted")
+        query = (
+            select(*(upserted.c[column.key] for column in PROFILE_READ_COLUMNS), *TARIFF_READ_COLUMNS,
+                   *AI_MODEL_READ_COLUMNS, upserted.c.is_created)
+            .select_from(upserted)
+            .outerjoin(Tariff, Tariff.id == upserted.c.tariff_id)
+            .outerjoin(AiModel, AiModel.code == upserted.c.ai_model_id)
+            .add_cte(inserted)
+        )
+        if referal_link_id and count_referral:
+            counted = (
+                update(RefLink)
+                .where(RefLink.id == referal_link_id)
+                .where(select(inserted.c.id).exists())
+                .values(count_new_users=func.coalesce(RefLink.count_new_users, 0) + 1)
+                .cte("counted")
             )
-            result = await session.execute(query)
-            profile = result.unique().scalars().first()
-            if not profile:
-                profile = Profile(
-                    username=username,
-                    tgid=tgid,
-                    first_name=first_name,
-                    last_name=last_name,
-                    url_telegram=url,
-                    tariff_id=1
+            query = query.add_cte(counted)
+        async with self.async_session_db() as session:
+            row = (await session.execute(query)).first()
+            if row is None:
+                # Профиль одновременно вставил другой запрос: он виден новому снимку следующего запроса
+                row = (await session.execute(query)).first()
+            await session.commit()
+            return ProfileUpsert(profile=ProfileRead.from_row(row[:-1]), is_created=row[-1])
+
+    async def import_profiles(self, profiles: list[dict], chunk_size: int = 1000) -> int:
+        """Импортируй пользователей пачками. Существующие tgid пропускаются. Вернет кол-во созданных
+
+        Словари с ключами tgid, username, first_name, last_name, url_telegram, referal_link_id (обязателен только
+        tgid). Счетчики новых пользователей реферальных ссылок прибавляются в том же запросе, что и вставка.
+        """
+        columns = ("tgid", "username", "first_name", "last_name", "url_telegram", "referal_link_id")
+        created = 0
+        async with self.async_session_db() as session:
+            for i in range(0, len(profiles), chunk_size):
+                chunk = [
+                    {"tariff_id": 1, **{column: profile.get(column) for column in columns}}
+                    for profile in profiles[i:i + chunk_size]
+                ]
+                inserted = (
+                    pg_insert(Profile)
+                    .values(chunk)
+                    .on_conflict_do_nothing(index_elements=[Profile.tgid])
+                    .returning(Profile.id, Profile.referal_link_id)
+                    .cte("inserted")
                 )
-                if referal_link_id:
-                    profile.referal_link_id = referal_link_id
-                session.add(profile)
-                await session.commit()
-                query = (
-                    select(Profile)
-                    .filter_by(tgid=tgid)
-                    .options(joinedload(Profile.tariffs))
-                    .options(joinedload(Profile.ai_models_id))
+                referrals = (
+                    select(inserted.c.referal_link_id, func.count().label("count"))
+                    .where(inserted.c.referal_link_id.isnot(None))
+                    .group_by(inserted.c.referal_link_id)
+                    .subquery()
                 )
-                result = await session.execute(query)
-                profile = result.unique().scalars().first()
-            return profile
+                counted = (
+                    update(RefLink)
+                    .where(RefLink.id == referrals.c.referal_link_id)
+                    .values(count_new_users=func.coalesce(RefLink.count_new_users, 0) + referrals.c.count)
+                    .cte("counted")
+                )
+                query = select(func.count()).select_from(inserted).add_cte(counted)
+                created += (await session.execute(query)).scalar()
+            await session.commit()
+        return created
 
     async def get_profiles_finish_sub(self):
         """Получить пользователей с закончившей подпиской"""
@@ -755,24 +1126,81 @@ class ApiProfileAsync(DBApiAsync):
             result = await session.execute(query)
             profile = result.scalars().first()
 
-            profile.tariff_id = 1
-            profile.chatgpt_4o_mini_daily_limit = -1
-            profile.chatgpt_4o_daily_limit = 0
-            profile.mj_daily_limit_5_2 = 0
-            profile.mj_daily_limit_6_0 = 0
-            profile.chatgpt_o1_preview_daily_limit = 0
-            profile.chatgpt_o1_mini_daily_limit = 0
-            profile.date_subscription = None
+            for key, value in FREE_TARIFF_VALUES.items():
+                setattr(profile, key, value)
 
             await session.commit()
             return "Ok"
 
+    async def expire_subscriptions(self, batch_size: int = 1000) -> list[int]:
+        """Переведи всех пользователей с закончившейся подпиской на бесплатный тариф
+
+        Обновление идет пачками по batch_size строк, каждая пачка в своей транзакции.
+        Возвращает tgid всех пользователей, у которых закончилась подписка.
+        """
+        tgids = []
+        while True:
+            async with self.async_session_db() as session:
+                batch = (
+                    select(Profile.id)
+                    .filter_by(tariff_id=2)
+                    .filter(Profile.date_subscription <= func.now())
+                    .limit(batch_size)
+                    .with_for_update(skip_locked=True)
+                    .scalar_subquery()
+                )
+                query = (
+                    update(Profile)
+                    .where(Profile.id.in_(batch))
+                    .values(**FREE_TARIFF_VALUES)
+                    .returning(Profile.tgid)
+                    .execution_options(synchronize_session=False)
+                )
+                result = await session.execute(query)
+                batch_tgids = result.scalars().all()
+                await session.commit()
+            tgids.extend(batch_tgids)
+            if len(batch_tgids) < batch_size:
+                return tgids
+
+    @staticmethod
+    def _refresh_limits_query(profile_id: int):
+        """Запрос обновления дневных лимитов пользователя из тарифа, если они не обновлялись с начала суток (мск)"""
+        today = msk_today()
+        values = {profile_column: tariff_column for profile_column, tariff_column in TARIFF_LIMIT_COLUMNS.items()}
+        values[Profile.limits_reset_date] = today
+        return (
+            update(Profile)
+            .where(Profile.id == profile_id)
+            .where(Tariff.id == Profile.tariff_id)
+            .where(limits_is_stale(today))
+            .values(values)
+            .returning(Profile.id)
+            .execution_options(synchronize_session=False)
+        )
+
+    async def refresh_daily_limits(self, profile_id: int) -> bool:
+        """Обнови дневные лимиты пользователя из тарифа, если они не обновлялись с начала суток (мск)"""
+        async with self.async_session_db() as session:
+            result = await session.execute(self._refresh_limits_query(profile_id))
+            is_updated = result.scalar() is not None
+            await session.commit()
+        return is_updated
+
     async def update_limits_profile(self):
-        """Обнови дневной баланс пользователей"""
+        """Обнови дневной баланс пользователей
+
+        При LAZY_LIMITS_RESET лимиты обновляются при первом запросе пользователя за сутки, задача ничего не делает.
+        Профили, лимиты которых на эти сутки уже обновил flush_quota, пропускаются.
+        """
+        if settings.LAZY_LIMITS_RESET:
+            return "Ok"
+        # Дата обновления нужна flush_quota, чтобы не списать вчерашние запросы из новых лимитов
+        today = msk_today()
         async with self.async_session_db() as session:
             query = (
                 select(Profile)
-                .filter_by(tariff_id=2)
+                .where(limits_is_stale(today))
                 .options(joinedload(Profile.tariffs))
                 .options(joinedload(Profile.ai_models_id))
             )
@@ -786,6 +1214,7 @@ class ApiProfileAsync(DBApiAsync):
                 profile_obj.mj_daily_limit_6_0 = 20
                 profile_obj.chatgpt_o1_preview_daily_limit = 20
                 profile_obj.chatgpt_o1_mini_daily_limit = 60
+                profile_obj.limits_reset_date = today
 
             await session.commit()
             return "Ok"
@@ -844,19 +1273,10 @@ class ApiProfileAsync(DBApiAsync):
             )
             result = await session.execute(query)
             profile_obj = result.unique().scalars().first()
-            profile_obj.tariff_id = tariff_id
-            profile_obj.recurring = recurring
-            profile_obj.chatgpt_4o_mini_daily_limit = -1
-            profile_obj.chatgpt_4o_daily_limit = 100
-            profile_obj.mj_daily_limit_5_2 = 45
-            profile_obj.mj_daily_limit_6_0 = 20
-            profile_obj.chatgpt_o1_preview_daily_limit = 20
-            profile_obj.chatgpt_o1_mini_daily_limit = 60
+            for key, value in subscription_values(tariff_id, recurring).items():
+                setattr(profile_obj, key, value)
             if tariff_id == 3:
-                profile_obj.date_subscription = datetime.now() + timedelta(days=3)
                 profile_obj.is_promo = True
-            elif tariff_id == 2:
-                profile_obj.date_subscription = datetime.now() + timedelta(days=30)
             await session.commit()
             await session.refresh(profile_obj)
             return profile_obj
@@ -868,35 +1288,27 @@ class ApiTariffAsync(DBApiAsync):
             tariff_obj = await session.get(Tariff, tariff_id)
             return tariff_obj
 
+    async def get_tariff_read(self, tariff_id: int) -> TariffRead | None:
+        """Получи тариф только для чтения"""
+        async with self.async_session_db() as session:
+            result = await session.execute(select(*TARIFF_READ_COLUMNS).where(Tariff.id == tariff_id))
+            row = result.first()
+            return TariffRead(*row) if row else None
+
     async def get_sum_payment_profile_for_ref_link(self, ref_link: str, currency: str):
         """Получить сумму оплат пользователей по реферальной ссылке"""
         async with self.async_session_db() as session:
-            # Шаг 1: Получаем все Invoice.id
-            invoice_query = (
-                select(Invoice.id)  # Выбираем ID из Invoice
-                .join(Profile, Profile.id == Invoice.profile_id)  # Соединяем с Profile
+            query = (
+                select(func.sum(Tariff.price_rub if currency == PaymentName.ROBOKASSA.name else Tariff.price_stars))
+                .select_from(Profile)
+                .join(Invoice, Invoice.profile_id == Profile.id)
+                .join(Tariff, Tariff.id == Invoice.tariff_id)
                 .where(Profile.referal_link_id == ref_link)  # Фильтруем по реферальной ссылке
                 .where(Invoice.provider == currency)  # Фильтруем по провайдеру
                 .where(Invoice.is_paid == True)  # Фильтруем только оплаченные инвойсы
             )
-
-            result = await session.execute(invoice_query)  # Выполняем запрос
-            invoice_ids = result.scalars().all()  # Получаем все ID инвойсов
-
-            if not invoice_ids:  # Если инвойсов нет, возвращаем 0
-                return 0
-
-            # Шаг 2: Суммируем все tariff_id.price_rub
-            sum_query = (
-                select(func.sum(Tariff.price_rub if currency == PaymentName.ROBOKASSA.name else Tariff.price_stars))  # Суммируем price_rub из Tariff
-                .join(Invoice, Invoice.tariff_id == Tariff.id)  # Соединяем с Invoice
-                .where(Invoice.id.in_(invoice_ids))  # Фильтруем по найденным Invoice.id
-            )
-
-            sum_result = await session.execute(sum_query)  # Выполняем запрос
-            total_price_rub = sum_result.scalar() or 0  # Получаем сумму или 0, если нет результатов
-
-        return total_price_rub  # Возвращаем общую сумму
+            result = await session.execute(query)
+            return result.scalar() or 0
 
     async def get_sum_sub(self, provider):
         async with self.async_session_db() as session:
@@ -944,4 +1356,259 @@ class ApiAiModelAsync(DBApiAsync):
             result = await session.execute(select(AiModel))
             ai_models = result.scalars().all()
             ai_models_dict = {model.code: model for model in ai_models}
-        return ai_models_dict
\ No newline at end of file
+        return ai_models_dict
+
+    async def get_all_ai_model_reads(self) -> dict[str, AiModelRead]:
+        """Получи все модели нейронок только для чтения в виде словаря"""
+        async with self.async_session_db() as session:
+            result = await session.execute(select(*AI_MODEL_READ_COLUMNS))
+            return {row.code: AiModelRead(*row) for row in result}
+
+
+class ApiStatAsync(DBApiAsync):
+    """Посуточные агрегаты статистики для админки"""
+
+    @staticmethod
+    def _day_bounds(day: date) -> tuple[datetime, datetime]:
+        """Границы суток по мск во времени utc, в котором хранятся created_at и paid_at"""
+        start = datetime.combine(day, time.min) - timedelta(hours=3)
+        return start, start + timedelta(days=1)
+
+    def _daily_stat_selects(self, day: date) -> list:
+        """Запросы, считающие показатели за сутки из основных таблиц: (day, metric, key, value)"""
+        start, end = self._day_bounds(day)
+        day_value = literal(day)
+        provider = cast(Invoice.provider, String)
+        model = func.coalesce(ChatSession.ai_model_id, "")
+        previous = aliased(Invoice)
+        # Ранее оплаченный инвойс того же пользователя и способа оплаты
+        paid_before = (
+            select(previous.id)
+            .where(previous.profile_id == Invoice.profile_id)
+            .where(previous.provider == Invoice.provider)
+            .where(previous.is_paid == True)
+            .where(previous.paid_at < Invoice.paid_at)
+            .exists()
+        )
+        # Оплата попадает в сутки, когда она прошла, а не когда был выставлен счет
+        paid_for_day = and_(Invoice.is_paid == True, Invoice.paid_at >= start, Invoice.paid_at < end)
+        return [
+            select(day_value, literal("requests"), model, func.count())
+            .select_from(TextQuery)
+            .join(ChatSession, TextQuery.chat_session_id == ChatSession.id)
+            .where(TextQuery.created_at >= start, TextQuery.created_at < end)
+            .group_by(model),
+            select(day_value, literal("requests"), model, func.count())
+            .select_from(ImageQuery)
+            .join(ChatSession, ImageQuery.chat_session_id == ChatSession.id)
+            .where(ImageQuery.created_at >= start, ImageQuery.created_at < end)
+            .group_by(model),
+            select(day_value, literal("new_users"), literal(""), func.count())
+            .where(Profile.created_at >= start, Profile.created_at < end),
+            select(day_value, literal("new_users_ref"), literal(""), func.count())
+            .where(Profile.created_at >= start, Profile.created_at < end)
+            .where(Profile.referal_link_id.isnot(None)),
+            select(day_value, literal("ref_links"), literal(""), func.count())
+            .where(RefLink.created_at >= start, RefLink.created_at < end),
+            # Продажи и оборот считаются по тарифу подписки, как в get_sum_sub
+            select(day_value, literal("sales"), provider, func.count())
+            .where(paid_for_day, Invoice.tariff_id == 2)
+            .group_by(provider),
+            select(day_value, literal("revenue"), provider,
+                   func.coalesce(func.sum(case((Invoice.provider == PaymentName.STARS, Tariff.price_stars),
+                                               else_=Tariff.price_rub)), 0))
+            .select_from(Invoice)
+            .join(Tariff, Tariff.id == Invoice.tariff_id)
+            .where(paid_for_day, Invoice.tariff_id == 2)
+            .group_by(provider),
+            # Первая оплата пользователя этим способом: сумма по всем суткам дает число подписчиков
+            select(day_value, literal("subscribers"), provider, func.count(Invoice.profile_id.distinct()))
+            .where(paid_for_day, ~paid_before)
+            .group_by(provider),
+            select(day_value, literal("renewals"), literal(""), func.count())
+            .where(paid_for_day, Invoice.provider == PaymentName.ROBOKASSA, paid_before),
+            select(day_value, literal("active_users"), literal(""), func.count())
+            .where(DailyActiveProfile.day == day),
+        ]
+
+    async def refresh_daily_stats(self, day: date) -> str:
+        """Пересчитай агрегаты статистики за сутки по мск. Запросы ограничены сутками и идут по индексам дат"""
+        start, end = self._day_bounds(day)
+        active_profiles = union_all(
+            select(ChatSession.profile_id)
+            .join(TextQuery, TextQuery.chat_session_id == ChatSession.id)
+            .where(TextQuery.created_at >= start, TextQuery.created_at < end),
+            select(ChatSession.profile_id)
+            .join(ImageQuery, ImageQuery.chat_session_id == ChatSession.id)
+            .where(ImageQuery.created_at >= start, ImageQuery.created_at < end),
+        ).subquery()
+        async with self.async_session_db() as session:
+            await session.execute(
+                pg_insert(DailyActiveProfile)
+                .from_select(
+                    ["day", "profile_id"],
+                    select(literal(day), active_profiles.c.profile_id)
+                    .where(active_profiles.c.profile_id.isnot(None))
+                    .distinct(),
+                )
+                .on_conflict_do_nothing()
+            )
+            await session.execute(delete(DailyStat).where(DailyStat.day == day))
+            await session.execute(
+                insert(DailyStat).from_select(
+                    ["day", "metric", "key", "value"], union_all(*self._daily_stat_selects(day))
+                )
+            )
+            await session.commit()
+            return "Ok"
+
+    async def get_basic_stat(self) -> dict[str, int]:
+        """Получи показатели экрана общей статистики одним запросом по агрегатам.
+
+        Вернет аргументы для BotStatTemplate.generate_basic_stat. Запросы из чата (gpt_chat_requests,
+        img_chat_requests) в бд не хранятся и не заполняются.
+        """
+        today = msk_today()
+        totals = (
+            select(
+                DailyStat.metric,
+                DailyStat.key,
+                func.coalesce(func.sum(DailyStat.value).filter(DailyStat.day == today), 0),
+                func.sum(DailyStat.value),
+            )
+            .group_by(DailyStat.metric, DailyStat.key)
+        )
+        mau_month = (
+            select(literal("mau_month"), literal(""), func.count(DailyActiveProfile.profile_id.distinct()),
+                   literal(0))
+            .where(DailyActiveProfile.day > today - timedelta(days=30))
+        )
+        async with self.async_session_db() as session:
+            result = await session.execute(union_all(totals, mau_month))
+            rows = result.all()
+
+        day_values = {(metric, key): int(value or 0) for metric, key, value, _ in rows}
+        total_values = {(metric, key): int(value or 0) for metric, key, _, value in rows}
+        stars, robokassa = PaymentName.STARS.name, PaymentName.ROBOKASSA.name
+        requests = {key: value for (metric, key), value in day_values.items() if metric == "requests"}
+        return {
+            "total_users": total_values.get(("new_users", ""), 0),
+            "ref_links": total_values.get(("ref_links", ""), 0),
+            "new_users": day_values.get(("new_users", ""), 0),
+            "new_users_with_ref": day_values.get(("new_users_ref", ""), 0),
+            "mau_day": day_values.get(("active_users", ""), 0),
+            "mau_month": day_values.get(("mau_month", ""), 0),
+            "total_requests": sum(requests.values()),
+            "chatgpt_4o": requests.get(AiModelName.GPT_4_O.value, 0),
+            "chatgpt_4o_mini": requests.get(AiModelName.GPT_4_O_MINI.value, 0),
+            "chatgpt_o1_preview": requests.get(AiModelName.GPT_O1_PREVIEW.value, 0),
+            "chatgpt_o1_mini": requests.get(AiModelName.GPT_O1_MINI.value, 0),
+            "midjourney": requests.get(AiModelName.MIDJOURNEY_5_2.value, 0)
+                          + requests.get(AiModelName.MIDJOURNEY_6_0.value, 0),
+            "telegram_stars_subs": total_values.get(("subscribers", stars), 0),
+            "telegram_stars_sales": total_values.get(("sales", stars), 0),
+            "telegram_stars_sum": total_values.get(("revenue", stars), 0),
+            "robokassa_subs": total_values.get(("subscribers", robokassa), 0),
+            "new_robokassa_subs": total_values.get(("sales", robokassa), 0),
+            "new_robokassa_sum": total_values.get(("revenue", robokassa), 0),
+            "renewals": total_values.get(("renewals", ""), 0),
+        }
+
+
+class ApiOutboxAsync(DBApiAsync):
+    async def dispatch(self, handler, batch_size: int = 500, max_attempts: int = 10) -> int:
+        """Обработай пачку событий outbox. Вернет кол-во обработанных событий
+
+        События блокируются FOR UPDATE SKIP LOCKED, поэтому диспетчеры в разных процессах не берут одни и те же.
+        Статистика реферальных ссылок применяется в той же транзакции, что и удаление событий, затем вызывается
+        handler(events) для побочных действий вне бд. При ошибке пачка обрабатывается заново по одному событию:
+        ошибочные события получают attempts + 1 и будут обработаны повторно (at-least-once), поэтому handler
+        должен быть идемпотентным. События с attempts >= max_attempts больше не выбираются и остаются в таблице
+        как dead letter до retry_dead_letters.
+        """
+        async with self.async_session_db() as session:
+            events = (await session.execute(self._pending_query(batch_size, max_attempts))).all()
+            if not events:
+                return 0
+            try:
+                await self._apply_events(session, events, handler)
+                await session.commit()
+                return len(events)
+            except Exception as e:
+                await session.rollback()
+                if len(events) == 1:
+                    await self._record_failure(session, events[0].id, e)
+                    return 0
+
+        dispatched = 0
+        for event in events:
+            async with self.async_session_db() as session:
+                query = self._pending_query(1, max_attempts).where(OutboxEvent.id == event.id)
+                locked = (await session.execute(query)).all()
+                if not locked:
+                    continue
+                try:
+                    await self._apply_events(session, locked, handler)
+                    await session.commit()
+                    dispatched += 1
+                except Exception as e:
+                    await session.rollback()
+                    await self._record_failure(session, event.id, e)
+        return dispatched
+
+    @staticmethod
+    def _pending_query(limit: int, max_attempts: int):
+        return (
+            select(OutboxEvent.id, OutboxEvent.kind, OutboxEvent.payload)
+            .where(OutboxEvent.attempts < max_attempts)
+            .order_by(OutboxEvent.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+
+    @staticmethod
+    async def _apply_events(session, events, handler):
+        """Примени статистику ссылок, вызови handler и удали события в транзакции session"""
+        deltas = {}
+        for event in events:
+            link_id = event.payload.get("referal_link_id")
+            if event.kind != OutboxKind.PAYMENT.value or not link_id:
+                continue
+            counters = deltas.setdefault(link_id, {})
+            is_stars = event.payload["category"] == PaymentName.STARS.value
+            sum_field = "sum_buys_stars" if is_stars else "sum_buys_rub"
+            counters["count_buys"] = counters.get("count_buys", 0) + 1
+            counters[sum_field] = counters.get(sum_field, 0) + event.payload["sum_buy"]
+        if deltas:
+            await session.execute(*ref_counter_deltas_statement(deltas))
+        await handler(events)
+        await session.execute(delete(OutboxEvent).where(OutboxEvent.id.in_([event.id for event in events])))
+
+    @staticmethod
+    async def _record_failure(session, event_id: int, error: Exception):
+        await session.execute(
+            update(OutboxEvent)
+            .where(OutboxEvent.id == event_id)
+            .values(attempts=OutboxEvent.attempts + 1, last_error=repr(error)[:500])
+        )
+        await session.commit()
+
+    async def get_dead_letters(self, max_attempts: int = 10) -> list[OutboxEvent]:
+        """Получи события, которые больше не обрабатываются из-за превышения попыток"""
+        async with self.async_session_db() as session:
+            query = select(OutboxEvent).where(OutboxEvent.attempts >= max_attempts).order_by(OutboxEvent.id)
+            return list((await session.execute(query)).scalars())
+
+    async def retry_dead_letters(self, max_attempts: int = 10) -> int:
+        """Верни события с превышением попыток в обработку. Вернет кол-во событий"""
+        async with self.async_session_db() as session:
+            result = await session.execute(
+                update(OutboxEvent).where(OutboxEvent.attempts >= max_attempts).values(attempts=0)
+            )
+            await session.commit()
+            return result.rowcount
+
+    async def get_backlog(self) -> int:
+        """Получи кол-во необработанных событий outbox"""
+        async with self.async_session_db() as session:
+            return (await session.execute(select(func.count()).select_from(OutboxEvent))).scalar()
@@ -0,0 +1,99 @@
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from config import settings
+
+
+@dataclass
+class PoolStats:
+    """Статистика выдачи соединений из пула"""
+    checkouts: int = 0
+    checkins: int = 0
+    connects: int = 0
+    waits: int = 0
+    wait_time_total: float = 0.0
+    wait_time_max: float = 0.0
+    checked_out_max: int = 0
+
+    def record_wait(self, seconds: float):
+        """Запомни время ожидания соединения"""
+        self.waits += 1
+        self.wait_time_total += seconds
+        self.wait_time_max = max(self.wait_time_max, seconds)
+
+
+pool_stats = PoolStats()
+
+
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+    """Пул соединений, который замеряет время ожидания свободного соединения"""
+
+    def _do_get(self):
+        # Ожиданием считается только выдача при занятом пуле: свободных нет и overflow исчерпан
+        if not self._is_exhausted():
+            return super()._do_get()
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_stats.record_wait(time.perf_counter() - start)
+
+    def _is_exhausted(self) -> bool:
+        return (self.checkedin() == 0 and self._max_overflow > -1
+                and self.checkedout() >= self.size() + self._max_overflow)
+
+
+def _create_engine():
+    """Создание общего для процесса асинхронного движка базы данных"""
+    engine = create_async_engine(
+        url=settings.url_connect_with_asyncpg,
+        echo=False,
+        poolclass=MeteredQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
+    pool = engine.sync_engine.pool
+
+    @event.listens_for(pool, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        pool_stats.connects += 1
+
+    @event.listens_for(pool, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_stats.checkouts += 1
+        pool_stats.checked_out_max = max(pool_stats.checked_out_max, pool.checkedout())
+
+    @event.listens_for(pool, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        pool_stats.checkins += 1
+
+    return engine
+
+
+async_engine_db = _create_engine()
+async_session_db = async_sessionmaker(async_engine_db)
+
+
+def get_pool_stats() -> dict:
+    """Верни текущее состояние пула и накопленную статистику выдачи соединений"""
+    pool = async_engine_db.sync_engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "checkouts": pool_stats.checkouts,
+        "checkins": pool_stats.checkins,
+        "connects": pool_stats.connects,
+        "checked_out_max": pool_stats.checked_out_max,
+        "waits": pool_stats.waits,
+        "wait_avg": pool_stats.wait_time_total / pool_stats.waits if pool_stats.waits else 0.0,
+        "wait_max": pool_stats.wait_time_max,
+    }
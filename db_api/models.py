@@ -3,10 +3,11 @@ from enum import unique
 from config import settings
 
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy.dialects.postgresql import JSONB
 import datetime
-from sqlalchemy import text, ForeignKey, BIGINT, Boolean
+from sqlalchemy import text, ForeignKey, BIGINT, Boolean, Index
 from typing import Annotated, Optional
-from utils.enum import TariffCode, PaymentName
+from utils.enum import TariffCode, PaymentName, ChargeStatus
 
 
 intpk = Annotated[int, mapped_column(primary_key=True)]
@@ -51,6 +52,14 @@ class Base(DeclarativeBase):
 
 class Invoice(Base):
     __tablename__ = "invoice"
+    __table_args__ = (
+        Index("ix_invoice_profile_id", "profile_id"),
+        Index("ix_invoice_mother", "profile_id", "provider",
+              postgresql_where=text("is_paid AND is_mother")),
+        Index("ix_invoice_paid_provider_created_at", "provider", "created_at",
+              postgresql_where=text("is_paid")),
+        Index("ix_invoice_paid_at", "paid_at", postgresql_where=text("is_paid")),
+    )
 
     id: Mapped[intpk]
     profile_id: Mapped[int | None] = mapped_column(ForeignKey("profile.id", ondelete="CASCADE"),
@@ -63,6 +72,13 @@ class Invoice(Base):
     updated_at: Mapped[updated]
     hash_transaction: Mapped[str | None]
     is_mother: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    # Время оплаты в utc, по нему считается посуточная статистика продаж
+    paid_at: Mapped[datetime.datetime | None]
+    # Результат запроса на рекуррентное списание по этому счету (только для продлений)
+    charge_status: Mapped[ChargeStatus | None] = mapped_column(nullable=True, default=None)
+    charge_attempts: Mapped[int] = mapped_column(default=0, server_default="0")
+    charge_error: Mapped[str | None]
+    charged_at: Mapped[datetime.datetime | None]
 
     profiles: Mapped["Profile"] = relationship()
     tariffs: Mapped["Tariff"] = relationship()
@@ -108,6 +124,8 @@ class Tariff(Base):
     chatgpt_4o_mini_daily_limit: Mapped[int | None] = mapped_column(default=0)
     midjourney_6_0_daily_limit: Mapped[int | None] = mapped_column(default=0)
     midjourney_5_2_daily_limit: Mapped[int | None] = mapped_column(default=0)
+    chatgpt_o1_preview_daily_limit: Mapped[int] = mapped_column(default=0, server_default="0")
+    chatgpt_o1_mini_daily_limit: Mapped[int] = mapped_column(default=0, server_default="0")
     days: Mapped[int | None]
     price_rub: Mapped[int | None]
     price_stars: Mapped[int | None]
@@ -129,6 +147,8 @@ class Tariff(Base):
             "chatgpt_4o_mini_daily_limit": self.chatgpt_4o_mini_daily_limit,
             "midjourney_6_0_daily_limit": self.midjourney_6_0_daily_limit,
             "midjourney_5_2_daily_limit": self.midjourney_5_2_daily_limit,
+            "chatgpt_o1_preview_daily_limit": self.chatgpt_o1_preview_daily_limit,
+            "chatgpt_o1_mini_daily_limit": self.chatgpt_o1_mini_daily_limit,
             "days": self.days,
             "price_rub": self.price_rub,
             "price_stars": self.price_stars,
@@ -140,6 +160,9 @@ class Tariff(Base):
 class RefLink(Base):
     """Класс представляет собой реферальные ссылки пользователей и статистику по ним"""
     __tablename__ = "ref_link"
+    __table_args__ = (
+        Index("ix_ref_link_owner_id", "owner_id"),
+    )
 
     id: Mapped[intpk]
     name: Mapped[Optional[str]] = mapped_column(unique=False)
@@ -160,6 +183,13 @@ class RefLink(Base):
 class Profile(Base):
     """Класс представляет собой профиль пользователя бота"""
     __tablename__ = "profile"
+    __table_args__ = (
+        Index("ix_profile_tariff_id_date_subscription", "tariff_id", "date_subscription"),
+        Index("ix_profile_created_at", "created_at"),
+        Index("ix_profile_referal_link_id", "referal_link_id",
+              postgresql_where=text("referal_link_id IS NOT NULL")),
+        Index("ix_profile_is_admin", "is_admin", postgresql_where=text("is_admin")),
+    )
 
     id: Mapped[uuid.UUID] = mapped_column(primary_key=True, default=uuid.uuid4)
     tgid: Mapped[int] = mapped_column(BIGINT, unique=True)
@@ -180,6 +210,7 @@ class Profile(Base):
     mj_daily_limit_5_2: Mapped[Optional[int]] = mapped_column(default=0)
     mj_daily_limit_6_0: Mapped[Optional[int]] = mapped_column(default=0)
     count_request: Mapped[int | None] = mapped_column(default=0)
+    limits_reset_date: Mapped[datetime.date | None] = mapped_column(nullable=True, default=None)
     recurring: Mapped[bool] = mapped_column(default=False)
     referal_link_id: Mapped[int | None] = mapped_column(ForeignKey("ref_link.id", ondelete="SET NULL", use_alter=True),
                                                         nullable=True)
@@ -213,6 +244,8 @@ class Profile(Base):
             "chatgpt_4o_mini_daily_limit": self.chatgpt_4o_mini_daily_limit,
             "mj_daily_limit_5_2": self.mj_daily_limit_5_2,
             "mj_daily_limit_6_0": self.mj_daily_limit_6_0,
+            "chatgpt_o1_preview_daily_limit": self.chatgpt_o1_preview_daily_limit,
+            "chatgpt_o1_mini_daily_limit": self.chatgpt_o1_mini_daily_limit,
             "count_request": self.count_request,
             "is_staff": self.is_staff,
             "is_admin": self.is_admin,
@@ -244,6 +277,9 @@ class ChatSession(Base):
     """Класс представляет себя сессию чата (историю переписки с моделью)"""
 
     __tablename__ = "chat_session"
+    __table_args__ = (
+        Index("uq_chat_session_profile_id_ai_model_id", "profile_id", "ai_model_id", unique=True),
+    )
 
     id: Mapped[intpk]
     name: Mapped[str]
@@ -268,6 +304,10 @@ class TextQuery(Base):
     """Класс представляет себя запрос, отправленный к текстовой модели и от нее"""
 
     __tablename__ = "text_query"
+    __table_args__ = (
+        Index("ix_text_query_chat_session_id_created_at", "chat_session_id", "created_at"),
+        Index("ix_text_query_created_at", "created_at"),
+    )
 
     id: Mapped[uuid.UUID] = mapped_column(primary_key=True, default=uuid.uuid4)
     chat_session_id: Mapped[uuid.UUID] = mapped_column(ForeignKey("chat_session.id", ondelete="CASCADE"),
@@ -288,6 +328,10 @@ class ImageQuery(Base):
     """Класс представляет себя запрос, отправленный к модели генерации картинки и от нее"""
 
     __tablename__ = "image_query"
+    __table_args__ = (
+        Index("ix_image_query_chat_session_id_created_at", "chat_session_id", "created_at"),
+        Index("ix_image_query_created_at", "created_at"),
+    )
 
     id: Mapped[uuid.UUID] = mapped_column(primary_key=True, default=uuid.uuid4)
     chat_session_id: Mapped[uuid.UUID] = mapped_column(ForeignKey("chat_session.id", ondelete="CASCADE"),
@@ -303,4 +347,45 @@ class ImageQuery(Base):
 
     chat_session: Mapped["ChatSession"] = relationship(
         back_populates="image_queries"
-    )
\ No newline at end of file
+    )
+
+class DailyStat(Base):
+    """Класс представляет собой посуточный агрегат статистики бота (сутки по мск)
+
+    metric - название показателя, key - разрез (модель, способ оплаты), пустая строка если разреза нет.
+    """
+
+    __tablename__ = "daily_stat"
+
+    day: Mapped[datetime.date] = mapped_column(primary_key=True)
+    metric: Mapped[str] = mapped_column(primary_key=True)
+    key: Mapped[str] = mapped_column(primary_key=True, server_default="")
+    value: Mapped[int] = mapped_column(BIGINT, default=0, server_default="0", nullable=False)
+
+    updated_at: Mapped[updated]
+
+
+class DailyActiveProfile(Base):
+    """Класс представляет собой пользователей, отправлявших запросы к нейросетям за сутки (сутки по мск)"""
+
+    __tablename__ = "daily_active_profile"
+
+    day: Mapped[datetime.date] = mapped_column(primary_key=True)
+    profile_id: Mapped[uuid.UUID] = mapped_column(primary_key=True)
+
+
+class OutboxEvent(Base):
+    """Класс представляет собой событие для отложенных побочных действий (transactional outbox)
+
+    Событие пишется в той же транзакции, что и изменение данных, и удаляется после обработки диспетчером.
+    """
+
+    __tablename__ = "outbox_event"
+
+    id: Mapped[int] = mapped_column(BIGINT, primary_key=True)
+    kind: Mapped[str]
+    payload: Mapped[dict] = mapped_column(JSONB)
+    attempts: Mapped[int] = mapped_column(default=0, server_default="0")
+    last_error: Mapped[str | None]
+
+    created_at: Mapped[created]
@@ -0,0 +1,149 @@
+from dataclasses import dataclass, fields
+from datetime import date, datetime
+from typing import NamedTuple
+from uuid import UUID
+
+from db_api.models import AiModel, Profile, Tariff
+from utils.enum import PaymentStatus, TariffCode
+
+
+class QuotaSpend(NamedTuple):
+    """Результат списания запроса из дневного лимита пользователя"""
+    is_spent: bool
+    remaining: int | None = None
+
+
+class PaymentResult(NamedTuple):
+    """Результат проведения оплаты транзакции"""
+    status: PaymentStatus
+    profile_id: int | None = None
+    tgid: int | None = None
+    referal_link_id: int | None = None
+
+
+class ChatSessionRef(NamedTuple):
+    """Id сессии чата и ее флаги без истории сообщений"""
+    id: int
+    active_generation: bool | None = None
+
+
+class RenewalDue(NamedTuple):
+    """Подписка, которую пора продлить рекуррентным списанием по материнскому счету"""
+    profile_id: UUID
+    tgid: int
+    mother_invoice_id: int
+    tariff_id: int
+    tariff_name: str
+    price: int
+
+
+class RefLinkStat(NamedTuple):
+    """Статистика реферальной ссылки. Поля кроме id совпадают с аргументами BotStatTemplate.generate_ref_stat"""
+    id: int
+    ref_name: str | None
+    ref_link: str
+    total_clicks: int
+    new_registrations: int
+    subscribers: int
+    purchases_rub: int
+    purchases_stars: int
+
+    def template_kwargs(self) -> dict:
+        """Аргументы для BotStatTemplate.generate_ref_stat"""
+        return {field: value for field, value in self._asdict().items() if field != "id"}
+
+
+@dataclass(frozen=True, slots=True)
+class TariffRead:
+    """Тариф только для чтения. Порядок полей совпадает с колонками TARIFF_READ_COLUMNS"""
+    id: int
+    name: str
+    code: TariffCode
+    description: str | None
+    chatgpt_4o_daily_limit: int | None
+    chatgpt_4o_mini_daily_limit: int | None
+    midjourney_6_0_daily_limit: int | None
+    midjourney_5_2_daily_limit: int | None
+    chatgpt_o1_preview_daily_limit: int
+    chatgpt_o1_mini_daily_limit: int
+    days: int | None
+    price_rub: int | None
+    price_stars: int | None
+    is_active: bool
+    created_at: datetime | None = None
+    updated_at: datetime | None = None
+
+
+@dataclass(frozen=True, slots=True)
+class AiModelRead:
+    """Модель нейронной сети только для чтения. Порядок полей совпадает с колонками AI_MODEL_READ_COLUMNS"""
+    code: str
+    name: str | None
+    type: str | None
+    is_active: bool | None
+    created_at: datetime | None = None
+    updated_at: datetime | None = None
+
+
+@dataclass(frozen=True, slots=True)
+class ProfileRead:
+    """Профиль пользователя только для чтения, без инструментации SQLAlchemy
+
+    Порядок полей совпадает с колонками PROFILE_READ_COLUMNS, tariffs и ai_models_id названы как связи Profile.
+    """
+    id: UUID
+    tgid: int
+    username: str | None
+    first_name: str | None
+    last_name: str | None
+    email: str | None
+    url_telegram: str | None
+    tariff_id: int | None
+    ai_model_id: str | None
+    date_subscription: datetime | None
+    chatgpt_4o_daily_limit: int | None
+    chatgpt_4o_mini_daily_limit: int | None
+    chatgpt_o1_preview_daily_limit: int | None
+    chatgpt_o1_mini_daily_limit: int | None
+    mj_daily_limit_5_2: int | None
+    mj_daily_limit_6_0: int | None
+    count_request: int | None
+    limits_reset_date: date | None
+    recurring: bool
+    referal_link_id: int | None
+    is_staff: bool
+    is_admin: bool
+    created_at: datetime | None = None
+    updated_at: datetime | None = None
+    tariffs: TariffRead | None = None
+    ai_models_id: AiModelRead | None = None
+
+    @classmethod
+    def from_row(cls, row) -> "ProfileRead":
+        """Собери профиль из строки запроса с колонками PROFILE_READ_COLUMNS + TARIFF_READ_COLUMNS + AI_MODEL_READ_COLUMNS"""
+        tariff_end = _PROFILE_COLUMNS_COUNT + _TARIFF_COLUMNS_COUNT
+        tariff = row[_PROFILE_COLUMNS_COUNT:tariff_end]
+        ai_model = row[tariff_end:]
+        return cls(
+            *row[:_PROFILE_COLUMNS_COUNT],
+            tariffs=TariffRead(*tariff) if tariff[0] is not None else None,
+            ai_models_id=AiModelRead(*ai_model) if ai_model[0] is not None else None,
+        )
+
+
+class ProfileUpsert(NamedTuple):
+    """Результат регистрации пользователя: профиль и признак, что он создан этим запросом"""
+    profile: ProfileRead
+    is_created: bool
+
+
+def _read_columns(read_model, table, exclude: tuple[str, ...] = ()) -> tuple:
+    """Колонки таблицы в порядке полей модели только для чтения"""
+    return tuple(table.c[field.name] for field in fields(read_model) if field.name not in exclude)
+
+
+PROFILE_READ_COLUMNS = _read_columns(ProfileRead, Profile.__table__, exclude=("tariffs", "ai_models_id"))
+TARIFF_READ_COLUMNS = _read_columns(TariffRead, Tariff.__table__)
+AI_MODEL_READ_COLUMNS = _read_columns(AiModelRead, AiModel.__table__)
+_PROFILE_COLUMNS_COUNT = len(PROFILE_READ_COLUMNS)
+_TARIFF_COLUMNS_COUNT = len(TARIFF_READ_COLUMNS)
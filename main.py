@@ -4,12 +4,12 @@ from fastapi.templating import Jinja2Templates
 from fastapi import Request
 import json
 import logging
-from db_api import api_invoice_async, api_profile_async, api_ref_link_async
-from utils.enum import PaymentName
+from db_api import api_invoice_async
+from utils.enum import PaymentName, PaymentStatus
 from utils.enum import Price
 from config import settings
 from services import robokassa_obj
-from utils.cache import set_cache_profile, serialization_profile, remove_user_in_notification
+from utils.cache import delete_cache_profiles
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -27,33 +27,39 @@ async def test_request(request: Request):
 async def result_confirm(request: Request):
     query_params = request.query_params
 
-    invoice = await api_invoice_async.pay_invoice(int(query_params.get("InvId")))
-    if not invoice:
-        logger.error(f"Not invoice ERROR | {invoice}")
-        return "ERROR"
-
     price = query_params.get("OutSum")
-    inv_id = int(query_params.get("InvId"))
+    inv_id = query_params.get("InvId")
     email = query_params.get("EMail")
     signature = query_params.get("SignatureValue")
 
+    if not (price and inv_id and inv_id.isdigit() and signature):
+        logger.error(f"Bad params ERROR | {inv_id}")
+        return "ERROR"
+    inv_id = int(inv_id)
 
     if not robokassa_obj.check_signature(inv_id=inv_id, price=price, recv_signature=signature):
         logger.error(f"Check signature ERROR | {inv_id}")
         return "Check signature ERROR"
 
-
     # if email and invoice.profiles.email != email.lower():
     #     await api_profile_async.update_email_of_profile(invoice.profiles.id, email.lower())
 
-    profile = await api_profile_async.update_subscription_profile(
-        invoice.profiles.id, invoice.tariff_id, settings.RECURRING
+    payment = await api_invoice_async.finalize_payment(
+        inv_id, Price.RUB.value, PaymentName.ROBOKASSA.value, settings.RECURRING
     )
-    if profile.referal_link_id:
-        await api_ref_link_async.add_count_buy(profile.referal_link_id)
-        await api_ref_link_async.add_sum_buy(profile.referal_link_id, Price.RUB.value, PaymentName.ROBOKASSA.value)
-    await set_cache_profile(profile.tgid, await serialization_profile(profile))
-    await remove_user_in_notification(profile.tgid)
+    if payment.status == PaymentStatus.NOT_FOUND:
+        logger.error(f"Not invoice ERROR | {inv_id}")
+        return "ERROR"
+    if payment.status == PaymentStatus.ALREADY_PAID:
+        logger.info(f"Invoice already paid | {inv_id}")
+        return f"OK{inv_id}"
+
+    # Сразу сбрасываем кэш профиля, чтобы подписка была видна до dispatch_outbox_job. Сброс идемпотентный,
+    # уведомления и статистику ссылки обновит dispatch_outbox_job, он же повторит сброс кэша
+    try:
+        await delete_cache_profiles([payment.tgid])
+    except Exception as e:
+        logger.error(f"Delete cache ERROR | {inv_id} | {e}")
     return f"OK{inv_id}"
 
 @app.get("/success", response_class=HTMLResponse)
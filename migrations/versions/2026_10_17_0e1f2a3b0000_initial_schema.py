@@ -0,0 +1,175 @@
+"""initial schema
+
+Схема бота в том виде, в котором она создавалась без alembic (Base.metadata.create_all), чтобы пустую базу
+можно было поднять цепочкой миграций: `alembic upgrade head`. На существующей базе эту ревизию не выполняют,
+а отмечают: `alembic stamp 0e1f2a3b0000`, затем `alembic upgrade head`.
+
+Revision ID: 0e1f2a3b0000
+Revises:
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0e1f2a3b0000'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+tariff_code = postgresql.ENUM('FREE', 'PREMIUM', 'PROMO', name='tariffcode', create_type=False)
+payment_name = postgresql.ENUM('STARS', 'ROBOKASSA', name='paymentname', create_type=False)
+
+
+def timestamps() -> list[sa.Column]:
+    return [
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text("TIMEZONE('utc', now())"), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text("TIMEZONE('utc', now())"), nullable=False),
+    ]
+
+
+def upgrade() -> None:
+    tariff_code.create(op.get_bind(), checkfirst=True)
+    payment_name.create(op.get_bind(), checkfirst=True)
+    op.create_table(
+        'ai_model',
+        sa.Column('code', sa.String(), nullable=False),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('type', sa.String(), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        *timestamps(),
+        sa.PrimaryKeyConstraint('code'),
+    )
+    op.create_table(
+        'tariff',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('code', tariff_code, nullable=False),
+        sa.Column('description', sa.String(), nullable=True),
+        sa.Column('chatgpt_4o_daily_limit', sa.Integer(), nullable=True),
+        sa.Column('chatgpt_4o_mini_daily_limit', sa.Integer(), nullable=True),
+        sa.Column('midjourney_6_0_daily_limit', sa.Integer(), nullable=True),
+        sa.Column('midjourney_5_2_daily_limit', sa.Integer(), nullable=True),
+        sa.Column('days', sa.Integer(), nullable=True),
+        sa.Column('price_rub', sa.Integer(), nullable=True),
+        sa.Column('price_stars', sa.Integer(), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=False),
+        *timestamps(),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('code'),
+    )
+    op.create_table(
+        'profile',
+        sa.Column('id', sa.Uuid(), nullable=False),
+        sa.Column('tgid', sa.BIGINT(), nullable=False),
+        sa.Column('username', sa.String(), nullable=True),
+        sa.Column('first_name', sa.String(), nullable=True),
+        sa.Column('last_name', sa.String(), nullable=True),
+        sa.Column('email', sa.String(), nullable=True),
+        sa.Column('url_telegram', sa.String(), nullable=True),
+        sa.Column('tariff_id', sa.Integer(), nullable=True),
+        sa.Column('ai_model_id', sa.String(), nullable=True),
+        sa.Column('date_subscription', sa.DateTime(), nullable=True),
+        sa.Column('chatgpt_4o_daily_limit', sa.Integer(), nullable=True),
+        sa.Column('chatgpt_4o_mini_daily_limit', sa.Integer(), nullable=True),
+        sa.Column('chatgpt_o1_preview_daily_limit', sa.Integer(), nullable=True),
+        sa.Column('chatgpt_o1_mini_daily_limit', sa.Integer(), nullable=True),
+        sa.Column('mj_daily_limit_5_2', sa.Integer(), nullable=True),
+        sa.Column('mj_daily_limit_6_0', sa.Integer(), nullable=True),
+        sa.Column('count_request', sa.Integer(), nullable=True),
+        sa.Column('recurring', sa.Boolean(), nullable=False),
+        sa.Column('referal_link_id', sa.Integer(), nullable=True),
+        sa.Column('is_staff', sa.Boolean(), nullable=False),
+        sa.Column('is_admin', sa.Boolean(), nullable=False),
+        *timestamps(),
+        sa.ForeignKeyConstraint(['tariff_id'], ['tariff.id'], ondelete='SET NULL'),
+        sa.ForeignKeyConstraint(['ai_model_id'], ['ai_model.code'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('tgid'),
+        sa.UniqueConstraint('username'),
+    )
+    op.create_table(
+        'ref_link',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('link', sa.String(), nullable=False),
+        sa.Column('count_clicks', sa.Integer(), nullable=True),
+        sa.Column('count_buys', sa.Integer(), nullable=True),
+        sa.Column('count_new_users', sa.Integer(), nullable=True),
+        sa.Column('sum_buys_rub', sa.Integer(), nullable=True),
+        sa.Column('sum_buys_stars', sa.Integer(), nullable=True),
+        sa.Column('owner_id', sa.Uuid(), nullable=False),
+        *timestamps(),
+        sa.ForeignKeyConstraint(['owner_id'], ['profile.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('link'),
+    )
+    op.create_foreign_key('profile_referal_link_id_fkey', 'profile', 'ref_link', ['referal_link_id'], ['id'], ondelete='SET NULL')
+    op.create_table(
+        'invoice',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('profile_id', sa.Uuid(), nullable=True),
+        sa.Column('is_paid', sa.Boolean(), nullable=False),
+        sa.Column('tariff_id', sa.Integer(), nullable=True),
+        sa.Column('provider', payment_name, nullable=False),
+        *timestamps(),
+        sa.Column('hash_transaction', sa.String(), nullable=True),
+        sa.Column('is_mother', sa.Boolean(), nullable=False),
+        sa.ForeignKeyConstraint(['profile_id'], ['profile.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['tariff_id'], ['tariff.id'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_table(
+        'chat_session',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('ai_model_id', sa.String(), nullable=True),
+        sa.Column('profile_id', sa.Uuid(), nullable=True),
+        sa.Column('active_generation', sa.Boolean(), nullable=True),
+        *timestamps(),
+        sa.ForeignKeyConstraint(['ai_model_id'], ['ai_model.code'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['profile_id'], ['profile.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_table(
+        'text_query',
+        sa.Column('id', sa.Uuid(), nullable=False),
+        sa.Column('chat_session_id', sa.Integer(), nullable=True),
+        sa.Column('query', sa.String(), nullable=True),
+        sa.Column('answer', sa.String(), nullable=True),
+        sa.Column('status', sa.String(), nullable=False),
+        *timestamps(),
+        sa.ForeignKeyConstraint(['chat_session_id'], ['chat_session.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_table(
+        'image_query',
+        sa.Column('id', sa.Uuid(), nullable=False),
+        sa.Column('chat_session_id', sa.Integer(), nullable=True),
+        sa.Column('query', sa.String(), nullable=True),
+        sa.Column('answer', sa.String(), nullable=True),
+        sa.Column('jobid', sa.String(), nullable=True),
+        sa.Column('status', sa.String(), nullable=False),
+        *timestamps(),
+        sa.ForeignKeyConstraint(['chat_session_id'], ['chat_session.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('image_query')
+    op.drop_table('text_query')
+    op.drop_table('chat_session')
+    op.drop_table('invoice')
+    op.drop_constraint('profile_referal_link_id_fkey', 'profile', type_='foreignkey')
+    op.drop_table('ref_link')
+    op.drop_table('profile')
+    op.drop_table('tariff')
+    op.drop_table('ai_model')
+    payment_name.drop(op.get_bind(), checkfirst=True)
+    tariff_code.drop(op.get_bind(), checkfirst=True)
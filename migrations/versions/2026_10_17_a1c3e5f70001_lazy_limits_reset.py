@@ -0,0 +1,39 @@
+"""lazy limits reset
+
+Схема до этой ревизии создавалась без alembic и описана ревизией 0e1f2a3b0000: на существующей базе
+сначала выполните `alembic stamp 0e1f2a3b0000`, затем `alembic upgrade head`.
+
+Revision ID: a1c3e5f70001
+Revises: 0e1f2a3b0000
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a1c3e5f70001'
+down_revision: Union[str, None] = '0e1f2a3b0000'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('profile', sa.Column('limits_reset_date', sa.Date(), nullable=True))
+    op.add_column('tariff', sa.Column('chatgpt_o1_preview_daily_limit', sa.Integer(), nullable=True))
+    op.add_column('tariff', sa.Column('chatgpt_o1_mini_daily_limit', sa.Integer(), nullable=True))
+    # Лимиты премиум тарифа, которые раньше были зашиты в update_limits_profile
+    op.execute(
+        "UPDATE tariff SET chatgpt_4o_daily_limit = 100, chatgpt_4o_mini_daily_limit = -1, "
+        "midjourney_5_2_daily_limit = 45, midjourney_6_0_daily_limit = 20, "
+        "chatgpt_o1_preview_daily_limit = 20, chatgpt_o1_mini_daily_limit = 60 WHERE id = 2"
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('tariff', 'chatgpt_o1_mini_daily_limit')
+    op.drop_column('tariff', 'chatgpt_o1_preview_daily_limit')
+    op.drop_column('profile', 'limits_reset_date')
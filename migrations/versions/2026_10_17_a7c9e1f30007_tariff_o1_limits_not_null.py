@@ -0,0 +1,47 @@
+"""tariff o1 limits not null
+
+Ревизия a1c3e5f70001 заполнила лимиты o1 только у премиум тарифа, у остальных платных тарифов (промо)
+они остались NULL. Раньше update_subscription_profile выдавал всем платным тарифам 20 o1-preview и 60 o1-mini.
+
+Revision ID: a7c9e1f30007
+Revises: f6b8d0e20006
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c9e1f30007'
+down_revision: Union[str, None] = 'f6b8d0e20006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        "UPDATE tariff SET "
+        "chatgpt_o1_preview_daily_limit = COALESCE(chatgpt_o1_preview_daily_limit, CASE WHEN id = 1 THEN 0 ELSE 20 END), "
+        "chatgpt_o1_mini_daily_limit = COALESCE(chatgpt_o1_mini_daily_limit, CASE WHEN id = 1 THEN 0 ELSE 60 END) "
+        "WHERE chatgpt_o1_preview_daily_limit IS NULL OR chatgpt_o1_mini_daily_limit IS NULL"
+    )
+    # Профили промо тарифа, которым refresh_daily_limits уже записал NULL из тарифа
+    op.execute(
+        "UPDATE profile SET "
+        "chatgpt_o1_preview_daily_limit = COALESCE(profile.chatgpt_o1_preview_daily_limit, "
+        "tariff.chatgpt_o1_preview_daily_limit), "
+        "chatgpt_o1_mini_daily_limit = COALESCE(profile.chatgpt_o1_mini_daily_limit, "
+        "tariff.chatgpt_o1_mini_daily_limit) "
+        "FROM tariff WHERE tariff.id = profile.tariff_id AND tariff.id <> 1 "
+        "AND (profile.chatgpt_o1_preview_daily_limit IS NULL OR profile.chatgpt_o1_mini_daily_limit IS NULL)"
+    )
+    for column in ('chatgpt_o1_preview_daily_limit', 'chatgpt_o1_mini_daily_limit'):
+        op.alter_column('tariff', column, existing_type=sa.Integer(), nullable=False, server_default='0')
+
+
+def downgrade() -> None:
+    for column in ('chatgpt_o1_preview_daily_limit', 'chatgpt_o1_mini_daily_limit'):
+        op.alter_column('tariff', column, existing_type=sa.Integer(), nullable=True, server_default=None)
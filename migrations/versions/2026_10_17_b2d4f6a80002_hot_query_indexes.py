@@ -0,0 +1,54 @@
+"""hot query indexes
+
+Индексы создаются CONCURRENTLY вне транзакции, чтобы не блокировать запись в большие таблицы.
+
+Revision ID: b2d4f6a80002
+Revises: a1c3e5f70001
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2d4f6a80002'
+down_revision: Union[str, None] = 'a1c3e5f70001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (название, таблица, колонки, условие частичного индекса)
+INDEXES = (
+    ('ix_invoice_profile_id', 'invoice', ['profile_id'], None),
+    ('ix_invoice_mother', 'invoice', ['profile_id', 'provider'], 'is_paid AND is_mother'),
+    ('ix_invoice_paid_provider_created_at', 'invoice', ['provider', 'created_at'], 'is_paid'),
+    ('ix_ref_link_owner_id', 'ref_link', ['owner_id'], None),
+    ('ix_profile_tariff_id_date_subscription', 'profile', ['tariff_id', 'date_subscription'], None),
+    ('ix_profile_created_at', 'profile', ['created_at'], None),
+    ('ix_profile_referal_link_id', 'profile', ['referal_link_id'], 'referal_link_id IS NOT NULL'),
+    ('ix_profile_is_admin', 'profile', ['is_admin'], 'is_admin'),
+    ('ix_chat_session_profile_id_ai_model_id', 'chat_session', ['profile_id', 'ai_model_id'], None),
+    ('ix_text_query_chat_session_id_created_at', 'text_query', ['chat_session_id', 'created_at'], None),
+    ('ix_text_query_created_at', 'text_query', ['created_at'], None),
+    ('ix_image_query_chat_session_id_created_at', 'image_query', ['chat_session_id', 'created_at'], None),
+    ('ix_image_query_created_at', 'image_query', ['created_at'], None),
+)
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            op.create_index(
+                name, table, columns,
+                postgresql_concurrently=True,
+                postgresql_where=sa.text(where) if where else None,
+                if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
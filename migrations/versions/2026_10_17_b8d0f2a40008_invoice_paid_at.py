@@ -0,0 +1,37 @@
+"""invoice paid_at
+
+Посуточная статистика продаж считается по времени оплаты. Для уже оплаченных счетов время оплаты
+берется из updated_at: после оплаты счет больше не меняется. После миграции агрегаты продаж стоит
+пересчитать вызовом services.jobs.backfill_daily_stats(days=...).
+
+Revision ID: b8d0f2a40008
+Revises: a7c9e1f30007
+Create Date: 2026-10-17 19:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8d0f2a40008'
+down_revision: Union[str, None] = 'a7c9e1f30007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('invoice', sa.Column('paid_at', sa.DateTime(), nullable=True))
+    op.execute("UPDATE invoice SET paid_at = COALESCE(updated_at, created_at) WHERE is_paid")
+    # Индекс строится без блокировки записи в invoice, CONCURRENTLY нельзя выполнять в транзакции
+    with op.get_context().autocommit_block():
+        op.create_index('ix_invoice_paid_at', 'invoice', ['paid_at'], postgresql_where=sa.text('is_paid'),
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_invoice_paid_at', table_name='invoice', postgresql_concurrently=True, if_exists=True)
+    op.drop_column('invoice', 'paid_at')
@@ -0,0 +1,44 @@
+"""daily stat rollup
+
+Посуточные агрегаты для экрана общей статистики. После миграции заполните историю
+вызовом services.jobs.backfill_daily_stats(days=...) на глубину хранения данных.
+
+Revision ID: c3e5a7b90003
+Revises: b2d4f6a80002
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3e5a7b90003'
+down_revision: Union[str, None] = 'b2d4f6a80002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'daily_stat',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('metric', sa.String(), nullable=False),
+        sa.Column('key', sa.String(), server_default='', nullable=False),
+        sa.Column('value', sa.BIGINT(), server_default='0', nullable=False),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text("TIMEZONE('utc', now())"), nullable=False),
+        sa.PrimaryKeyConstraint('day', 'metric', 'key'),
+    )
+    op.create_table(
+        'daily_active_profile',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('profile_id', sa.Uuid(), nullable=False),
+        sa.PrimaryKeyConstraint('day', 'profile_id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('daily_active_profile')
+    op.drop_table('daily_stat')
@@ -0,0 +1,60 @@
+"""chat session unique
+
+Одна сессия на пару (profile_id, ai_model_id) для upsert в get_or_create_session_ref.
+Дубликаты объединяются в сессию с наименьшим id: сообщения переносятся в нее, лишние сессии удаляются.
+
+Revision ID: d4f6b8c00004
+Revises: c3e5a7b90003
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4f6b8c00004'
+down_revision: Union[str, None] = 'c3e5a7b90003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+DUPLICATES = """
+    SELECT id, min(id) OVER (PARTITION BY profile_id, ai_model_id) AS keep_id
+    FROM chat_session
+    WHERE profile_id IS NOT NULL
+"""
+
+
+def upgrade() -> None:
+    op.execute(f"""
+        UPDATE text_query SET chat_session_id = d.keep_id
+        FROM ({DUPLICATES}) AS d
+        WHERE text_query.chat_session_id = d.id AND d.id <> d.keep_id
+    """)
+    op.execute(f"""
+        UPDATE image_query SET chat_session_id = d.keep_id
+        FROM ({DUPLICATES}) AS d
+        WHERE image_query.chat_session_id = d.id AND d.id <> d.keep_id
+    """)
+    op.execute(f"""
+        DELETE FROM chat_session USING ({DUPLICATES}) AS d
+        WHERE chat_session.id = d.id AND d.id <> d.keep_id
+    """)
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'uq_chat_session_profile_id_ai_model_id', 'chat_session', ['profile_id', 'ai_model_id'],
+            unique=True, postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.drop_index('ix_chat_session_profile_id_ai_model_id', table_name='chat_session',
+                      postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_chat_session_profile_id_ai_model_id', 'chat_session', ['profile_id', 'ai_model_id'],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.drop_index('uq_chat_session_profile_id_ai_model_id', table_name='chat_session',
+                      postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,39 @@
+"""invoice charge outcome
+
+Результат запроса на рекуррентное списание по счету продления.
+
+Revision ID: e5a7c9d10005
+Revises: d4f6b8c00004
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a7c9d10005'
+down_revision: Union[str, None] = 'd4f6b8c00004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+charge_status = postgresql.ENUM('SENT', 'REJECTED', 'FAILED', name='chargestatus', create_type=False)
+
+
+def upgrade() -> None:
+    charge_status.create(op.get_bind(), checkfirst=True)
+    op.add_column('invoice', sa.Column('charge_status', charge_status, nullable=True))
+    op.add_column('invoice', sa.Column('charge_attempts', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('invoice', sa.Column('charge_error', sa.String(), nullable=True))
+    op.add_column('invoice', sa.Column('charged_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('invoice', 'charged_at')
+    op.drop_column('invoice', 'charge_error')
+    op.drop_column('invoice', 'charge_attempts')
+    op.drop_column('invoice', 'charge_status')
+    charge_status.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,107 @@
+"""Периодические задачи бота. Модуль не импортируется в services/__init__, чтобы не было циклических импортов."""
+
+from datetime import timedelta
+
+from config import settings
+from db_api import api_invoice_async, api_outbox_async, api_profile_async, api_stat_async
+from db_api.async_api import msk_today
+from services import logger, robokassa_obj
+from services.recurring import RecurringBilling
+from utils.cache import delete_cache_profiles, flush_quota, remove_users_in_notification, reset_quota_left
+from utils.counters import flush_ref_counters
+from utils.activity import reconcile_active_users
+
+
+async def expire_subscriptions_job(batch_size: int = 1000) -> list[int]:
+    """Сними истекшие подписки и сбрось кэш затронутых пользователей"""
+    tgids = await api_profile_async.expire_subscriptions(batch_size=batch_size)
+    await delete_cache_profiles(tgids)
+    logger.info(f"Expired subscriptions | {len(tgids)}")
+    return tgids
+
+
+async def flush_ref_counters_job(batch_size: int = 500) -> int:
+    """Сбрось буферизованные счетчики реферальных ссылок в бд"""
+    total = 0
+    while flushed := await flush_ref_counters(batch_size=batch_size):
+        total += flushed
+    return total
+
+
+async def flush_quota_job() -> int:
+    """Сбрось списания лимитов и счетчики запросов из redis в бд"""
+    updated = await flush_quota()
+    logger.debug(f"Quota flushed | {updated}")
+    return updated
+
+
+async def update_limits_job() -> str:
+    """Обнови дневные лимиты пользователей с подпиской и удали их остатки за сутки в redis.
+    Запускается после полуночи по мск; при LAZY_LIMITS_RESET лимиты обновляются при первом запросе"""
+    if settings.LAZY_LIMITS_RESET:
+        return "Ok"
+    await api_profile_async.update_limits_profile()
+    await reset_quota_left()
+    return "Ok"
+
+
+async def refresh_daily_stats_job() -> str:
+    """Пересчитай агрегаты статистики за последние STAT_REFRESH_DAYS суток, чтобы дописать поздние оплаты и запросы"""
+    today = msk_today()
+    for offset in range(max(settings.STAT_REFRESH_DAYS, 1) - 1, -1, -1):
+        await api_stat_async.refresh_daily_stats(today - timedelta(days=offset))
+    return "Ok"
+
+
+async def backfill_daily_stats(days: int) -> str:
+    """Заполни агрегаты статистики за последние days суток. Запускается один раз после миграции"""
+    today = msk_today()
+    for offset in range(days, -1, -1):
+        await api_stat_async.refresh_daily_stats(today - timedelta(days=offset))
+    logger.info(f"Daily stats backfilled | {days}")
+    return "Ok"
+
+
+async def reconcile_active_users_job() -> dict[str, dict[str, int]]:
+    """Сверь DAU/MAU из HyperLogLog с точным подсчетом по бд и запиши расхождение в лог"""
+    result = await reconcile_active_users()
+    logger.info(f"Active users reconciled | {result}")
+    return result
+
+
+async def renew_subscriptions_job(batch_size: int = 1000) -> dict[str, int]:
+    """Отправь рекуррентные списания по подпискам, которые скоро закончатся. Вернет кол-во счетов по статусам"""
+    totals = {}
+    async with RecurringBilling(robokassa_obj) as billing:
+        while dues := await api_invoice_async.get_due_mother_invoices(limit=batch_size):
+            renewals = await api_invoice_async.create_renewal_invoices(dues)
+            outcomes = await billing.charge_all([
+                {"invoice_id": invoice_id, "mother_invoice_id": due.mother_invoice_id, "user_id": due.tgid,
+                 "price": due.price, "desc": due.tariff_name}
+                for invoice_id, due in renewals.items()
+            ])
+            await api_invoice_async.record_charge_outcomes([outcome.to_record() for outcome in outcomes])
+            for outcome in outcomes:
+                totals[outcome.status.value] = totals.get(outcome.status.value, 0) + 1
+    logger.info(f"Recurring charges | {totals}")
+    return totals
+
+
+async def _apply_payment_events(events) -> str:
+    """Побочные действия оплат вне бд: сброс кэша пользователей и удаление из списка уведомлений"""
+    tgids = list({event.payload["tgid"] for event in events if event.payload.get("tgid")})
+    await delete_cache_profiles(tgids)
+    await remove_users_in_notification(tgids)
+    return "Ok"
+
+
+async def dispatch_outbox_job(batch_size: int = 500) -> int:
+    """Обработай все накопленные события outbox. Запускается раз в несколько секунд: до него в кэше профиля
+    остается старый тариф, если /result не смог сбросить кэш сам"""
+    total = 0
+    while dispatched := await api_outbox_async.dispatch(_apply_payment_events, batch_size=batch_size,
+                                                        max_attempts=settings.OUTBOX_MAX_ATTEMPTS):
+        total += dispatched
+    if total:
+        logger.info(f"Outbox dispatched | {total}")
+    return total
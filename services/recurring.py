@@ -0,0 +1,87 @@
+"""Рекуррентные списания Robokassa по материнским счетам.
+
+Все запросы идут через один aiohttp.ClientSession с ограниченным пулом соединений, поэтому TCP+TLS
+соединения переиспользуются. Одновременных запросов не больше concurrency, у каждого свой таймаут,
+сетевые ошибки и ответы 5xx повторяются с экспоненциальной задержкой (повтор идет с тем же номером
+счета, поэтому Robokassa не спишет деньги дважды). Результат каждого списания
+возвращается в ChargeOutcome и записывается в счет (ApiInvoiceAsync.record_charge_outcomes).
+Сам платеж подтверждается позже колбэком /result по счету продления.
+"""
+
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+
+from config import settings
+from services.payment import Robokassa
+from utils.enum import ChargeStatus
+
+
+@dataclass
+class ChargeOutcome:
+    """Результат запроса на списание по счету продления"""
+    invoice_id: int
+    status: ChargeStatus
+    attempts: int
+    error: str | None = None
+    elapsed: float = 0.0
+
+    def to_record(self) -> dict:
+        """Параметры для ApiInvoiceAsync.record_charge_outcomes"""
+        return {"invoice_id": self.invoice_id, "status": self.status, "attempts": self.attempts,
+                "error": self.error}
+
+
+class RecurringBilling:
+    """Пул для рекуррентных списаний. Используется как async context manager, чтобы закрыть соединения"""
+
+    def __init__(self, robokassa: Robokassa, concurrency: int = settings.RECURRING_CONCURRENCY,
+                 timeout: float = settings.RECURRING_TIMEOUT, retries: int = settings.RECURRING_RETRIES,
+                 backoff: float = 0.5, url: str | None = None):
+        self.robokassa = robokassa
+        self.concurrency = concurrency
+        self.timeout = ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.url = url or robokassa.recurring_url
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._session: ClientSession | None = None
+
+    async def __aenter__(self) -> "RecurringBilling":
+        self._session = ClientSession(connector=TCPConnector(limit=self.concurrency), timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._session.close()
+        self._session = None
+
+    async def charge(self, invoice_id: int, mother_invoice_id: int, user_id: int | str, price: int,
+                     desc: str) -> ChargeOutcome:
+        """Отправь запрос на списание по счету продления с повторами"""
+        data = self.robokassa.gen_payment_data(user_id=user_id, inv_id=invoice_id, price=price, tariff_desc=desc,
+                                               mother_inv_id=mother_invoice_id, recurring=True)
+        error = None
+        async with self._semaphore:
+            start = time.perf_counter()
+            for attempt in range(1, self.retries + 1):
+                try:
+                    async with self._session.post(self.url, data=data) as response:
+                        text = await response.text()
+                    if response.status < 500:
+                        # Robokassa отвечает OK<номер счета>, если списание принято в обработку
+                        status = ChargeStatus.SENT if response.ok and text.startswith("OK") else ChargeStatus.REJECTED
+                        error = None if status == ChargeStatus.SENT else f"{response.status} {text[:200]}"
+                        return ChargeOutcome(invoice_id, status, attempt, error, time.perf_counter() - start)
+                    error = f"{response.status} {text[:200]}"
+                except (ClientError, asyncio.TimeoutError) as e:
+                    error = repr(e)
+                if attempt < self.retries:
+                    await asyncio.sleep(self.backoff * 2 ** (attempt - 1) * (1 + random.random()))
+        return ChargeOutcome(invoice_id, ChargeStatus.FAILED, self.retries, error, time.perf_counter() - start)
+
+    async def charge_all(self, charges: list[dict]) -> list[ChargeOutcome]:
+        """Отправь запросы на списание параллельно. Словари с аргументами charge"""
+        return await asyncio.gather(*(self.charge(**charge) for charge in charges))
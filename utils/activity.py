@@ -0,0 +1,67 @@
+"""Подсчет активных пользователей (DAU/MAU) через HyperLogLog в redis.
+
+Каждый созданный запрос к нейросети (text_query, image_query) добавляет id профиля в HyperLogLog
+текущих суток по мск (PFADD): вызывающий код после create_text_query/create_image_query вызывает
+track_active_profile. Списание лимита активность не отмечает.
+DAU - PFCOUNT за сутки, MAU - PFCOUNT по объединению последних 30 суток. Погрешность оценки ~0.8%,
+каждый ключ занимает до 12 КБ. Точный подсчет по бд остается для сверки: exact=True.
+"""
+
+from datetime import datetime, timedelta
+
+from db_api import api_chat_session_async
+from services import redis
+
+ACTIVE_USERS_KEY = "active_users:{day}"
+ACTIVE_USERS_MONTH_DAYS = 30
+# Ключи хранятся чуть дольше окна MAU, чтобы подсчет на границе суток не терял первый день
+ACTIVE_USERS_KEEP_DAYS = ACTIVE_USERS_MONTH_DAYS + 2
+
+
+def _msk_now() -> datetime:
+    """Текущее время по мск"""
+    return datetime.utcnow() + timedelta(hours=3)
+
+def active_users_key(day=None) -> str:
+    """Ключ HyperLogLog активных пользователей за сутки по мск"""
+    return ACTIVE_USERS_KEY.format(day=(day or _msk_now().date()).isoformat())
+
+def active_users_expire_at() -> int:
+    """Unix-время, после которого ключ текущих суток больше не нужен"""
+    start_of_day = _msk_now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(hours=3)
+    return int((start_of_day + timedelta(days=ACTIVE_USERS_KEEP_DAYS) - datetime(1970, 1, 1)).total_seconds())
+
+async def track_active_profile(profile_id) -> str:
+    """Отметь пользователя активным за текущие сутки"""
+    key = active_users_key()
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.pfadd(key, str(profile_id))
+        pipe.expireat(key, active_users_expire_at())
+        await pipe.execute()
+    return "Ok"
+
+async def get_dau(exact: bool = False) -> int:
+    """Получи кол-во активных пользователей за текущие сутки"""
+    if exact:
+        return await api_chat_session_async.get_count_unique_profile_count_from_queries_for_24_hours()
+    return await redis.pfcount(active_users_key())
+
+async def get_mau(exact: bool = False) -> int:
+    """Получи кол-во активных пользователей за последние 30 суток"""
+    if exact:
+        return await api_chat_session_async.get_count_unique_profile_count_from_queries_for_month()
+    today = _msk_now().date()
+    keys = [active_users_key(today - timedelta(days=offset)) for offset in range(ACTIVE_USERS_MONTH_DAYS + 1)]
+    return await redis.pfcount(*keys)
+
+async def get_active_users(exact: bool = False) -> dict[str, int]:
+    """Получи DAU и MAU в виде аргументов BotStatTemplate.generate_basic_stat"""
+    return {"mau_day": await get_dau(exact), "mau_month": await get_mau(exact)}
+
+async def reconcile_active_users() -> dict[str, dict[str, int]]:
+    """Сверь оценку HyperLogLog с точным подсчетом по бд"""
+    estimate, exact = await get_active_users(), await get_active_users(exact=True)
+    return {
+        name: {"estimate": estimate[name], "exact": exact[name], "diff": estimate[name] - exact[name]}
+        for name in estimate
+    }
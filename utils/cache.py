@@ -1,7 +1,104 @@
 from services import redis
+import asyncio
 import json
-from db_api.models import Profile, Tariff, AiModel
+import math
+import random
+import time
+from datetime import date, datetime, timedelta
+from uuid import UUID, uuid4
+from db_api import (api_profile_async, api_tariff_async, api_ai_model_async, api_chat_session_async,
+                    api_ref_link_async)
+from db_api.async_api import QUOTA_COLUMNS, TARIFF_LIMIT_COLUMNS
+from db_api.models import Profile, RefLink
+from db_api.schemas import QuotaSpend, ProfileRead, TariffRead, AiModelRead
 from config import settings
+from utils.context import delete_context_cache
+from utils.local_cache import LocalCache
+
+CACHE_INVALIDATION_CHANNEL = "cache:invalidate"
+
+# Формат кэша профиля: символ версии схемы + json-массив полей в порядке PROFILE_CACHE_FIELDS.
+# При любом изменении списка полей увеличьте версию: записи старой схемы будут считаться промахом.
+PROFILE_CACHE_VERSION = "2"
+PROFILE_CACHE_FIELDS = (
+    "id", "tgid", "username", "first_name", "last_name", "email", "url_telegram", "tariff_id", "ai_model_id",
+    "date_subscription", "chatgpt_4o_daily_limit", "chatgpt_4o_mini_daily_limit", "chatgpt_o1_preview_daily_limit",
+    "chatgpt_o1_mini_daily_limit", "mj_daily_limit_5_2", "mj_daily_limit_6_0", "count_request", "recurring",
+    "referal_link_id", "limits_reset_date", "is_staff", "is_admin",
+)
+_EPOCH = datetime(1970, 1, 1)
+
+# Первый уровень кэша в памяти процесса, второй - redis
+profile_local_cache = LocalCache(maxsize=settings.LOCAL_CACHE_SIZE, ttl=settings.LOCAL_CACHE_TTL)
+tariff_local_cache = LocalCache(maxsize=64, ttl=settings.TTL)
+ai_model_local_cache = LocalCache(maxsize=1, ttl=settings.TTL)
+session_local_cache = LocalCache(maxsize=settings.LOCAL_CACHE_SIZE, ttl=settings.LOCAL_CACHE_TTL)
+ref_link_local_cache = LocalCache(maxsize=settings.LOCAL_CACHE_SIZE, ttl=settings.TTL)
+_local_caches = {"profile": profile_local_cache, "tariff": tariff_local_cache, "ai_model": ai_model_local_cache,
+                 "session": session_local_cache, "ref_link": ref_link_local_cache}
+
+# Id реферальной ссылки по ее коду. Неизвестные коды кэшируются пустой строкой на короткое время,
+# чтобы переходы по несуществующим ссылкам не доходили до бд
+REF_LINK_ID_KEY = "ref_link_id:{}"
+REF_LINK_ID_TTL = 24 * 60 * 60
+REF_LINK_MISSING_TTL = 60
+_REF_LINK_MISSING = 0
+
+# Id сессии чата пользователя с моделью. Сессия меняется только при сбросе контекста, поэтому TTL длинный
+CHAT_SESSION_KEY = "chat_session:{tgid}:{model}"
+CHAT_SESSION_TTL = 24 * 60 * 60
+
+# Заполнение кэша профиля при промахе: одна загрузка из бд на ключ в процессе и короткая блокировка в redis
+# между процессами. Горячие профили обновляются заранее с вероятностью, растущей к концу TTL (XFetch).
+PROFILE_FILL_LOCK_KEY = "lock:profile_fill:{}"
+PROFILE_FILL_LOCK_MS = 3000
+PROFILE_FILL_POLL_SECONDS = 0.05
+_profile_inflight: dict[int, asyncio.Future] = {}
+_background_tasks: set[asyncio.Task] = set()
+_profile_load_seconds = 0.01
+
+# Удаление блокировки только ее владельцем, общее для блокировок в redis. KEYS: ключ блокировки, ARGV: токен владельца
+RELEASE_LOCK_SCRIPT = redis.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+QUOTA_LEFT_KEY = "quota_left:{day}:{tgid}:{model}"
+QUOTA_PENDING_KEY = "quota:pending:{day}"
+QUOTA_PENDING_KEEP_DAYS = 2
+
+# Проверка лимита и списание одним атомарным шагом.
+# Остаток за сутки заводится при первом списании из колонки профиля за вычетом еще не сброшенных в бд списаний,
+# поэтому начисления администратора на профиль учитываются.
+# KEYS: остаток лимита за сутки, хэш несброшенных в бд списаний за сутки
+# ARGV: остаток лимита по профилю (-1 безлимит), время конца суток, поле лимита в хэше, поле count_request в хэше
+#       ('' если не нужно), время удаления хэша
+_SPEND_QUOTA_SCRIPT = redis.register_script("""
+local seed = tonumber(ARGV[1])
+local left = -1
+if seed >= 0 then
+    local value = redis.call('GET', KEYS[1])
+    if value then
+        left = tonumber(value)
+    else
+        left = seed - tonumber(redis.call('HGET', KEYS[2], ARGV[3]) or '0')
+    end
+    if left <= 0 then
+        return {0, 0}
+    end
+    left = left - 1
+    redis.call('SET', KEYS[1], left)
+    redis.call('EXPIREAT', KEYS[1], ARGV[2])
+    redis.call('HINCRBY', KEYS[2], ARGV[3], 1)
+end
+if ARGV[4] ~= '' then
+    redis.call('HINCRBY', KEYS[2], ARGV[4], 1)
+end
+redis.call('EXPIREAT', KEYS[2], ARGV[5])
+return {1, left}
+""")
 
 
 async def remove_user_in_notification(user_tgid: int | None) -> str:
@@ -9,6 +106,12 @@ async def remove_user_in_notification(user_tgid: int | None) -> str:
     await redis.srem('users_notifications', user_tgid)
     return "Ok"
 
+async def remove_users_in_notification(user_tgids: list[int]) -> str:
+    """Удали пользователей из списка 'Пользовательские уведомления' в redis одной командой"""
+    if user_tgids:
+        await redis.srem('users_notifications', *user_tgids)
+    return "Ok"
+
 async def add_user_in_notification(user_tgid: int | None) -> str:
     """Добавь пользователя в список 'Пользовательские уведомления' в redis"""
     await redis.sadd("users_notifications", user_tgid)
@@ -19,28 +122,394 @@ async def get_users_from_notification():
     users_notifications = await redis.smembers("users_notifications")
     return users_notifications
 
-async def get_cache_profile(profile_tgid: int | None) -> str:
-    """Получает обьект из кэша"""
+async def get_cache_profile(profile_tgid: int | None) -> str | None:
+    """Получает обьект из кэша. Записи старой версии схемы считаются промахом"""
     cache_value = await redis.get(profile_tgid)
+    if cache_value is None or cache_value[:1] != PROFILE_CACHE_VERSION:
+        return None
     return cache_value
 
+async def get_cache_profile_obj(profile_tgid: int) -> ProfileRead | None:
+    """Получает обьект пользователя из локального кэша, а при промахе из redis"""
+    profile = profile_local_cache.get(profile_tgid)
+    if profile is not None:
+        return profile
+    profile = await decode_profile(await redis.get(profile_tgid))
+    if profile is not None:
+        profile_local_cache.set(profile_tgid, profile)
+    return profile
+
+async def get_or_load_profile(profile_tgid: int) -> ProfileRead | None:
+    """Получи пользователя из кэша, а при промахе загрузи его из бд не более одного раза на ключ
+
+    Если до истечения записи в redis осталось мало времени, запускается фоновое обновление (XFetch).
+    """
+    profile = profile_local_cache.get(profile_tgid)
+    if profile is not None:
+        return profile
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.get(profile_tgid)
+        pipe.pttl(profile_tgid)
+        cache_value, ttl_ms = await pipe.execute()
+    profile = await decode_profile(cache_value)
+    if profile is None:
+        return await _fill_profile(profile_tgid)
+    profile_local_cache.set(profile_tgid, profile)
+    if profile_tgid not in _profile_inflight and _need_early_refresh(ttl_ms):
+        task = asyncio.create_task(_fill_profile(profile_tgid))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    return profile
+
+def _need_early_refresh(ttl_ms: int) -> bool:
+    """Реши, обновлять ли запись заранее: -delta * beta * ln(rand) >= оставшийся TTL"""
+    beta = settings.CACHE_EARLY_REFRESH_BETA
+    if beta <= 0 or ttl_ms <= 0:
+        return False
+    return -_profile_load_seconds * beta * math.log(1.0 - random.random()) * 1000 >= ttl_ms
+
+async def _fill_profile(profile_tgid: int) -> ProfileRead | None:
+    """Загрузи пользователя в кэш. Одновременные вызовы для одного ключа ждут одну загрузку"""
+    future = _profile_inflight.get(profile_tgid)
+    if future is not None:
+        return await asyncio.shield(future)
+    future = asyncio.get_running_loop().create_future()
+    _profile_inflight[profile_tgid] = future
+    try:
+        profile = await _load_profile_with_lock(profile_tgid)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # ошибка уже передается вызывающему, не логируем ее повторно для future
+        raise
+    else:
+        future.set_result(profile)
+        return profile
+    finally:
+        _profile_inflight.pop(profile_tgid, None)
+
+async def _load_profile_with_lock(profile_tgid: int) -> ProfileRead | None:
+    """Загрузи пользователя из бд под блокировкой redis или дождись загрузки другим процессом"""
+    global _profile_load_seconds
+    lock_key = PROFILE_FILL_LOCK_KEY.format(profile_tgid)
+    token = uuid4().hex
+    if await redis.set(lock_key, token, nx=True, px=PROFILE_FILL_LOCK_MS):
+        try:
+            start = time.perf_counter()
+            profile = await api_profile_async.get_profile_read(profile_tgid)
+            _profile_load_seconds = 0.8 * _profile_load_seconds + 0.2 * (time.perf_counter() - start)
+            if profile is not None:
+                await redis.setex(profile_tgid, settings.TTL, encode_profile(profile))
+        finally:
+            await RELEASE_LOCK_SCRIPT(keys=[lock_key], args=[token])
+    else:
+        profile = await _wait_profile_fill(profile_tgid, lock_key)
+    if profile is not None:
+        profile_local_cache.set(profile_tgid, profile)
+    return profile
+
+async def _wait_profile_fill(profile_tgid: int, lock_key: str) -> ProfileRead | None:
+    """Дождись, пока другой процесс положит пользователя в redis, иначе загрузи его сам"""
+    deadline = time.monotonic() + PROFILE_FILL_LOCK_MS / 1000
+    while time.monotonic() < deadline:
+        await asyncio.sleep(PROFILE_FILL_POLL_SECONDS)
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.get(profile_tgid)
+            pipe.exists(lock_key)
+            cache_value, is_locked = await pipe.execute()
+        profile = await decode_profile(cache_value)
+        if profile is not None:
+            return profile
+        if not is_locked:
+            break
+    return await api_profile_async.get_profile_read(profile_tgid)
+
 async def set_cache_profile(profile_tgid: int | None, json_profile: str) -> str:
-    """Добавляет обьект в кэш"""
-    await redis.setex(profile_tgid, settings.TTL, json_profile)
-    return "Ok"
-
-async def serialization_profile(profile_obj: Profile) -> str:
-    """Сериализует обьект пользователя в строку json"""
-    profile_dict = profile_obj.to_dict()
-    json_profile = json.dumps(profile_dict)
-    return json_profile
-
-async def deserialization_profile(cache_value_profile: str) -> Profile:
-    """Десериализует строку пользователя в обьект Profile"""
-    profile_data = json.loads(cache_value_profile)
-    tariff = Tariff(**profile_data['tariffs'])
-    ai_models_id = AiModel(**profile_data['ai_models_id'])
-    profile_data['tariffs'] = tariff
-    profile_data['ai_models_id'] = ai_models_id
-    profile = Profile(**profile_data)
-    return profile
\ No newline at end of file
+    """Добавляет обьект в кэш и сбрасывает его локальные копии во всех процессах"""
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.setex(profile_tgid, settings.TTL, json_profile)
+        pipe.publish(CACHE_INVALIDATION_CHANNEL, f"profile:{profile_tgid}")
+        await pipe.execute()
+    profile_local_cache.pop(profile_tgid)
+    return "Ok"
+
+async def delete_cache_profiles(profile_tgids: list[int], chunk_size: int = 1000) -> int:
+    """Удаляет обьекты пользователей из кэша одним пайплайном"""
+    if not profile_tgids:
+        return 0
+    async with redis.pipeline(transaction=False) as pipe:
+        for i in range(0, len(profile_tgids), chunk_size):
+            pipe.delete(*profile_tgids[i:i + chunk_size])
+        for profile_tgid in profile_tgids:
+            pipe.publish(CACHE_INVALIDATION_CHANNEL, f"profile:{profile_tgid}")
+        result = await pipe.execute()
+    for profile_tgid in profile_tgids:
+        profile_local_cache.pop(profile_tgid)
+    return sum(result[:-len(profile_tgids)])
+
+async def get_cache_tariff(tariff_id: int) -> TariffRead | None:
+    """Получает тариф из локального кэша, а при промахе из бд"""
+    tariff = tariff_local_cache.get(tariff_id)
+    if tariff is None:
+        tariff = await api_tariff_async.get_tariff_read(tariff_id)
+        if tariff is not None:
+            tariff_local_cache.set(tariff_id, tariff)
+    return tariff
+
+async def get_cache_ai_models() -> dict[str, AiModelRead]:
+    """Получает все модели нейронок из локального кэша, а при промахе из бд"""
+    ai_models = ai_model_local_cache.get("all")
+    if ai_models is None:
+        ai_models = await api_ai_model_async.get_all_ai_model_reads()
+        ai_model_local_cache.set("all", ai_models)
+    return ai_models
+
+async def get_session_id(profile: ProfileRead, model: str) -> int:
+    """Получи id сессии чата пользователя с моделью из локального кэша или redis, а при промахе создай ее в бд"""
+    key = f"{profile.tgid}:{model}"
+    session_id = session_local_cache.get(key)
+    if session_id is not None:
+        return session_id
+    cache_key = CHAT_SESSION_KEY.format(tgid=profile.tgid, model=model)
+    cache_value = await redis.get(cache_key)
+    if cache_value is not None:
+        session_id = int(cache_value)
+    else:
+        session_id = (await api_chat_session_async.get_or_create_session_ref(profile.id, model)).id
+        await redis.setex(cache_key, CHAT_SESSION_TTL, session_id)
+    session_local_cache.set(key, session_id)
+    return session_id
+
+async def delete_cache_session(profile_tgid: int, model: str) -> str:
+    """Удали id сессии из кэша во всех процессах. Вызывается после удаления сессии (сброса контекста)"""
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.delete(CHAT_SESSION_KEY.format(tgid=profile_tgid, model=model))
+        pipe.publish(CACHE_INVALIDATION_CHANNEL, f"session:{profile_tgid}:{model}")
+        await pipe.execute()
+    session_local_cache.pop(f"{profile_tgid}:{model}")
+    return "Ok"
+
+async def reset_session(session_id: int, profile: ProfileRead | Profile) -> str:
+    """Сбрось контекст: удали сессию в бд, создай новую и удали id старой сессии и ее историю из кэша"""
+    result = await api_chat_session_async.delete_context_from_session(session_id, profile)
+    await delete_cache_session(profile.tgid, profile.ai_model_id)
+    await delete_context_cache(session_id)
+    return result
+
+async def resolve_ref_link_id(link: str) -> int | None:
+    """Получи id реферальной ссылки по коду из локального кэша или redis, а при промахе из бд"""
+    link_id = ref_link_local_cache.get(link)
+    if link_id is not None:
+        return link_id or None
+    cache_key = REF_LINK_ID_KEY.format(link)
+    cache_value = await redis.get(cache_key)
+    if cache_value is not None:
+        link_id = int(cache_value) if cache_value else _REF_LINK_MISSING
+    else:
+        link_id = await api_ref_link_async.get_ref_link_id(link) or _REF_LINK_MISSING
+        await redis.setex(cache_key, REF_LINK_ID_TTL if link_id else REF_LINK_MISSING_TTL, link_id or "")
+    ref_link_local_cache.set(link, link_id, ttl=None if link_id else REF_LINK_MISSING_TTL)
+    return link_id or None
+
+async def delete_cache_ref_link(link: str) -> str:
+    """Удали код ссылки из кэша во всех процессах, например после создания ссылки с ранее неизвестным кодом"""
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.delete(REF_LINK_ID_KEY.format(link))
+        pipe.publish(CACHE_INVALIDATION_CHANNEL, f"ref_link:{link}")
+        await pipe.execute()
+    ref_link_local_cache.pop(link)
+    return "Ok"
+
+async def create_ref_link(name_link: str, owner_id: UUID) -> RefLink:
+    """Создай реферальную ссылку и сбрось закэшированный промах по ее коду.
+
+    Код берется из последовательности, и переход по нему мог закэшировать "не найдено" до создания ссылки.
+    """
+    ref_link = await api_ref_link_async.create_ref_link(name_link, owner_id)
+    await delete_cache_ref_link(ref_link.link)
+    return ref_link
+
+async def publish_cache_invalidation(kind: str, key: int | str) -> str:
+    """Сбрось локальные копии обьекта ('profile', 'tariff', 'ai_model' или 'session') во всех процессах"""
+    await redis.publish(CACHE_INVALIDATION_CHANNEL, f"{kind}:{key}")
+    return "Ok"
+
+def _apply_invalidation(message: str):
+    """Удали обьект из локального кэша по сообщению из канала инвалидации"""
+    kind, _, key = message.partition(":")
+    local_cache = _local_caches.get(kind)
+    if local_cache is None:
+        return
+    local_cache.pop(int(key) if key.lstrip("-").isdigit() else key)
+
+async def listen_cache_invalidation():
+    """Слушай канал инвалидации и сбрасывай локальный кэш. Запускается фоновой задачей в каждом процессе бота"""
+    pubsub = redis.pubsub()
+    await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+    try:
+        async for message in pubsub.listen():
+            if message["type"] == "message":
+                _apply_invalidation(message["data"])
+    finally:
+        await pubsub.unsubscribe(CACHE_INVALIDATION_CHANNEL)
+        await pubsub.close()
+
+def get_local_cache_stats() -> dict:
+    """Получи статистику попаданий, промахов и вытеснений локальных кэшей"""
+    return {kind: local_cache.get_stats() for kind, local_cache in _local_caches.items()}
+
+def _to_timestamp(value: datetime | None) -> int | None:
+    return None if value is None else int((value - _EPOCH).total_seconds())
+
+def _from_timestamp(value: int | None) -> datetime | None:
+    return None if value is None else _EPOCH + timedelta(seconds=value)
+
+def encode_profile(profile_obj: Profile | ProfileRead) -> str:
+    """Закодируй пользователя в компактную строку: байт версии схемы и массив полей PROFILE_CACHE_FIELDS
+
+    Тариф и модель хранятся только по id и восстанавливаются из реестра.
+    """
+    values = []
+    for field in PROFILE_CACHE_FIELDS:
+        value = getattr(profile_obj, field)
+        if field == "id":
+            value = str(value)
+        elif field == "date_subscription":
+            value = _to_timestamp(value)
+        elif field == "limits_reset_date":
+            value = value.toordinal() if value else None
+        values.append(value)
+    return PROFILE_CACHE_VERSION + json.dumps(values, separators=(",", ":"), ensure_ascii=False)
+
+async def decode_profile(cache_value_profile: str) -> ProfileRead | None:
+    """Раскодируй строку из encode_profile. Вернет None для записей другой версии схемы"""
+    if not cache_value_profile or cache_value_profile[0] != PROFILE_CACHE_VERSION:
+        return None
+    profile_data = dict(zip(PROFILE_CACHE_FIELDS, json.loads(cache_value_profile[1:])))
+    profile_data["id"] = UUID(profile_data["id"])
+    profile_data["date_subscription"] = _from_timestamp(profile_data["date_subscription"])
+    if profile_data["limits_reset_date"] is not None:
+        profile_data["limits_reset_date"] = date.fromordinal(profile_data["limits_reset_date"])
+    profile_data["tariffs"] = await get_cache_tariff(profile_data["tariff_id"]) if profile_data["tariff_id"] else None
+    profile_data["ai_models_id"] = (await get_cache_ai_models()).get(profile_data["ai_model_id"])
+    return ProfileRead(**profile_data)
+
+async def serialization_profile(profile_obj: Profile | ProfileRead) -> str:
+    """Сериализует обьект пользователя в компактную строку кэша"""
+    return encode_profile(profile_obj)
+
+async def deserialization_profile(cache_value_profile: str) -> ProfileRead | None:
+    """Десериализует строку пользователя в обьект ProfileRead. Вернет None для записей старой схемы"""
+    return await decode_profile(cache_value_profile)
+
+def _msk_day_bounds() -> tuple[str, int]:
+    """Верни текущую дату по мск и unix-время ее окончания"""
+    current_time = datetime.utcnow() + timedelta(hours=3)
+    end_of_day = current_time.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1, hours=-3)
+    return current_time.date().isoformat(), _to_timestamp(end_of_day)
+
+def get_daily_limit(profile: ProfileRead, model_id: str) -> int:
+    """Получи остаток дневного лимита модели по профилю (-1 безлимит)
+
+    Если лимиты профиля еще не обновлены на текущие сутки (ночная задача не прошла или кэш профиля устарел),
+    берется лимит тарифа, а не вчерашний остаток.
+    """
+    column = QUOTA_COLUMNS[model_id]
+    value = getattr(profile, column.key)
+    if profile.tariffs is not None and api_profile_async.limits_outdated(profile):
+        value = getattr(profile.tariffs, TARIFF_LIMIT_COLUMNS[column].key)
+    if value == -1:
+        return -1
+    return max(value or 0, 0)
+
+async def spend_quota(profile: ProfileRead, model_id: str, add_request: bool = False) -> QuotaSpend:
+    """Проверь лимит и спиши запрос к модели в redis без записи в бд
+
+    Списания копятся в хэше quota:pending:<сутки> и сбрасываются в бд через flush_quota.
+    """
+    day, expire_at = _msk_day_bounds()
+    column = QUOTA_COLUMNS[model_id]
+    is_spent, remaining = await _SPEND_QUOTA_SCRIPT(
+        keys=[QUOTA_LEFT_KEY.format(day=day, tgid=profile.tgid, model=model_id),
+              QUOTA_PENDING_KEY.format(day=day)],
+        args=[
+            get_daily_limit(profile, model_id),
+            expire_at,
+            f"{profile.id}:{column.key}",
+            f"{profile.id}:count_request" if add_request else "",
+            expire_at + QUOTA_PENDING_KEEP_DAYS * 24 * 60 * 60,
+        ],
+    )
+    if not is_spent:
+        return QuotaSpend(is_spent=False)
+    return QuotaSpend(is_spent=True, remaining=remaining)
+
+async def add_request_count(profile: ProfileRead) -> str:
+    """Прибавь запрос пользователю в redis без записи в бд"""
+    day, expire_at = _msk_day_bounds()
+    key = QUOTA_PENDING_KEY.format(day=day)
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hincrby(key, f"{profile.id}:count_request", 1)
+        pipe.expireat(key, expire_at + QUOTA_PENDING_KEEP_DAYS * 24 * 60 * 60)
+        await pipe.execute()
+    return "Ok"
+
+async def get_quota_left(profile: ProfileRead, model_id: str) -> int | None:
+    """Получи остаток лимита модели на текущие сутки в redis или None, если сегодня списаний еще не было"""
+    day, _ = _msk_day_bounds()
+    left = await redis.get(QUOTA_LEFT_KEY.format(day=day, tgid=profile.tgid, model=model_id))
+    return None if left is None else int(left)
+
+async def reset_quota_left(profile_tgid: int | None = None) -> str:
+    """Удали остатки лимитов пользователя за сутки, без profile_tgid - всех пользователей. Вызывается после
+    начисления лимитов в бд: следующее списание заведет остаток из профиля заново"""
+    day, _ = _msk_day_bounds()
+    if profile_tgid is not None:
+        keys = [QUOTA_LEFT_KEY.format(day=day, tgid=profile_tgid, model=model) for model in QUOTA_COLUMNS]
+        await redis.delete(*keys)
+        return "Ok"
+    keys = []
+    async for key in redis.scan_iter(match=QUOTA_LEFT_KEY.format(day=day, tgid="*", model="*"), count=1000):
+        keys.append(key)
+        if len(keys) >= 1000:
+            await redis.unlink(*keys)
+            keys = []
+    if keys:
+        await redis.unlink(*keys)
+    return "Ok"
+
+async def flush_quota() -> int:
+    """Сбрось накопленные списания лимитов и запросов в бд. Вернет кол-во обновленных пользователей
+
+    Списания каждых суток сбрасываются отдельно: если лимиты пользователя уже обновлены на следующие сутки,
+    вчерашние списания из них не вычитаются.
+    """
+    today = date.fromisoformat(_msk_day_bounds()[0])
+    updated = 0
+    for offset in range(QUOTA_PENDING_KEEP_DAYS, -1, -1):
+        day = today - timedelta(days=offset)
+        key = QUOTA_PENDING_KEY.format(day=day.isoformat())
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hgetall(key)
+            pipe.delete(key)
+            pending, _ = await pipe.execute()
+        if not pending:
+            continue
+        deltas = {}
+        for field_key, value in pending.items():
+            profile_id, field = field_key.split(":")
+            counters = deltas.setdefault(profile_id, {})
+            counters[field] = counters.get(field, 0) + int(value)
+        try:
+            await api_profile_async.apply_quota_deltas(deltas, day)
+        except Exception:
+            # Возвращаем списания в хэш, чтобы не потерять их при ошибке бд
+            async with redis.pipeline(transaction=True) as pipe:
+                for field_key, value in pending.items():
+                    pipe.hincrby(key, field_key, int(value))
+                await pipe.execute()
+            raise
+        updated += len(deltas)
+    return updated
@@ -0,0 +1,114 @@
+"""Контекст диалога с текстовой моделью, ограниченный бюджетом токенов.
+
+В модель уходят только последние пары вопрос-ответ сессии: не больше CONTEXT_MAX_TURNS и не больше
+бюджета токенов модели (CONTEXT_TOKENS_* в настройках). Последние CONTEXT_CACHE_TURNS пар хранятся в redis,
+поэтому следующие сообщения диалога обычно не обращаются к бд. Более старые пары догружаются из бд постранично по created_at.
+После сохранения ответа модели (save_message) добавьте пару в кэш через push_context_turn.
+"""
+
+import json
+import math
+from datetime import datetime
+
+from config import settings
+from db_api import api_chat_session_async
+from services import redis
+from utils.enum import AiModelName
+
+CONTEXT_CACHE_KEY = "chat_context:{}"
+# Грубая оценка без токенизатора: для русского и английского текста с запасом
+CHARS_PER_TOKEN = 3
+# Бюджет токенов истории диалога по моделям из настроек, без учета нового сообщения и ответа
+CONTEXT_TOKEN_BUDGET = {
+    AiModelName.GPT_4_O.value: settings.CONTEXT_TOKENS_GPT_4O,
+    AiModelName.GPT_4_O_MINI.value: settings.CONTEXT_TOKENS_GPT_4O_MINI,
+    AiModelName.GPT_O1_PREVIEW.value: settings.CONTEXT_TOKENS_O1_PREVIEW,
+    AiModelName.GPT_O1_MINI.value: settings.CONTEXT_TOKENS_O1_MINI,
+}
+
+
+def count_tokens(text: str) -> int:
+    """Оцени кол-во токенов в тексте"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def _encode_turn(query: str, answer: str, created_at: datetime) -> str:
+    """Пара вопрос-ответ для списка в redis"""
+    return json.dumps([query, answer, created_at.isoformat()], ensure_ascii=False)
+
+def _decode_turn(value: str) -> tuple[str, str, datetime]:
+    """Пара вопрос-ответ из списка в redis"""
+    query, answer, created_at = json.loads(value)
+    return query, answer, datetime.fromisoformat(created_at)
+
+async def _get_cached_turns(session_id: int) -> list[tuple[str, str, datetime]] | None:
+    """Пары из redis от старых к новым или None, если кэша нет"""
+    values = await redis.lrange(CONTEXT_CACHE_KEY.format(session_id), 0, -1)
+    if not values:
+        return None
+    return [_decode_turn(value) for value in values]
+
+async def _set_cached_turns(session_id: int, turns: list[tuple[str, str, datetime]]) -> str:
+    """Запиши последние пары в redis от старых к новым"""
+    key = CONTEXT_CACHE_KEY.format(session_id)
+    turns = turns[-settings.CONTEXT_CACHE_TURNS:]
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.delete(key)
+        if turns:
+            pipe.rpush(key, *(_encode_turn(*turn) for turn in turns))
+            pipe.expire(key, settings.CONTEXT_CACHE_TTL)
+        await pipe.execute()
+    return "Ok"
+
+async def push_context_turn(session_id: int, query: str, answer: str, created_at: datetime) -> str:
+    """Добавь завершенную пару в кэш контекста. Пустой кэш не создается: он заполнится при следующем чтении"""
+    key = CONTEXT_CACHE_KEY.format(session_id)
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.rpushx(key, _encode_turn(query, answer, created_at))
+        pipe.ltrim(key, -settings.CONTEXT_CACHE_TURNS, -1)
+        pipe.expire(key, settings.CONTEXT_CACHE_TTL)
+        await pipe.execute()
+    return "Ok"
+
+async def delete_context_cache(session_id: int) -> str:
+    """Удали кэш контекста сессии"""
+    await redis.delete(CONTEXT_CACHE_KEY.format(session_id))
+    return "Ok"
+
+def _fit_budget(turns: list[tuple[str, str, datetime]], budget: int) -> tuple[list, bool]:
+    """Оставь самые новые пары, которые помещаются в бюджет. Второе значение - бюджет исчерпан"""
+    fitted, used = [], 0
+    for query, answer, created_at in reversed(turns):
+        cost = count_tokens(query) + count_tokens(answer)
+        if used + cost > budget or len(fitted) >= settings.CONTEXT_MAX_TURNS:
+            return fitted[::-1], True
+        fitted.append((query, answer, created_at))
+        used += cost
+    return fitted[::-1], False
+
+async def get_context_messages(session_id: int, name_ai_model: str) -> list[dict[str, str]]:
+    """Верни сообщения истории диалога для модели в пределах бюджета токенов, от старых к новым"""
+    budget = CONTEXT_TOKEN_BUDGET.get(name_ai_model, settings.CONTEXT_TOKENS_DEFAULT)
+    turns = await _get_cached_turns(session_id)
+    if turns is None:
+        rows = await api_chat_session_async.get_last_turns(session_id, settings.CONTEXT_CACHE_TURNS)
+        turns = [tuple(row) for row in reversed(rows)]
+        await _set_cached_turns(session_id, turns)
+        complete = len(rows) < settings.CONTEXT_CACHE_TURNS
+    else:
+        # Неполный список в кэше означает, что более старых пар в сессии нет
+        complete = len(turns) < settings.CONTEXT_CACHE_TURNS
+    turns, exhausted = _fit_budget(turns, budget)
+
+    # Догружаем более старые пары из бд, пока есть бюджет и лимит пар
+    while not exhausted and not complete and turns and len(turns) < settings.CONTEXT_MAX_TURNS:
+        page_size = settings.CONTEXT_MAX_TURNS - len(turns)
+        rows = await api_chat_session_async.get_last_turns(session_id, page_size, before=turns[0][2])
+        older = [tuple(row) for row in reversed(rows)]
+        complete = len(rows) < page_size
+        turns, exhausted = _fit_budget(older + turns, budget)
+
+    messages = []
+    for query, answer, _ in turns:
+        messages.append({"role": "user", "content": query})
+        messages.append({"role": "assistant", "content": answer})
+    return messages
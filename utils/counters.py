@@ -0,0 +1,99 @@
+"""Буферизованные счетчики статистики реферальных ссылок.
+
+Приращения копятся в redis (хэш на ссылку) и периодически сбрасываются в бд атомарными
+UPDATE ... SET col = col + n через flush_ref_counters.
+"""
+
+from db_api import api_ref_link_async
+from db_api.models import RefLink
+from db_api.schemas import RefLinkStat
+from services import redis
+from utils.cache import resolve_ref_link_id
+from utils.enum import PaymentName
+
+REF_COUNTERS_KEY = "ref_counters:{}"
+REF_COUNTERS_DIRTY_KEY = "ref_counters:dirty"
+REF_COUNTER_FIELDS = ("count_clicks", "count_new_users", "count_buys", "sum_buys_rub", "sum_buys_stars")
+
+
+async def incr_ref_counter(link_id: int, field: str, amount: int = 1) -> str:
+    """Прибавь значение к счетчику ссылки в буфере redis"""
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hincrby(REF_COUNTERS_KEY.format(link_id), field, amount)
+        pipe.sadd(REF_COUNTERS_DIRTY_KEY, link_id)
+        await pipe.execute()
+    return "Ok"
+
+async def add_click(link: str) -> int | None:
+    """Прибавь переход по ссылке. Вернет id ссылки или None, если ссылки нет"""
+    link_id = await resolve_ref_link_id(link)
+    if link_id is None:
+        return None
+    await incr_ref_counter(link_id, "count_clicks")
+    return link_id
+
+async def add_count_new_users(link_id: int) -> str:
+    """Прибавь новую регистрацию по ссылке"""
+    return await incr_ref_counter(link_id, "count_new_users")
+
+async def add_count_buy(link_id: int) -> str:
+    """Прибавь покупку по ссылке"""
+    return await incr_ref_counter(link_id, "count_buys")
+
+async def add_sum_buy(link_id: int, sum_buy: int, category: str) -> str:
+    """Прибавь сумму покупки по ссылке"""
+    field = "sum_buys_stars" if category == PaymentName.STARS.value else "sum_buys_rub"
+    return await incr_ref_counter(link_id, field, sum_buy)
+
+async def get_pending_ref_counters(link_id: int) -> dict[str, int]:
+    """Получи приращения счетчиков ссылки, которые еще не сброшены в бд"""
+    pending = await redis.hgetall(REF_COUNTERS_KEY.format(link_id))
+    return {field: int(pending.get(field, 0)) for field in REF_COUNTER_FIELDS}
+
+async def get_ref_link_stats(ref_link: RefLink) -> dict[str, int]:
+    """Получи счетчики ссылки: значение из бд плюс еще не сброшенные приращения"""
+    pending = await get_pending_ref_counters(ref_link.id)
+    return {field: (getattr(ref_link, field) or 0) + pending[field] for field in REF_COUNTER_FIELDS}
+
+async def get_ref_links_stats(limit: int | None = None, offset: int = 0, owner_id=None) -> list[RefLinkStat]:
+    """Получи статистику страницы ссылок одним запросом в бд и одним пайплайном к буферу redis"""
+    stats = await api_ref_link_async.get_ref_links_stats(limit=limit, offset=offset, owner_id=owner_id)
+    if not stats:
+        return stats
+    async with redis.pipeline(transaction=False) as pipe:
+        for stat in stats:
+            pipe.hmget(REF_COUNTERS_KEY.format(stat.id), "count_clicks", "count_new_users")
+        pending = await pipe.execute()
+    return [
+        stat._replace(total_clicks=stat.total_clicks + int(clicks or 0),
+                      new_registrations=stat.new_registrations + int(new_users or 0))
+        for stat, (clicks, new_users) in zip(stats, pending)
+    ]
+
+async def flush_ref_counters(batch_size: int = 500) -> int:
+    """Сбрось накопленные приращения в бд. Вернет кол-во обработанных ссылок"""
+    link_ids = await redis.spop(REF_COUNTERS_DIRTY_KEY, batch_size)
+    if not link_ids:
+        return 0
+    async with redis.pipeline(transaction=True) as pipe:
+        for link_id in link_ids:
+            pipe.hgetall(REF_COUNTERS_KEY.format(link_id))
+            pipe.delete(REF_COUNTERS_KEY.format(link_id))
+        result = await pipe.execute()
+    deltas = {
+        int(link_id): {field: int(value) for field, value in counters.items()}
+        for link_id, counters in zip(link_ids, result[::2])
+        if counters
+    }
+    try:
+        await api_ref_link_async.apply_counter_deltas(deltas)
+    except Exception:
+        # Возвращаем приращения в буфер, чтобы не потерять их при ошибке бд
+        async with redis.pipeline(transaction=True) as pipe:
+            for link_id, counters in deltas.items():
+                for field, value in counters.items():
+                    pipe.hincrby(REF_COUNTERS_KEY.format(link_id), field, value)
+                pipe.sadd(REF_COUNTERS_DIRTY_KEY, link_id)
+            await pipe.execute()
+        raise
+    return len(link_ids)
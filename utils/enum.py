@@ -322,6 +322,25 @@ class PaymentName(Enum):
     ROBOKASSA = "robokassa"
 
 
+class PaymentStatus(Enum):
+    """Класс с результатами обработки оплаты"""
+    PAID = "paid"
+    ALREADY_PAID = "already_paid"
+    NOT_FOUND = "not_found"
+
+
+class OutboxKind(Enum):
+    """Класс с типами событий outbox"""
+    PAYMENT = "payment"
+
+
+class ChargeStatus(Enum):
+    """Класс с результатами запроса на рекуррентное списание"""
+    SENT = "sent"
+    REJECTED = "rejected"
+    FAILED = "failed"
+
+
 class Errors(Enum):
     """Класс с ошибками"""
     ERROR_ACTIVE_GENERATE = 'You have already activated generation. Wait for it to complete.'
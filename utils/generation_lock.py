@@ -0,0 +1,119 @@
+"""Блокировка генерации в сессии чата через redis вместо флага ChatSession.active_generation.
+
+Блокировка ставится SET NX PX с токеном владельца и продлевается фоновой задачей, пока идет генерация.
+Если процесс упал, блокировка сама снимается по истечении GENERATION_LOCK_TTL_MS.
+
+    async with GenerationLock(session_id) as acquired:
+        if not acquired:
+            return Errors.ERROR_ACTIVE_GENERATE.value
+        ...
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, asdict
+from uuid import uuid4
+
+from services import redis, logger
+from utils.cache import RELEASE_LOCK_SCRIPT
+
+GENERATION_LOCK_KEY = "lock:generation:{}"
+GENERATION_LOCK_TTL_MS = 30000
+GENERATION_LOCK_POLL_SECONDS = 0.1
+
+# Продление блокировки только ее владельцем. KEYS: ключ блокировки, ARGV: токен владельца, TTL.
+# Удаление - общим скриптом RELEASE_LOCK_SCRIPT из utils.cache
+_RENEW_LOCK_SCRIPT = redis.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+""")
+
+
+@dataclass
+class GenerationLockStats:
+    """Статистика блокировок генерации в процессе"""
+    acquired: int = 0
+    rejected: int = 0
+    waited: int = 0
+    wait_seconds: float = 0.0
+    lost: int = 0
+
+
+generation_lock_stats = GenerationLockStats()
+
+
+class GenerationLock:
+    """Блокировка одновременных генераций в одной сессии чата
+
+    wait - сколько секунд ждать завершения чужой генерации, 0 - сразу отказать.
+    """
+
+    def __init__(self, session_id: int, wait: float = 0, ttl_ms: int = GENERATION_LOCK_TTL_MS):
+        self.key = GENERATION_LOCK_KEY.format(session_id)
+        self.wait = wait
+        self.ttl_ms = ttl_ms
+        self.token = uuid4().hex
+        self.acquired = False
+        self._heartbeat: asyncio.Task | None = None
+
+    async def acquire(self) -> bool:
+        """Поставь блокировку, при необходимости дождавшись освобождения"""
+        start = time.monotonic()
+        deadline = start + self.wait
+        waited = False
+        while True:
+            if await redis.set(self.key, self.token, nx=True, px=self.ttl_ms):
+                break
+            if time.monotonic() >= deadline:
+                generation_lock_stats.rejected += 1
+                return False
+            waited = True
+            await asyncio.sleep(GENERATION_LOCK_POLL_SECONDS)
+        if waited:
+            generation_lock_stats.waited += 1
+            generation_lock_stats.wait_seconds += time.monotonic() - start
+        generation_lock_stats.acquired += 1
+        self.acquired = True
+        self._heartbeat = asyncio.create_task(self._renew())
+        return True
+
+    async def _renew(self):
+        """Продлевай блокировку каждую треть TTL, пока она принадлежит этому владельцу"""
+        while True:
+            await asyncio.sleep(self.ttl_ms / 3000)
+            try:
+                renewed = await _RENEW_LOCK_SCRIPT(keys=[self.key], args=[self.token, self.ttl_ms])
+            except Exception as e:
+                logger.error(f"Generation lock renew failed | {self.key} | {e}")
+                continue
+            if not renewed:
+                generation_lock_stats.lost += 1
+                logger.error(f"Generation lock lost | {self.key}")
+                return
+
+    async def release(self):
+        """Сними блокировку, если она еще принадлежит этому владельцу"""
+        if not self.acquired:
+            return
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        self.acquired = False
+        await RELEASE_LOCK_SCRIPT(keys=[self.key], args=[self.token])
+
+    async def __aenter__(self) -> bool:
+        return await self.acquire()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.release()
+
+
+async def is_generation_active(session_id: int) -> bool:
+    """Проверь, идет ли генерация в сессии"""
+    return bool(await redis.exists(GENERATION_LOCK_KEY.format(session_id)))
+
+def get_generation_lock_stats() -> dict:
+    """Получи статистику захвата, ожидания и отказов блокировок генерации"""
+    return asdict(generation_lock_stats)
@@ -0,0 +1,66 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+
+
+@dataclass
+class LocalCacheStats:
+    """Статистика работы локального кэша"""
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+
+
+class LocalCache:
+    """Ограниченный по размеру LRU кэш в памяти процесса с временем жизни записей"""
+
+    _missing = object()
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stats = LocalCacheStats()
+        self._data: OrderedDict = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Получи значение по ключу или default, если его нет или оно устарело"""
+        item = self._data.get(key, self._missing)
+        if item is self._missing:
+            self.stats.misses += 1
+            return default
+        expire_at, value = item
+        if expire_at < time.monotonic():
+            del self._data[key]
+            self.stats.expirations += 1
+            self.stats.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.stats.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float | None = None):
+        """Положи значение в кэш, вытеснив самое старое при переполнении"""
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.stats.evictions += 1
+
+    def pop(self, key):
+        """Удали значение из кэша"""
+        if self._data.pop(key, self._missing) is not self._missing:
+            self.stats.invalidations += 1
+
+    def clear(self):
+        """Очисти кэш"""
+        self.stats.invalidations += len(self._data)
+        self._data.clear()
+
+    def get_stats(self) -> dict:
+        """Верни статистику и текущий размер кэша"""
+        return {**asdict(self.stats), "size": len(self._data), "maxsize": self.maxsize}